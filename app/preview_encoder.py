@@ -0,0 +1,116 @@
+import concurrent.futures
+import logging
+import struct
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Type numbers in the header of binary preview messages
+PREVIEW_TYPES = {"JPEG": 1, "PNG": 2, "WEBP": 3}
+
+
+def encode_preview(image_data, image_format=None, quality=80, max_size=None):
+    """
+    Encodes an (image_type, PIL image, max_size) preview into the bytes of a PREVIEW_IMAGE
+    message: a 4 byte image type followed by the encoded image. image_format and max_size
+    override what the sender asked for.
+    """
+    image_type, image, requested_size = image_data[0], image_data[1], image_data[2]
+    image_format = image_format or image_type
+    if image_format not in PREVIEW_TYPES:
+        image_format = "JPEG"
+    size = requested_size
+    if max_size is not None:
+        size = max_size if size is None else min(size, max_size)
+    if size is not None:
+        if hasattr(Image, 'Resampling'):
+            resampling = Image.Resampling.BILINEAR
+        else:
+            resampling = Image.ANTIALIAS
+        image = ImageOps.contain(image, (size, size), resampling)
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    bytesIO = BytesIO()
+    bytesIO.write(struct.pack(">I", PREVIEW_TYPES[image_format]))
+    if image_format == "PNG":
+        image.save(bytesIO, format="PNG", compress_level=1)
+    else:
+        image.save(bytesIO, format=image_format, quality=quality)
+    return bytesIO.getvalue()
+
+
+class PreviewEncoder:
+    """
+    Encodes sampler previews on a small thread pool instead of the event loop. Each target
+    (a client id, or None for a broadcast) has at most one frame being encoded and one waiting;
+    a newer frame replaces the waiting one, so a lagging encoder skips frames instead of
+    falling further behind. Frames are only accepted when a client would receive them and at
+    most max_fps times per second per target.
+    """
+    def __init__(self, deliver, has_subscribers, workers=2, image_format=None, quality=80, max_size=None, max_fps=10):
+        self.deliver = deliver
+        self.has_subscribers = has_subscribers
+        self.image_format = image_format
+        self.quality = quality
+        self.max_size = max_size
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="preview_encoder")
+        self.lock = threading.Lock()
+        self.busy = set()
+        self.waiting = {}
+        self.last_accepted = {}
+        self.stats = {"encoded": 0, "dropped": 0, "rate_limited": 0, "no_subscribers": 0, "errors": 0, "encode_time": 0.0}
+
+    def wants_preview(self, sid=None):
+        """Whether a frame for sid would be used right now. Callers can skip decoding the preview otherwise."""
+        if not self.has_subscribers(sid):
+            with self.lock:
+                self.stats["no_subscribers"] += 1
+            return False
+        with self.lock:
+            if time.perf_counter() - self.last_accepted.get(sid, 0.0) < self.min_interval:
+                self.stats["rate_limited"] += 1
+                return False
+        return True
+
+    def submit(self, image_data, sid=None):
+        if not self.wants_preview(sid):
+            return False
+        with self.lock:
+            self.last_accepted[sid] = time.perf_counter()
+            if sid in self.busy:
+                if sid in self.waiting:
+                    self.stats["dropped"] += 1
+                self.waiting[sid] = image_data
+                return True
+            self.busy.add(sid)
+        self.pool.submit(self._encode_loop, sid, image_data)
+        return True
+
+    def _encode_loop(self, sid, image_data):
+        while image_data is not None:
+            try:
+                start = time.perf_counter()
+                message = encode_preview(image_data, self.image_format, self.quality, self.max_size)
+                with self.lock:
+                    self.stats["encoded"] += 1
+                    self.stats["encode_time"] += time.perf_counter() - start
+                self.deliver(message, sid)
+            except Exception as e:
+                logging.warning("Preview encoding failed: {}".format(e))
+                with self.lock:
+                    self.stats["errors"] += 1
+            with self.lock:
+                image_data = self.waiting.pop(sid, None)
+                if image_data is None:
+                    self.busy.discard(sid)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["average_encode_ms"] = stats.pop("encode_time") * 1000 / max(stats["encoded"], 1)
+        stats.update(format=self.image_format, quality=self.quality, max_size=self.max_size,
+                     max_fps=1.0 / self.min_interval if self.min_interval > 0 else 0)
+        return stats
@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import itertools
+import json
+import logging
+
+import aiohttp
+
+PREVIEW_KEY = ("preview",)
+
+SEND_ERRORS = (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError, RuntimeError)
+
+
+class OutgoingMessage:
+    """A message encoded once and shared by every client it is sent to."""
+    __slots__ = ("payload", "binary", "key", "droppable")
+
+    def __init__(self, payload, binary, key=None, droppable=False):
+        self.payload = payload
+        self.binary = binary
+        self.key = key
+        self.droppable = droppable
+
+
+class ClientChannel:
+    """
+    The outgoing queue of one websocket, drained by its own sender task so a slow client only
+    delays itself. Messages with a coalescing key replace the queued message with the same key
+    and move to the back of the queue. When the queue is full the oldest droppable message
+    (progress, previews) goes first. A client whose queue is full of messages that can't be
+    dropped has fallen too far behind and is disconnected, as is a client a send fails for.
+    on_close(channel) is called once the channel stopped.
+    """
+    def __init__(self, sid, ws, max_queue, previews=True, on_close=None):
+        self.sid = sid
+        self.ws = ws
+        self.max_queue = max_queue
+        self.previews = previews
+        self.on_close = on_close
+        self.closed = False
+        self.queue = collections.OrderedDict()
+        self.sequence = itertools.count()
+        self.ready = asyncio.Event()
+        self.task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.disconnected = 0
+
+    def put(self, message):
+        if self.closed:
+            return
+        if message.key is not None and message.key in self.queue:
+            del self.queue[message.key]
+            self.coalesced += 1
+        elif len(self.queue) >= self.max_queue and not self._drop_one():
+            # Dropping an executing/executed message would leave the client with a wrong state
+            logging.warning("websocket client {} fell {} messages behind, disconnecting it".format(self.sid, len(self.queue)))
+            self.disconnected += 1
+            self.close()
+            return
+        self.queue[message.key if message.key is not None else next(self.sequence)] = message
+        self.ready.set()
+
+    def _drop_one(self):
+        victim = next((key for key, message in self.queue.items() if message.droppable), None)
+        if victim is None:
+            return False
+        del self.queue[victim]
+        self.dropped += 1
+        return True
+
+    def close(self):
+        """Stops sending. The sender task closes the socket and calls on_close."""
+        self.closed = True
+        self.queue.clear()
+        self.ready.set()
+
+    async def run(self):
+        while not self.closed:
+            await self.ready.wait()
+            if self.closed:
+                break
+            if len(self.queue) == 0:
+                self.ready.clear()
+                continue
+            _, message = self.queue.popitem(last=False)
+            try:
+                if message.binary:
+                    await self.ws.send_bytes(message.payload)
+                else:
+                    await self.ws.send_str(message.payload)
+                self.sent += 1
+            except SEND_ERRORS as err:
+                self.errors += 1
+                logging.warning("send error: {}".format(err))
+                self.close()
+        try:
+            await self.ws.close()
+        except SEND_ERRORS as err:
+            logging.debug("websocket close error: {}".format(err))
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def get_stats(self):
+        return {"queued": len(self.queue), "previews": self.previews, "sent": self.sent, "coalesced": self.coalesced, "dropped": self.dropped, "errors": self.errors, "disconnected": self.disconnected}
+
+
+class WebSocketFanout:
+    """
+    Delivers server events to connected websockets. Each message is encoded once, then queued
+    on every target client's bounded channel, and the channels send concurrently. Superseded
+    progress, preview and status messages are coalesced so clients that fall behind only get
+    the latest one. Clients that opted out of previews are skipped when publishing them, and
+    clients that fell too far behind or failed a send are removed.
+    """
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self.channels = {}
+        self.totals = {"sent": 0, "coalesced": 0, "dropped": 0, "errors": 0, "disconnected": 0}
+
+    def add(self, sid, ws, previews=True):
+        self.remove(sid)
+        channel = ClientChannel(sid, ws, self.max_queue, previews, on_close=lambda channel: self.remove(channel.sid, channel.ws))
+        channel.task = asyncio.get_running_loop().create_task(channel.run())
+        self.channels[sid] = channel
+        return channel
+
+    def remove(self, sid, ws=None):
+        channel = self.channels.get(sid, None)
+        if channel is None or (ws is not None and channel.ws is not ws):
+            return
+        del self.channels[sid]
+        if channel.task is not asyncio.current_task():
+            channel.task.cancel()
+        for name in self.totals:
+            self.totals[name] += getattr(channel, name)
+
+    def publish(self, message, sid=None):
+        preview = message.key == PREVIEW_KEY
+        if sid is None:
+            for channel in list(self.channels.values()):
+                if channel.previews or not preview:
+                    channel.put(message)
+        elif sid in self.channels and (self.channels[sid].previews or not preview):
+            self.channels[sid].put(message)
+
+    def has_preview_subscribers(self, sid=None):
+        """Whether a preview published to sid (or broadcast when None) would reach any client."""
+        if sid is None:
+            return any(channel.previews for channel in list(self.channels.values()))
+        channel = self.channels.get(sid, None)
+        return channel is not None and channel.previews
+
+    def publish_json(self, event, data, sid=None):
+        key = json_coalesce_key(event, data)
+        self.publish(OutgoingMessage(json.dumps({"type": event, "data": data}), False, key=key, droppable=key is not None), sid)
+
+    def publish_bytes(self, message, key=None, sid=None):
+        self.publish(OutgoingMessage(message, True, key=key, droppable=key == PREVIEW_KEY), sid)
+
+    def get_stats(self):
+        clients = {sid: channel.get_stats() for sid, channel in self.channels.items()}
+        totals = dict(self.totals)
+        for stats in clients.values():
+            for name in totals:
+                totals[name] += stats[name]
+        return dict(totals, connected=len(clients), max_queue=self.max_queue, clients=clients)
+
+
+def json_coalesce_key(event, data):
+    """Messages that only carry the latest state can replace an older queued one with the same key."""
+    if not isinstance(data, dict):
+        return None
+    if event == "progress":
+        return ("progress", data.get("prompt_id"), data.get("node"))
+    if event == "status" and "sid" not in data:
+        # The first status message carries the client's sid and must not be replaced
+        return ("status",)
+    return None
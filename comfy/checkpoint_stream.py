@@ -0,0 +1,179 @@
+"""
+    This file is part of ComfyUI.
+    Copyright (C) 2024 Comfy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import queue
+import threading
+
+import torch
+
+import comfy.utils
+
+CHUNK_SIZE = 64 * 1024 * 1024
+READ_AHEAD = 4
+# Gaps between the tensors of one read up to this size are read through instead of seeking
+MAX_GAP = 1024 * 1024
+
+
+def plan_reads(items, chunk_size=CHUNK_SIZE, max_gap=MAX_GAP):
+    """
+    Groups (offset, nbytes, element_size, ...) items into sequential reads of at most chunk_size
+    bytes, splitting tensors larger than a read on element boundaries. Reads start at multiples
+    of 8 bytes so the tensors in them stay aligned. Yields (file offset, length, pieces), each
+    piece being (position in the read, nbytes, first element, item).
+    """
+    start = end = None
+    pieces = []
+    for item in sorted(items, key=lambda i: i[0]):
+        offset, nbytes, element_size = item[0], item[1], item[2]
+        done = 0
+        while done < nbytes:
+            position = offset + done
+            if start is not None and (position - end > max_gap or position + element_size - start > chunk_size):
+                yield start, end - start, pieces
+                start = None
+            if start is None:
+                start = position - position % 8
+                pieces = []
+            length = min(nbytes - done, (start + chunk_size - position) // element_size * element_size)
+            pieces.append((position - start, length, done // element_size, item))
+            done += length
+            end = position + length
+    if start is not None:
+        yield start, end - start, pieces
+
+
+class ChunkReader:
+    """
+    Reads the planned chunks of one file on a background thread into a fixed set of staging
+    buffers, so reading the next chunks overlaps with copying the current one and at most
+    read_ahead chunks are in memory at any time.
+    """
+    def __init__(self, path, plan, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD, pin_memory=False):
+        self.path = path
+        self.plan = plan
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        self.stopped = False
+        for _ in range(max(read_ahead, 1)):
+            buffer = torch.empty((chunk_size + 8,), dtype=torch.uint8)
+            if pin_memory:
+                buffer = buffer.pin_memory()
+            self.free.put((buffer, None))
+        self.thread = threading.Thread(target=self._read, daemon=True, name="checkpoint_reader")
+        self.thread.start()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb", buffering=0) as f:
+                for start, length, pieces in self.plan:
+                    buffer, event = self.free.get()
+                    if self.stopped:
+                        return
+                    if event is not None:
+                        event.synchronize()
+                    view = memoryview(buffer.numpy())[:length]
+                    f.seek(start)
+                    read = 0
+                    while read < length:
+                        n = f.readinto(view[read:])
+                        if not n:
+                            raise EOFError("Unexpected end of file while reading {}".format(self.path))
+                        read += n
+                    self.ready.put((buffer, pieces))
+            self.ready.put(None)
+        except Exception as e:
+            self.ready.put(e)
+
+    def __iter__(self):
+        while True:
+            item = self.ready.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def release(self, buffer, event=None):
+        self.free.put((buffer, event))
+
+    def stop(self):
+        self.stopped = True
+        self.free.put((None, None))
+        self.thread.join()
+
+
+def stream_file(path, items, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD):
+    """
+    Copies tensors stored in path into their targets. items are (file offset, nbytes,
+    element_size, source dtype, target) where target is a contiguous tensor of the same shape;
+    the data is cast to the target's dtype and moved to its device as part of the copy.
+    """
+    cuda = any(item[4].device.type == "cuda" for item in items)
+    reader = ChunkReader(path, plan_reads(items, chunk_size), chunk_size, read_ahead, pin_memory=cuda)
+    try:
+        for buffer, pieces in reader:
+            for position, nbytes, first, (_, _, element_size, dtype, target) in pieces:
+                source = buffer[position:position + nbytes]
+                try:
+                    source = source.view(dtype)
+                except RuntimeError:  # not aligned to the element size
+                    source = source.clone().view(dtype)
+                target.view(-1)[first:first + source.numel()].copy_(source, non_blocking=cuda)
+            event = None
+            if cuda:
+                event = torch.cuda.Event()
+                event.record()
+            reader.release(buffer, event)
+    finally:
+        reader.stop()
+    if cuda:
+        torch.cuda.synchronize()
+
+
+def load_state_dict_streaming(module, state_dict, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD, pin_memory=False):
+    """
+    Like module.load_state_dict(state_dict, strict=False) but tensors that are views into a file
+    mapped by comfy.utils.load_torch_file are read from the file in large sequential chunks and
+    written straight into the module's already allocated parameters and buffers, on whatever
+    device and in whatever dtype they have. With pin_memory the module's CPU parameters are
+    moved to pinned memory first so later transfers to the GPU are faster. Everything else goes
+    through load_state_dict. Returns (missing_keys, unexpected_keys).
+    """
+    if pin_memory and torch.cuda.is_available():
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if tensor.device.type == "cpu" and not tensor.is_pinned():
+                tensor.data = tensor.data.pin_memory()
+
+    targets = module.state_dict(keep_vars=True)
+    files = {}
+    rest = {}
+    for k, v in state_dict.items():
+        target = targets.get(k, None)
+        location = comfy.utils.mapped_file_location(v) if target is not None else None
+        if location is None or target.shape != v.shape or not target.is_contiguous() or not v.is_contiguous() or v.numel() == 0:
+            rest[k] = v
+            continue
+        files.setdefault(location[0], []).append((location[1], v.numel() * v.element_size(), v.element_size(), v.dtype, target.data))
+
+    streamed = set(k for k in state_dict.keys() if k not in rest)
+    with torch.no_grad():
+        for path, items in files.items():
+            stream_file(path, items, chunk_size, read_ahead)
+
+    missing, unexpected = module.load_state_dict(rest, strict=False)
+    return [k for k in missing if k not in streamed], unexpected
@@ -96,10 +96,36 @@ class LatentPreviewMethod(enum.Enum):
 parser.add_argument("--preview-method", type=LatentPreviewMethod, default=LatentPreviewMethod.NoPreviews, help="Default preview method for sampler nodes.", action=EnumAction)
 
 parser.add_argument("--preview-size", type=int, default=512, help="Sets the maximum preview size for sampler nodes.")
+parser.add_argument("--preview-format", type=str.upper, default=None, choices=["JPEG", "WEBP", "PNG"], help="Image format used for sampler previews sent to clients. By default the format requested by the previewer (JPEG) is used.")
+parser.add_argument("--preview-quality", type=int, default=80, metavar="QUALITY", help="Encoding quality (1-100) of JPEG and WEBP previews.")
+parser.add_argument("--preview-max-fps", type=float, default=10.0, metavar="FPS", help="Maximum number of previews sent to each client per second, extra previews are not decoded. 0 disables the limit.")
+parser.add_argument("--preview-encode-workers", type=int, default=2, metavar="N", help="Number of threads encoding previews. A frame that arrives while the previous one is still being encoded replaces any older waiting frame.")
 
 cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
+cache_group.add_argument("--cache-ram-gb", type=float, default=0, metavar="GB", help="Use size aware caching that keeps cached node outputs within this many GB of RAM. Entries are evicted by recency, recompute cost and size.")
+parser.add_argument("--cache-vram-gb", type=float, default=0, metavar="GB", help="Like --cache-ram-gb but for tensors and model weights cached on the GPU. Can be combined with --cache-ram-gb but not with the other cache options.")
+parser.add_argument("--cache-disk-directory", type=str, default=None, metavar="PATH", help="Enable a persistent on-disk cache for tensor and conditioning outputs of deterministic nodes in this directory. It survives restarts and /free.")
+parser.add_argument("--cache-disk-gb", type=float, default=10.0, metavar="GB", help="Maximum size of the on-disk node output cache.")
+
+parser.add_argument("--node-state-ram-gb", type=float, default=0, metavar="GB", help="Keep the outputs of persistent nodes within this many GB of RAM. Least recently used outputs are spilled to --node-state-spill-directory or dropped and recomputed on next use. 0 means unlimited.")
+parser.add_argument("--node-state-vram-gb", type=float, default=0, metavar="GB", help="Keep tensors held by persistent node outputs within this many GB of VRAM by moving the least recently used ones to the CPU. 0 means unlimited.")
+parser.add_argument("--node-state-ttl", type=float, default=0, metavar="SECONDS", help="Spill or drop persistent node outputs that have not been used for this many seconds. 0 disables it.")
+parser.add_argument("--node-state-spill-directory", type=str, default=None, metavar="PATH", help="Directory where persistent node outputs made of tensors are written when they are evicted from memory.")
+
+parser.add_argument("--preload-nodes", action="store_true", help="Register the nodes in preload_nodes.json as persistent nodes and execute them in the background at startup.")
+parser.add_argument("--preload-workers", type=int, default=4, metavar="N", help="Number of persistent nodes that are preloaded at the same time. Independent loaders read from disk concurrently.")
+
+parser.add_argument("--ws-queue-size", type=int, default=256, metavar="N", help="Maximum number of messages queued for each websocket client. Older progress and preview messages are dropped when a client falls behind, a client that is still full after that is disconnected.")
+
+parser.add_argument("--prefetch-models", type=int, default=0, metavar="N", help="Load the model files of the next N queued prompts in the background while the current prompt runs. 0 disables prefetching.")
+parser.add_argument("--prefetch-ram-gb", type=float, default=8.0, metavar="GB", help="Maximum size of the model files held by the prefetcher.")
+parser.add_argument("--prefetch-pinned", action="store_true", help="Read prefetched safetensors files into pinned memory so copying them to the GPU is faster. Uses page locked RAM.")
+parser.add_argument("--history-db", type=str, default=None, metavar="PATH", help="Keep the prompt history in this SQLite file so it survives restarts. By default the history is kept in memory.")
+
+parser.add_argument("--parallel-execution", type=int, default=0, metavar="N", help="Run independent branches of a prompt concurrently. Nodes marked as cpu or io bound run on a pool of N threads while GPU nodes still execute one at a time. 0 disables it.")
+parser.add_argument("--worker-devices", type=str, nargs="+", default=None, metavar="DEVICE", help="Run one prompt worker per listed device (for example: --worker-devices cuda:0 cuda:1). Workers share the queue and history and each keeps its own cache. With more than one worker, prompts are preferably dispatched to the worker that recently used the same models.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -128,7 +154,12 @@ parser.add_argument("--reserve-vram", type=float, default=None, help="Set the am
 
 parser.add_argument("--default-hashing-function", type=str, choices=['md5', 'sha1', 'sha256', 'sha512'], default='sha256', help="Allows you to choose the hash function to use for duplicate filename / contents comparison. Default is sha256.")
 
+parser.add_argument("--eviction-policy", type=str, default="legacy", choices=["legacy", "cost"], help="How models are picked for unloading when memory runs out. legacy uses the original order, cost unloads the unreferenced models that are cheapest to reload and least used first.")
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
+parser.add_argument("--mmap-checkpoints", action="store_true", help="Memory map safetensors files loaded on the CPU instead of reading them fully into memory. Weights are only read from the file when they are used and their pages can be dropped again by the OS.")
+parser.add_argument("--weight-store-files", type=int, default=0, metavar="N", help="Number of checkpoint files kept loaded after every loader using them is done, so loading them again is free. The default 0 releases a file as soon as nothing uses it.")
+parser.add_argument("--weight-store-ram-gb", type=float, default=0.0, metavar="GB", help="RAM the files kept by --weight-store-files may use when they were read into memory. Memory mapped files don't count against it.")
+parser.add_argument("--pin-model-weights", action="store_true", help="Keep diffusion model weights loaded to the CPU in pinned memory so moving them to the GPU is faster. Uses page locked RAM.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
 class PerformanceFeature(enum.Enum):
@@ -192,6 +223,10 @@ if comfy.options.args_parsing:
 else:
     args = parser.parse_args([])
 
+# Size aware caching can have both budgets, so --cache-vram-gb can't be in cache_group itself
+if args.cache_vram_gb > 0 and (args.cache_classic or args.cache_lru > 0):
+    parser.error("argument --cache-vram-gb: not allowed with argument --cache-classic or --cache-lru")
+
 if args.windows_standalone_build:
     args.auto_launch = True
 
@@ -0,0 +1,241 @@
+"""
+Eviction policies for comfy.model_management.free_memory.
+
+free_memory turns every model it may unload into an EvictionCandidate and unloads them in the
+order the current policy returns until enough memory is free. Each decision is reported to the
+registered event hooks as a dict. simulate() replays a trace of load requests against a fake
+device with a fixed amount of memory so policies can be compared without a GPU.
+"""
+import logging
+import time
+import weakref
+
+# Decayed use counts halve after this many seconds without a use
+USAGE_HALF_LIFE = 600.0
+
+
+class ModelUsage:
+    """How often a model was requested recently, as a use count that decays over time."""
+    __slots__ = ("uses", "last_used", "count")
+
+    def __init__(self):
+        self.uses = 0
+        self.last_used = None
+        self.count = 0.0
+
+    def frequency(self, now):
+        if self.last_used is None:
+            return 0.0
+        return self.count * 0.5 ** (max(now - self.last_used, 0.0) / USAGE_HALF_LIFE)
+
+    def record(self, now):
+        self.count = self.frequency(now) + 1.0
+        self.last_used = now
+        self.uses += 1
+
+
+model_usage = weakref.WeakKeyDictionary()  # torch module -> ModelUsage
+
+
+def usage_for(model):
+    """The usage record of a ModelPatcher, shared by all its clones."""
+    key = getattr(model, "model", model)
+    usage = model_usage.get(key, None)
+    if usage is None:
+        usage = ModelUsage()
+        model_usage[key] = usage
+    return usage
+
+
+def record_use(model, now=None):
+    usage_for(model).record(time.time() if now is None else now)
+
+
+class EvictionCandidate:
+    """
+    A model free_memory may unload. source is where its weights come back from when it is needed
+    again: "ram" when unloading moves them to the offload device, "disk" when they are gone.
+    partial tells if part of the model can be unloaded instead of all of it.
+    """
+    __slots__ = ("index", "name", "model_memory", "loaded_memory", "refcount", "source", "partial", "usage", "score")
+
+    def __init__(self, index, name, model_memory, loaded_memory, refcount=0, source="ram", partial=True, usage=None):
+        self.index = index
+        self.name = name
+        self.model_memory = model_memory
+        self.loaded_memory = loaded_memory
+        self.refcount = refcount
+        self.source = source
+        self.partial = partial
+        self.usage = usage if usage is not None else ModelUsage()
+        self.score = None
+
+    @property
+    def offloaded_memory(self):
+        return self.model_memory - self.loaded_memory
+
+    @classmethod
+    def from_loaded_model(cls, loaded_model, index, refcount):
+        model = loaded_model.model
+        source = "ram" if model.offload_device != loaded_model.device else "disk"
+        return cls(index, model.model.__class__.__name__, loaded_model.model_memory(), loaded_model.model_loaded_memory(),
+                   refcount=refcount, source=source, partial=True, usage=usage_for(model))
+
+
+class EvictionPolicy:
+    name = "base"
+
+    def order(self, candidates, memory_to_free, now=None):
+        """Returns the candidates in the order they should be unloaded. memory_to_free is None when everything may go."""
+        raise NotImplementedError
+
+
+class LegacyPolicy(EvictionPolicy):
+    """The original order: partially offloaded models first, then the least referenced and smallest."""
+    name = "legacy"
+
+    def order(self, candidates, memory_to_free, now=None):
+        return sorted(candidates, key=lambda c: (-c.offloaded_memory, c.refcount, c.model_memory, c.index))
+
+
+class CostAwarePolicy(EvictionPolicy):
+    """
+    Unloads the models that are cheapest to get back first. A candidate's score is the time it
+    would take to reload what unloading it frees, from RAM or from disk, weighted by how often
+    it was used recently. A model that can be partially unloaded only loses what is missing, so
+    a large model that can give up part of its weights often scores below a small one that
+    would have to go completely. Like the legacy order, less referenced models still go first.
+    """
+    name = "cost"
+
+    def __init__(self, ram_bandwidth=8e9, disk_bandwidth=1e9):
+        self.ram_bandwidth = ram_bandwidth
+        self.disk_bandwidth = disk_bandwidth
+
+    def reload_bytes(self, candidate, memory_to_free):
+        if candidate.partial and memory_to_free is not None:
+            return min(candidate.loaded_memory, max(memory_to_free, 0))
+        return candidate.loaded_memory
+
+    def score(self, candidate, memory_to_free, now):
+        bandwidth = self.ram_bandwidth if candidate.source == "ram" else self.disk_bandwidth
+        reload_time = self.reload_bytes(candidate, memory_to_free) / bandwidth
+        return reload_time * (1.0 + candidate.usage.frequency(now))
+
+    def order(self, candidates, memory_to_free, now=None):
+        now = time.time() if now is None else now
+        for c in candidates:
+            c.score = self.score(c, memory_to_free, now)
+        return sorted(candidates, key=lambda c: (c.refcount, c.score, -c.offloaded_memory, c.index))
+
+
+POLICIES = {
+    "cost": CostAwarePolicy,
+    "legacy": LegacyPolicy,
+}
+
+current_policy = LegacyPolicy()
+
+
+def get_policy():
+    return current_policy
+
+
+def set_policy(policy):
+    """Replaces the policy free_memory uses, either a name from POLICIES or an EvictionPolicy."""
+    global current_policy
+    if isinstance(policy, str):
+        policy = POLICIES[policy]()
+    current_policy = policy
+
+
+event_hooks = []
+
+
+def register_event_hook(hook):
+    """hook(event) is called with a dict for every eviction decision."""
+    if hook not in event_hooks:
+        event_hooks.append(hook)
+
+
+def emit(event, **data):
+    record = dict(data, event=event, time=time.time())
+    for hook in event_hooks:
+        try:
+            hook(record)
+        except Exception as e:
+            logging.warning(f"eviction event hook failed: {e}")
+
+
+def log_event(record):
+    logging.debug("eviction: {}".format(record))
+
+
+register_event_hook(log_event)
+
+
+class SimulatedModel:
+    __slots__ = ("name", "size", "loaded", "source", "partial", "usage")
+
+    def __init__(self, name, size, source="ram", partial=True):
+        self.name = name
+        self.size = size
+        self.loaded = 0
+        self.source = source
+        self.partial = partial
+        self.usage = ModelUsage()
+
+
+def simulate(policy, trace, device_memory, ram_bandwidth=8e9, disk_bandwidth=1e9, on_event=None):
+    """
+    Replays load requests on a fake device with device_memory bytes. Every request is a dict with
+    "model", "size" and optionally "source" ("ram" or "disk"), "partial" and "time" (seconds,
+    defaults to the request's position in the trace). Loading what is missing of a model costs
+    bytes / bandwidth of its source. Returns totals to compare policies by.
+    """
+    models = {}
+    result = {"policy": policy.name, "requests": 0, "hits": 0, "bytes_loaded": 0, "load_seconds": 0.0, "unloads": 0, "partial_unloads": 0, "lowvram_loads": 0}
+    for step, request in enumerate(trace):
+        now = request.get("time", float(step))
+        model = models.get(request["model"], None)
+        if model is None:
+            model = SimulatedModel(request["model"], request["size"], request.get("source", "ram"), request.get("partial", True))
+            models[model.name] = model
+        model.usage.record(now)
+        result["requests"] += 1
+        needed = model.size - model.loaded
+        if needed == 0:
+            result["hits"] += 1
+            continue
+
+        free = device_memory - sum(m.loaded for m in models.values())
+        if free < needed:
+            others = [m for m in models.values() if m is not model and m.loaded > 0]
+            candidates = [EvictionCandidate(i, m.name, m.size, m.loaded, source=m.source, partial=m.partial, usage=m.usage) for i, m in enumerate(others)]
+            for candidate in policy.order(candidates, needed - free, now=now):
+                if free >= needed:
+                    break
+                victim = others[candidate.index]
+                to_free = needed - free
+                if victim.partial and to_free < victim.loaded:
+                    victim.loaded -= to_free
+                    free += to_free
+                    result["partial_unloads"] += 1
+                    event = "partial_unload"
+                    freed = to_free
+                else:
+                    freed = victim.loaded
+                    free += victim.loaded
+                    victim.loaded = 0
+                    result["unloads"] += 1
+                    event = "unload"
+                if on_event is not None:
+                    on_event(dict(event=event, model=victim.name, score=candidate.score, freed=freed, time=now))
+
+        load = min(needed, max(free, 0))
+        if load < needed:
+            result["lowvram_loads"] += 1
+        model.loaded += load
+        result["bytes_loaded"] += load
+        result["load_seconds"] += load / (ram_bandwidth if model.source == "ram" else disk_bandwidth)
+    return result
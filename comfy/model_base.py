@@ -42,6 +42,8 @@ import comfy.model_management
 import comfy.patcher_extension
 import comfy.conds
 import comfy.ops
+import comfy.checkpoint_stream
+from comfy.cli_args import args
 from enum import Enum
 from . import utils
 import comfy.latent_formats
@@ -264,7 +266,7 @@ class BaseModel(torch.nn.Module):
                 to_load[k[len(unet_prefix):]] = sd.pop(k)
 
         to_load = self.model_config.process_unet_state_dict(to_load)
-        m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
+        m, u = comfy.checkpoint_stream.load_state_dict_streaming(self.diffusion_model, to_load, pin_memory=args.pin_model_weights)
         if len(m) > 0:
             logging.warning("unet missing: {}".format(m))
 
@@ -25,6 +25,8 @@ import sys
 import platform
 import weakref
 import gc
+import threading
+import comfy.eviction
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -145,6 +147,19 @@ def get_torch_device():
         else:
             return torch.device(torch.cuda.current_device())
 
+def set_current_thread_device(device):
+    # CUDA and XPU track the current device per thread, so a worker thread can be pinned
+    # to its own GPU and get_torch_device() will return it.
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    elif device.type == "xpu":
+        torch.xpu.set_device(device)
+    elif device.type == "npu":
+        torch.npu.set_device(device)
+    elif device.type == "mlu":
+        torch.mlu.set_device(device)
+
 def get_total_memory(dev=None, torch_total_too=False):
     global directml_enabled
     if dev is None:
@@ -360,6 +375,20 @@ except:
 
 current_loaded_models = []
 
+# Several prompt workers can load and unload models at the same time. model_management_lock
+# guards current_loaded_models, the per device locks keep freeing memory on a device and
+# loading weights into it together without blocking loads on other devices.
+model_management_lock = threading.RLock()
+device_locks = {}
+
+def device_lock(device):
+    with model_management_lock:
+        lock = device_locks.get(device, None)
+        if lock is None:
+            lock = threading.RLock()
+            device_locks[device] = lock
+        return lock
+
 def module_size(module):
     module_mem = 0
     sd = module.state_dict()
@@ -487,117 +516,155 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
-def free_memory(memory_required, device, keep_loaded=[]):
-    cleanup_models_gc()
-    unloaded_model = []
-    can_unload = []
-    unloaded_models = []
-
-    for i in range(len(current_loaded_models) -1, -1, -1):
-        shift_model = current_loaded_models[i]
-        if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
-                shift_model.currently_used = False
-
-    for x in sorted(can_unload):
-        i = x[-1]
-        memory_to_free = None
-        if not DISABLE_SMART_MEMORY:
-            free_mem = get_free_memory(device)
-            if free_mem > memory_required:
-                break
-            memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
-            unloaded_model.append(i)
+comfy.eviction.set_policy(args.eviction_policy)
 
-    for i in sorted(unloaded_model, reverse=True):
-        unloaded_models.append(current_loaded_models.pop(i))
+# Called as callback(bytes_needed, device) before models are unloaded so other holders of
+# device memory (like persistent node outputs) can give it back first. Returns the bytes freed.
+free_memory_callbacks = []
 
-    if len(unloaded_model) > 0:
-        soft_empty_cache()
-    else:
-        if vram_state != VRAMState.HIGH_VRAM:
-            mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
-            if mem_free_torch > mem_free_total * 0.25:
-                soft_empty_cache()
-    return unloaded_models
+def register_free_memory_callback(callback):
+    if callback not in free_memory_callbacks:
+        free_memory_callbacks.append(callback)
 
-def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    cleanup_models_gc()
-    global vram_state
-
-    inference_memory = minimum_inference_memory()
-    extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
-    if minimum_memory_required is None:
-        minimum_memory_required = extra_mem
-    else:
-        minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
-
-    models = set(models)
-
-    models_to_load = []
+def free_memory(memory_required, device, keep_loaded=[]):
+    with device_lock(device), model_management_lock:
+        cleanup_models_gc()
+        if len(free_memory_callbacks) > 0:
+            missing = memory_required if DISABLE_SMART_MEMORY else memory_required - get_free_memory(device)
+            freed = 0
+            for callback in free_memory_callbacks:
+                if freed >= missing:
+                    break
+                try:
+                    freed += callback(missing - freed, device) or 0
+                except Exception as e:
+                    logging.warning(f"free_memory callback failed: {e}")
+            if freed > 0:
+                soft_empty_cache()
+        unloaded_model = []
+        can_unload = []
+        unloaded_models = []
+
+        for i in range(len(current_loaded_models) -1, -1, -1):
+            shift_model = current_loaded_models[i]
+            if shift_model.device == device:
+                if shift_model not in keep_loaded and not shift_model.is_dead():
+                    can_unload.append(comfy.eviction.EvictionCandidate.from_loaded_model(shift_model, i, sys.getrefcount(shift_model.model)))
+                    shift_model.currently_used = False
+
+        policy = comfy.eviction.get_policy()
+        missing = None if DISABLE_SMART_MEMORY else memory_required - get_free_memory(device)
+        if len(can_unload) > 0 and (missing is None or missing > 0):
+            comfy.eviction.emit("free_memory", device=str(device), memory_required=memory_required, memory_to_free=missing, policy=policy.name, candidates=len(can_unload))
+        for candidate in policy.order(can_unload, missing):
+            i = candidate.index
+            memory_to_free = None
+            if not DISABLE_SMART_MEMORY:
+                free_mem = get_free_memory(device)
+                if free_mem > memory_required:
+                    break
+                memory_to_free = memory_required - free_mem
+            logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+            loaded_before = candidate.loaded_memory
+            if current_loaded_models[i].model_unload(memory_to_free):
+                unloaded_model.append(i)
+                comfy.eviction.emit("unload", model=candidate.name, device=str(device), score=candidate.score, source=candidate.source, freed=loaded_before)
+            else:
+                comfy.eviction.emit("partial_unload", model=candidate.name, device=str(device), score=candidate.score, source=candidate.source,
+                                    freed=loaded_before - current_loaded_models[i].model_loaded_memory())
 
-    for x in models:
-        loaded_model = LoadedModel(x)
-        try:
-            loaded_model_index = current_loaded_models.index(loaded_model)
-        except:
-            loaded_model_index = None
+        for i in sorted(unloaded_model, reverse=True):
+            unloaded_models.append(current_loaded_models.pop(i))
 
-        if loaded_model_index is not None:
-            loaded = current_loaded_models[loaded_model_index]
-            loaded.currently_used = True
-            models_to_load.append(loaded)
+        if len(unloaded_model) > 0:
+            soft_empty_cache()
         else:
-            if hasattr(x, "model"):
-                logging.info(f"Requested to load {x.model.__class__.__name__}")
-            models_to_load.append(loaded_model)
+            if vram_state != VRAMState.HIGH_VRAM:
+                mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
+                if mem_free_torch > mem_free_total * 0.25:
+                    soft_empty_cache()
+        return unloaded_models
 
-    for loaded_model in models_to_load:
-        to_unload = []
-        for i in range(len(current_loaded_models)):
-            if loaded_model.model.is_clone(current_loaded_models[i].model):
-                to_unload = [i] + to_unload
-        for i in to_unload:
-            current_loaded_models.pop(i).model.detach(unpatch_all=False)
+def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
+    with model_management_lock:
+        cleanup_models_gc()
+        global vram_state
+
+        inference_memory = minimum_inference_memory()
+        extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
+        if minimum_memory_required is None:
+            minimum_memory_required = extra_mem
+        else:
+            minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
 
-    total_memory_required = {}
-    for loaded_model in models_to_load:
-        total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
+        models = set(models)
+        for x in models:
+            comfy.eviction.record_use(x)
 
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
+        models_to_load = []
 
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_mem = get_free_memory(device)
-            if free_mem < minimum_memory_required:
-                models_l = free_memory(minimum_memory_required, device)
-                logging.info("{} models unloaded.".format(len(models_l)))
+        for x in models:
+            loaded_model = LoadedModel(x)
+            try:
+                loaded_model_index = current_loaded_models.index(loaded_model)
+            except:
+                loaded_model_index = None
 
+            if loaded_model_index is not None:
+                loaded = current_loaded_models[loaded_model_index]
+                loaded.currently_used = True
+                models_to_load.append(loaded)
+            else:
+                if hasattr(x, "model"):
+                    logging.info(f"Requested to load {x.model.__class__.__name__}")
+                models_to_load.append(loaded_model)
+
+        for loaded_model in models_to_load:
+            to_unload = []
+            for i in range(len(current_loaded_models)):
+                if loaded_model.model.is_clone(current_loaded_models[i].model):
+                    to_unload = [i] + to_unload
+            for i in to_unload:
+                current_loaded_models.pop(i).model.detach(unpatch_all=False)
+
+    models_by_device = {}
     for loaded_model in models_to_load:
-        model = loaded_model.model
-        torch_dev = model.load_device
-        if is_device_cpu(torch_dev):
-            vram_set_state = VRAMState.DISABLED
-        else:
-            vram_set_state = vram_state
-        lowvram_model_memory = 0
-        if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
-            loaded_memory = loaded_model.model_loaded_memory()
-            current_free_mem = get_free_memory(torch_dev) + loaded_memory
-
-            lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
-            lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
-
-        if vram_set_state == VRAMState.NO_VRAM:
-            lowvram_model_memory = 0.1
-
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
-        current_loaded_models.insert(0, loaded_model)
+        models_by_device.setdefault(loaded_model.device, []).append(loaded_model)
+
+    # Weights are moved without holding model_management_lock, other devices can load at the same time
+    for device, device_models in models_by_device.items():
+        with device_lock(device):
+            if device != torch.device("cpu"):
+                total_memory_required = sum(loaded_model.model_memory_required(device) for loaded_model in device_models)
+                free_memory(total_memory_required * 1.1 + extra_mem, device)
+                free_mem = get_free_memory(device)
+                if free_mem < minimum_memory_required:
+                    models_l = free_memory(minimum_memory_required, device)
+                    logging.info("{} models unloaded.".format(len(models_l)))
+
+            for loaded_model in device_models:
+                model = loaded_model.model
+                torch_dev = model.load_device
+                if is_device_cpu(torch_dev):
+                    vram_set_state = VRAMState.DISABLED
+                else:
+                    vram_set_state = vram_state
+                lowvram_model_memory = 0
+                if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
+                    loaded_memory = loaded_model.model_loaded_memory()
+                    current_free_mem = get_free_memory(torch_dev) + loaded_memory
+
+                    lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
+                    lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
+
+                if vram_set_state == VRAMState.NO_VRAM:
+                    lowvram_model_memory = 0.1
+
+                loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+                with model_management_lock:
+                    if loaded_model in current_loaded_models:
+                        current_loaded_models.remove(loaded_model)
+                    current_loaded_models.insert(0, loaded_model)
     return
 
 def load_model_gpu(model):
@@ -1228,23 +1295,44 @@ class InterruptProcessingException(Exception):
 
 interrupt_processing_mutex = threading.RLock()
 
-interrupt_processing = False
-def interrupt_current_processing(value=True):
-    global interrupt_processing
-    global interrupt_processing_mutex
+class InterruptFlag:
+    """The interrupt state of one prompt worker, threads bound to the worker check it."""
+    def __init__(self):
+        self.value = False
+
+# Checked by threads that aren't bound to a worker
+default_interrupt_flag = InterruptFlag()
+interrupt_flags = [default_interrupt_flag]
+interrupt_local = threading.local()
+
+def register_interrupt_flag():
+    flag = InterruptFlag()
+    with interrupt_processing_mutex:
+        interrupt_flags.append(flag)
+    return flag
+
+def bind_interrupt_flag(flag):
+    """Makes the calling thread check and set flag, None unbinds it."""
+    interrupt_local.flag = flag
+
+def current_interrupt_flag():
+    return getattr(interrupt_local, "flag", None) or default_interrupt_flag
+
+def interrupt_current_processing(value=True, flag=None):
+    # Called from a thread bound to a worker only that worker is affected, from any other thread all of them
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        if flag is None:
+            flag = getattr(interrupt_local, "flag", None)
+        for f in (interrupt_flags if flag is None else [flag]):
+            f.value = value
 
 def processing_interrupted():
-    global interrupt_processing
-    global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        return interrupt_processing
+        return current_interrupt_flag().value
 
 def throw_exception_if_processing_interrupted():
-    global interrupt_processing
-    global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        if interrupt_processing:
-            interrupt_processing = False
+        flag = current_interrupt_flag()
+        if flag.value:
+            flag.value = False
             raise InterruptProcessingException()
@@ -9,7 +9,18 @@ def prepare_noise(latent_image, seed, noise_inds=None):
     """
     creates random noise given a latent image and a seed.
     optional arg skip can be used to skip and discard x number of noise generations for a given seed
+    seed can also be a list of [seed, count] pairs (fused batches), each generating the noise for
+    the next count elements of the batch as if they had been sampled on their own.
     """
+    if isinstance(seed, (list, tuple)):
+        noises = []
+        offset = 0
+        for s, count in seed:
+            inds = noise_inds[offset:offset + count] if noise_inds is not None else None
+            noises.append(prepare_noise(latent_image[offset:offset + count], s, inds))
+            offset += count
+        return torch.cat(noises, dim=0)
+
     generator = torch.manual_seed(seed)
     if noise_inds is None:
         return torch.randn(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
@@ -20,7 +20,13 @@
 import torch
 import math
 import struct
+import json
+import mmap
+import os
+import sys
+import weakref
 import comfy.checkpoint_pickle
+import comfy.weight_store
 import safetensors.torch
 import numpy as np
 from PIL import Image
@@ -28,6 +34,7 @@ import logging
 import itertools
 from torch.nn.functional import interpolate
 from einops import rearrange
+from comfy.cli_args import args
 
 ALWAYS_SAFE_LOAD = False
 if hasattr(torch.serialization, "add_safe_globals"):  # TODO: this was added in pytorch 2.4, the unsafe path should be removed once earlier versions are deprecated
@@ -46,18 +53,109 @@ if hasattr(torch.serialization, "add_safe_globals"):  # TODO: this was added in
 else:
     logging.info("Warning, you are using an old pytorch version and some ckpt/pt files might be loaded unsafely. Upgrading to 2.4 or above is recommended.")
 
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+if hasattr(torch, "float8_e4m3fn"):
+    SAFETENSORS_DTYPES["F8_E4M3"] = torch.float8_e4m3fn
+    SAFETENSORS_DTYPES["F8_E5M2"] = torch.float8_e5m2
+
+mapped_files = {}  # address of a mapping made by load_safetensors_mmap -> path of the file
+
+def mapped_file_location(tensor):
+    """(path, byte offset) of a tensor that is a view into a file mapped by load_safetensors_mmap, otherwise None."""
+    storage = tensor.untyped_storage()
+    path = mapped_files.get(storage.data_ptr(), None)
+    if path is None:
+        return None
+    return path, tensor.data_ptr() - storage.data_ptr()
+
+def safetensors_state_dict(data):
+    """Parses a safetensors file held in a uint8 tensor, returns (state_dict, metadata) with tensors that are views into data."""
+    header_size = struct.unpack("<Q", data[:8].numpy().tobytes())[0]
+    header = json.loads(data[8:8 + header_size].numpy().tobytes())
+    metadata = header.pop("__metadata__", None)
+    start = 8 + header_size
+    sd = {}
+    for k, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if begin == end:
+            sd[k] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        t = data[start + begin:start + end]
+        try:
+            t = t.view(dtype)
+        except RuntimeError:  # views need the data aligned to the element size
+            t = t.clone().view(dtype)
+        sd[k] = t.reshape(info["shape"])
+    return sd, metadata
+
+def load_safetensors_mmap(ckpt):
+    """
+    Memory maps a safetensors file and returns (state_dict, metadata). The state dict is a plain
+    dict but every tensor is a view into the mapping: nothing is read until the tensor's data is
+    used (for example copied into a model), the pages are file backed so the OS can drop them
+    again, and the mapping is closed once the last tensor referencing it is freed. The mapping
+    is copy on write so in place changes never reach the file.
+    """
+    with open(ckpt, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data = torch.frombuffer(mapped, dtype=torch.uint8)
+    mapped_files[data.data_ptr()] = ckpt
+    weakref.finalize(mapped, mapped_files.pop, data.data_ptr(), None)
+    return safetensors_state_dict(data)
+
+def load_safetensors_pinned(ckpt, chunk_size=64 * 1024 * 1024):
+    """Reads a whole safetensors file into one page locked buffer, returns (state_dict, metadata) with tensors that are views into it."""
+    with open(ckpt, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        data = torch.empty((size,), dtype=torch.uint8, pin_memory=True)
+        view = memoryview(data.numpy())
+        read = 0
+        while read < size:
+            n = f.readinto(view[read:read + chunk_size])
+            if not n:
+                raise EOFError("Unexpected end of file while reading {}".format(ckpt))
+            read += n
+    return safetensors_state_dict(data)
+
 def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
     if device is None:
         device = torch.device("cpu")
+    if device.type == "cpu":
+        # Shared with every other loader of the same file, the tensors must not be modified in place
+        sd, metadata = comfy.weight_store.store.load(ckpt, lambda: read_torch_file(ckpt, safe_load, device), safe_load=safe_load)
+    else:
+        sd, metadata, _ = read_torch_file(ckpt, safe_load, device)
+    return (sd, metadata) if return_metadata else sd
+
+def read_torch_file(ckpt, safe_load, device):
+    """Reads a checkpoint, returns (state_dict, metadata, mapped) where mapped tells if the tensors are memory mapped."""
     metadata = None
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
+        if device.type == "cpu" and args.mmap_checkpoints and sys.byteorder == "little":
+            try:
+                sd, metadata = load_safetensors_mmap(ckpt)
+                return sd, metadata, True
+            except Exception as e:
+                # safe_open below reports what is wrong with the file
+                logging.debug("Could not memory map {}: {}".format(ckpt, e))
         try:
             with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
                 sd = {}
                 for k in f.keys():
                     sd[k] = f.get_tensor(k)
-                if return_metadata:
-                    metadata = f.metadata()
+                metadata = f.metadata()
         except Exception as e:
             if len(e.args) > 0:
                 message = e.args[0]
@@ -83,7 +181,7 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
                     sd = pl_sd
             else:
                 sd = pl_sd
-    return (sd, metadata) if return_metadata else sd
+    return sd, metadata, False
 
 def save_torch_file(sd, ckpt, metadata=None):
     if metadata is not None:
@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+import time
+import weakref
+
+import torch
+
+from comfy.cli_args import args
+
+
+class StoreStateDict(dict):
+    """A state dict handed out by the weight store. The tensors in it are shared and must not be modified in place."""
+
+
+class StoreEntry:
+    def __init__(self, key):
+        self.key = key
+        self.state_dict = None
+        self.metadata = None
+        self.mapped = False
+        self.nbytes = 0
+        self.refs = 0
+        self.hits = 0
+        self.loading = True
+        self.last_used = time.time()
+
+    @property
+    def cost(self):
+        # Memory mapped tensors are file backed pages the OS can drop, only copies count against the budget
+        return 0 if self.mapped else self.nbytes
+
+
+class WeightStore:
+    """
+    Process wide store of loaded state dicts keyed by (path, mtime, size, dtype, safe_load), so
+    loaders and workflows that load the same file share its tensors instead of reading it again.
+    Every state dict handed out holds a reference on its entry until it is garbage collected.
+    Entries without references are dropped, unless max_released is set: then up to that many
+    stay in an LRU as long as the copied (not memory mapped) bytes of them fit in ram_budget.
+    """
+    def __init__(self, ram_budget=0, max_released=0):
+        self.ram_budget = ram_budget
+        self.max_released = max_released
+        self.entries = {}
+        self.released = {}  # key -> entry, least recently released first
+        self.condition = threading.Condition()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(path, dtype=None, safe_load=False):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        # A file read with pickle allowed must not be handed to a caller that asked for safe_load
+        return (path, st.st_mtime_ns, st.st_size, str(dtype) if dtype is not None else None, bool(safe_load))
+
+    def load(self, path, loader, dtype=None, safe_load=False):
+        """
+        Returns (state_dict, metadata) for path. loader() is called to read the file when the store
+        has no entry for it and returns (state_dict, metadata, mapped). With a dtype, floating point
+        tensors are cast to it once when the file is loaded. safe_load tells how loader reads the
+        file, entries read without it are only shared with other callers that didn't ask for it.
+        """
+        key = self.make_key(path, dtype, safe_load)
+        with self.condition:
+            entry = self.entries.get(key, None)
+            while entry is not None and entry.loading:
+                self.condition.wait()
+                entry = self.entries.get(key, None)
+            if entry is None:
+                entry = StoreEntry(key)
+                self.entries[key] = entry
+                self.stats["misses"] += 1
+                self._drop_stale(key)
+            else:
+                entry.hits += 1
+                self.stats["hits"] += 1
+                return self._hand_out(entry)
+
+        try:
+            state_dict, metadata, mapped = loader()
+            if dtype is not None:
+                state_dict = {k: v.to(dtype) if torch.is_tensor(v) and v.is_floating_point() else v for k, v in state_dict.items()}
+                mapped = False
+        except Exception:
+            with self.condition:
+                del self.entries[key]
+                self.condition.notify_all()
+            raise
+
+        with self.condition:
+            entry.state_dict = state_dict
+            entry.metadata = metadata
+            entry.mapped = mapped
+            entry.nbytes = sum(v.nbytes for v in state_dict.values() if torch.is_tensor(v))
+            entry.loading = False
+            self.condition.notify_all()
+            return self._hand_out(entry)
+
+    def _hand_out(self, entry):
+        # Must hold the condition
+        entry.refs += 1
+        entry.last_used = time.time()
+        self.released.pop(entry.key, None)
+        state_dict = StoreStateDict(entry.state_dict)
+        weakref.finalize(state_dict, self._release, entry)
+        return state_dict, entry.metadata
+
+    def _release(self, entry):
+        with self.condition:
+            entry.refs -= 1
+            if entry.refs == 0 and self.entries.get(entry.key, None) is entry:
+                entry.last_used = time.time()
+                self.released[entry.key] = entry
+                self._evict()
+
+    def _drop_stale(self, key):
+        """Forget released entries of the same file loaded before it changed"""
+        for other in list(self.released.keys()):
+            if other[0] == key[0] and other[1:3] != key[1:3]:
+                self._remove(other)
+
+    def _remove(self, key):
+        self.released.pop(key, None)
+        self.entries.pop(key, None)
+        self.stats["evictions"] += 1
+
+    def _evict(self):
+        released_cost = sum(entry.cost for entry in self.released.values())
+        while len(self.released) > 0 and (released_cost > self.ram_budget or len(self.released) > self.max_released):
+            key, entry = next(iter(self.released.items()))
+            released_cost -= entry.cost
+            logging.debug("Weight store evicting {}".format(key[0]))
+            self._remove(key)
+
+    def clear(self):
+        with self.condition:
+            for key in list(self.released.keys()):
+                self._remove(key)
+
+    def get_stats(self):
+        with self.condition:
+            entries = [{
+                "path": entry.key[0],
+                "dtype": entry.key[3],
+                "safe_load": entry.key[4],
+                "bytes": entry.nbytes,
+                "mapped": entry.mapped,
+                "refs": entry.refs,
+                "hits": entry.hits,
+                "last_used": entry.last_used,
+            } for entry in self.entries.values() if not entry.loading]
+            return dict(self.stats,
+                        ram_budget=self.ram_budget,
+                        held_bytes=sum(e["bytes"] for e in entries if e["refs"] > 0),
+                        released_bytes=sum(entry.nbytes for entry in self.released.values()),
+                        released_ram=sum(entry.cost for entry in self.released.values()),
+                        entries=entries)
+
+
+store = WeightStore(ram_budget=int(args.weight_store_ram_gb * 1024 * 1024 * 1024), max_released=args.weight_store_files)
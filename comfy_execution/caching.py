@@ -1,6 +1,12 @@
+import hashlib
+import logging
 import itertools
+import uuid
 from typing import Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
+from comfy_execution import schema_registry
+
+import torch
 
 import nodes
 
@@ -13,7 +19,7 @@ def include_unique_id_in_input(class_type: str) -> bool:
     if class_type in NODE_CLASS_CONTAINS_UNIQUE_ID:
         return NODE_CLASS_CONTAINS_UNIQUE_ID[class_type]
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-    NODE_CLASS_CONTAINS_UNIQUE_ID[class_type] = "UNIQUE_ID" in class_def.INPUT_TYPES().get("hidden", {}).values()
+    NODE_CLASS_CONTAINS_UNIQUE_ID[class_type] = "UNIQUE_ID" in schema_registry.get_input_types(class_def).get("hidden", {}).values()
     return NODE_CLASS_CONTAINS_UNIQUE_ID[class_type]
 
 class CacheKeySet:
@@ -72,11 +78,37 @@ class CacheKeySetID(CacheKeySet):
             self.keys[node_id] = (node_id, node["class_type"])
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+class UncacheableSignature(Exception):
+    pass
+
+def encode_signature_value(obj):
+    # Produces a canonical string for JSON-like values. Anything we can't encode
+    # deterministically (NaN, tensors, arbitrary objects) makes the node uncacheable.
+    if isinstance(obj, float) and obj != obj:
+        raise UncacheableSignature()
+    if isinstance(obj, (int, float, str, bool, type(None))):
+        return repr(obj)
+    elif isinstance(obj, Mapping):
+        items = sorted((encode_signature_value(k), encode_signature_value(v)) for k, v in obj.items())
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    elif isinstance(obj, Sequence):
+        return "[" + ",".join(encode_signature_value(i) for i in obj) + "]"
+    else:
+        raise UncacheableSignature()
+
 class CacheKeySetInputSignature(CacheKeySet):
+    """
+    Keys each node by a fixed-size Merkle-style digest of its own inputs plus the digests
+    of the nodes it is linked to. Digests are computed bottom-up once per node, so building
+    the key set is linear in the size of the graph. Because the digest only depends on the
+    contents of a node's subtree (not on node ids), an unchanged subtree produces the same
+    keys in every prompt and its cached outputs are reused.
+    """
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.digests = {}
         self.add_keys(node_ids)
 
     def include_node_id_in_input(self) -> bool:
@@ -93,17 +125,45 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
     def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        if node_id in self.digests:
+            return self.digests[node_id]
+
+        # Iterative post-order walk so that long chains don't hit the recursion limit.
+        # Each node is hashed exactly once, after all of its parents.
+        visiting = set()
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current_id, parents_done = stack.pop()
+            if current_id in self.digests:
+                continue
+            if parents_done:
+                visiting.discard(current_id)
+                self.digests[current_id] = self.get_immediate_node_signature(dynprompt, current_id, self.digests)
+                continue
+            if current_id in visiting:
+                # A cycle. Validation normally rejects these, but dynamic graphs can still
+                # produce them; we just refuse to cache anything involved.
+                self.digests[current_id] = self.get_uncacheable_signature()
+                continue
+            visiting.add(current_id)
+            stack.append((current_id, True))
+            if not dynprompt.has_node(current_id):
+                continue
+            inputs = dynprompt.get_node(current_id)["inputs"]
+            for key in sorted(inputs.keys(), reverse=True):
+                if is_link(inputs[key]):
+                    ancestor_id = inputs[key][0]
+                    if ancestor_id not in self.digests:
+                        stack.append((ancestor_id, False))
+        return self.digests[node_id]
+
+    def get_uncacheable_signature(self):
+        return "uncacheable:" + uuid.uuid4().hex
+
+    def get_immediate_node_signature(self, dynprompt, node_id, ancestor_digests):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return self.get_uncacheable_signature()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
@@ -114,32 +174,17 @@ class CacheKeySetInputSignature(CacheKeySet):
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                ancestor_digest = ancestor_digests[ancestor_id]
+                if ancestor_digest.startswith("uncacheable:"):
+                    return self.get_uncacheable_signature()
+                signature.append((key, ("ANCESTOR", ancestor_digest, ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+        try:
+            encoded = encode_signature_value(signature)
+        except UncacheableSignature:
+            return self.get_uncacheable_signature()
+        return hashlib.blake2b(encoded.encode("utf-8"), digest_size=32).hexdigest()
 
 class BasicCache:
     def __init__(self, key_class):
@@ -218,6 +263,13 @@ class BasicCache:
         else:
             return None
 
+    def record_execution_time(self, node_id, seconds):
+        # Only caches that weigh eviction by recompute cost care about this.
+        pass
+
+    def get_stats(self):
+        return {"type": self.__class__.__name__, "entries": len(self.cache)}
+
     def recursive_debug_dump(self):
         result = []
         for key in self.cache:
@@ -316,3 +368,200 @@ class LRUCache(BasicCache):
             self.children[cache_key].append(self.cache_key_set.get_data_key(child_id))
         return self
 
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["max_size"] = self.max_size
+        stats["generation"] = self.generation
+        return stats
+
+def output_storages(obj, storages=None, seen=None, depth=0):
+    """
+    Collects the memory a node output keeps alive as {storage key: (ram_bytes, vram_bytes)}.
+    Tensors are keyed by their underlying storage so views and shared tensors appear once.
+    ModelPatchers (and objects holding one, like CLIP and VAE) are keyed by their model and
+    count their weights, split between what is loaded on the device and what is offloaded.
+    """
+    if storages is None:
+        storages = {}
+    if seen is None:
+        seen = set()
+    if depth > 8 or obj is None or isinstance(obj, (int, float, str, bool)):
+        return storages
+
+    if isinstance(obj, torch.Tensor):
+        try:
+            storage = obj.untyped_storage()
+            storage_id = (obj.device, storage.data_ptr())
+            size = storage.nbytes()
+        except Exception:
+            storage_id = id(obj)
+            size = obj.nelement() * obj.element_size()
+        if storage_id not in storages:
+            storages[storage_id] = (size, 0) if obj.device.type == "cpu" else (0, size)
+        return storages
+
+    if id(obj) in seen:
+        return storages
+    seen.add(id(obj))
+
+    if hasattr(obj, "model_size") and hasattr(obj, "loaded_size"):
+        # Clones of a ModelPatcher share the same underlying model
+        model_id = ("model", id(getattr(obj, "model", obj)))
+        if model_id in storages:
+            return storages
+        try:
+            total = obj.model_size()
+            loaded = obj.loaded_size()
+        except Exception:
+            return storages
+        storages[model_id] = (max(total - loaded, 0), loaded)
+        return storages
+
+    if isinstance(obj, Mapping):
+        children = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        children = obj
+    elif hasattr(obj, "patcher"):
+        children = [obj.patcher]
+    else:
+        children = []
+    for child in children:
+        output_storages(child, storages, seen, depth + 1)
+    return storages
+
+def measure_output_size(obj):
+    """Estimates how much memory a node output keeps alive. Returns (ram_bytes, vram_bytes)."""
+    storages = output_storages(obj)
+    return sum(ram for ram, _ in storages.values()), sum(vram for _, vram in storages.values())
+
+class SizeAwareCache(LRUCache):
+    """
+    An LRU cache that keeps the memory held by cached outputs within RAM and VRAM budgets
+    (in bytes, 0 meaning unlimited) instead of capping the number of entries. When over
+    budget, entries that the current prompt isn't using are evicted in order of how cheap
+    they are to keep around: recently used, slow to recompute and small entries stay.
+
+    Storage shared between entries (a node passing its input through, models cloned by
+    several loaders) is counted once and only stops counting when the last entry holding it
+    is gone.
+    """
+    def __init__(self, key_class, ram_budget=0, vram_budget=0):
+        super().__init__(key_class, max_size=0)
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.entry_sizes = {}
+        self.entry_storages = {}
+        self.storage_refs = {}  # storage key -> [entries holding it, ram_bytes, vram_bytes]
+        self.execution_times = {}
+        self.ram_used = 0
+        self.vram_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _over_budget(self):
+        return (self.ram_budget > 0 and self.ram_used > self.ram_budget) or (self.vram_budget > 0 and self.vram_used > self.vram_budget)
+
+    def _add_storages(self, key, value):
+        storages = output_storages(value)
+        self.entry_storages[key] = storages
+        self.entry_sizes[key] = (sum(ram for ram, _ in storages.values()), sum(vram for _, vram in storages.values()))
+        for storage_id, (ram, vram) in storages.items():
+            ref = self.storage_refs.get(storage_id, None)
+            if ref is None:
+                self.storage_refs[storage_id] = [1, ram, vram]
+                self.ram_used += ram
+                self.vram_used += vram
+            else:
+                ref[0] += 1
+
+    def _drop_storages(self, key):
+        self.entry_sizes.pop(key, None)
+        for storage_id in self.entry_storages.pop(key, {}):
+            ref = self.storage_refs[storage_id]
+            ref[0] -= 1
+            if ref[0] == 0:
+                del self.storage_refs[storage_id]
+                self.ram_used -= ref[1]
+                self.vram_used -= ref[2]
+
+    def _set_entry_size(self, key, value):
+        self._drop_storages(key)
+        self._add_storages(key, value)
+
+    def _remove_entry(self, key):
+        self._drop_storages(key)
+        del self.cache[key]
+        self.used_generation.pop(key, None)
+        self.execution_times.pop(key, None)
+        if key in self.children:
+            del self.children[key]
+        self.evictions += 1
+
+    def _eviction_score(self, key):
+        # Lower scores are evicted first.
+        ram, vram = self.entry_sizes.get(key, (0, 0))
+        size = 0
+        if self.ram_budget > 0:
+            size += ram / self.ram_budget
+        if self.vram_budget > 0:
+            size += vram / self.vram_budget
+        age = self.generation - self.used_generation.get(key, 0)
+        cost = self.execution_times.get(key, 0.0) + 0.001
+        return cost / ((size + 1e-6) * (age + 1))
+
+    def _evict_to_budget(self):
+        if not self._over_budget():
+            return
+        candidates = [key for key in self.cache if self.used_generation.get(key, 0) < self.generation]
+        for key in sorted(candidates, key=self._eviction_score):
+            if not self._over_budget():
+                break
+            self._remove_entry(key)
+        if self._over_budget():
+            logging.debug("Cache is over budget but all remaining entries are in use by the current prompt.")
+
+    def clean_unused(self):
+        # Model weights can move between devices after they were cached, so re-measure.
+        self.ram_used = 0
+        self.vram_used = 0
+        self.entry_sizes = {}
+        self.entry_storages = {}
+        self.storage_refs = {}
+        for key in self.cache:
+            self._add_storages(key, self.cache[key])
+        self._evict_to_budget()
+        self._clean_subcaches()
+
+    def get(self, node_id):
+        value = super().get(node_id)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, node_id, value):
+        super().set(node_id, value)
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        self._set_entry_size(cache_key, value)
+        self._evict_to_budget()
+
+    def record_execution_time(self, node_id, seconds):
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        if cache_key in self.cache:
+            self.execution_times[cache_key] = seconds
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({
+            "ram_used": self.ram_used,
+            "vram_used": self.vram_used,
+            "ram_budget": self.ram_budget,
+            "vram_budget": self.vram_budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        })
+        return stats
+
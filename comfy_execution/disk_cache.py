@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import torch
+import safetensors.torch
+
+import nodes
+from comfyui_version import __version__
+
+FORMAT_VERSION = 1
+
+class NotSerializable(Exception):
+    pass
+
+def encode_output(obj, tensors, tensor_names, clone=True):
+    if isinstance(obj, torch.Tensor):
+        name = tensor_names.get(id(obj), None)
+        if name is None:
+            name = str(len(tensors))
+            tensor_names[id(obj)] = name
+            tensor = obj.detach().to("cpu").contiguous()
+            # Clone so views of the same storage can be saved independently
+            tensors[name] = tensor.clone() if clone else tensor
+        return {"__tensor__": name}
+    if isinstance(obj, (int, float, str, bool, type(None))):
+        return obj
+    if isinstance(obj, tuple):
+        return {"__tuple__": [encode_output(x, tensors, tensor_names, clone) for x in obj]}
+    if isinstance(obj, list):
+        return [encode_output(x, tensors, tensor_names, clone) for x in obj]
+    if isinstance(obj, dict):
+        out = {}
+        for k, v in obj.items():
+            if not isinstance(k, str) or k in ("__tensor__", "__tuple__"):
+                raise NotSerializable()
+            out[k] = encode_output(v, tensors, tensor_names, clone)
+        return out
+    raise NotSerializable()
+
+def decode_output(obj, tensors):
+    if isinstance(obj, list):
+        return [decode_output(x, tensors) for x in obj]
+    if isinstance(obj, dict):
+        if "__tensor__" in obj:
+            return tensors[obj["__tensor__"]]
+        if "__tuple__" in obj:
+            return tuple(decode_output(x, tensors) for x in obj["__tuple__"])
+        return {k: decode_output(v, tensors) for k, v in obj.items()}
+    return obj
+
+class DiskCache:
+    """
+    A second level cache for node outputs that survives PromptExecutor.reset() and restarts.
+    Outputs are stored as safetensors files named by the node's input signature digest, with
+    the non-tensor structure kept in the file metadata. Only outputs made of tensors and plain
+    values (latents, images, masks, conditioning) are stored; models and other objects are
+    skipped. The least recently used files are removed once the directory grows past max_size.
+    """
+    def __init__(self, directory, max_size, min_execution_time=0.1):
+        self.directory = directory
+        self.max_size = max_size
+        self.min_execution_time = min_execution_time
+        self.lock = threading.RLock()
+        self.entries = {} # key -> (size, last_used)
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.write_queue = queue.Queue(maxsize=16)
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _scan(self):
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp"):
+                os.remove(path)
+                continue
+            if not filename.endswith(".safetensors"):
+                continue
+            stat = os.stat(path)
+            self.entries[filename[:-len(".safetensors")]] = (stat.st_size, stat.st_mtime)
+            self.total_size += stat.st_size
+        logging.info("Disk cache: {} entries, {:.1f} MB in {}".format(len(self.entries), self.total_size / (1024 * 1024), self.directory))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".safetensors")
+
+    def is_cacheable(self, key, class_type):
+        if key is None or not isinstance(key, str) or key.startswith("uncacheable:"):
+            return False
+        class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+        if getattr(class_def, "NOT_IDEMPOTENT", False) or getattr(class_def, "OUTPUT_NODE", False):
+            return False
+        return True
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+        path = self._path(key)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                metadata = f.metadata()
+                if metadata.get("comfyui_version") != __version__ or metadata.get("format_version") != str(FORMAT_VERSION):
+                    raise NotSerializable()
+                tensors = {k: f.get_tensor(k) for k in f.keys()}
+            output = decode_output(json.loads(metadata["structure"]), tensors)
+        except Exception:
+            # Missing, corrupt or written by another version
+            self._remove(key)
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            size, _ = self.entries.get(key, (0, 0))
+            self.entries[key] = (size, time.time())
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return output
+
+    def put(self, key, class_type, output, execution_time=None):
+        if not self.is_cacheable(key, class_type):
+            return False
+        if execution_time is not None and execution_time < self.min_execution_time:
+            return False
+        with self.lock:
+            if key in self.entries:
+                return False
+        tensors = {}
+        try:
+            structure = encode_output(output, tensors, {})
+        except NotSerializable:
+            return False
+        try:
+            self.write_queue.put_nowait((key, structure, tensors))
+        except queue.Full:
+            logging.debug("Disk cache writer is falling behind, skipping {}".format(key))
+            return False
+        return True
+
+    def _write_loop(self):
+        while True:
+            key, structure, tensors = self.write_queue.get()
+            try:
+                self._write(key, structure, tensors)
+            except Exception as e:
+                logging.warning("Disk cache: failed to write {}: {}".format(key, e))
+            finally:
+                self.write_queue.task_done()
+
+    def flush(self):
+        self.write_queue.join()
+
+    def _write(self, key, structure, tensors):
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        metadata = {
+            "structure": json.dumps(structure),
+            "comfyui_version": __version__,
+            "format_version": str(FORMAT_VERSION),
+        }
+        safetensors.torch.save_file(tensors, tmp_path, metadata=metadata)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            old_size, _ = self.entries.get(key, (0, 0))
+            self.total_size += size - old_size
+            self.entries[key] = (size, time.time())
+            self.writes += 1
+        self._evict()
+
+    def _remove(self, key):
+        with self.lock:
+            size, _ = self.entries.pop(key, (0, 0))
+            self.total_size -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self.lock:
+            if self.total_size <= self.max_size:
+                return
+            by_age = sorted(self.entries.items(), key=lambda x: x[1][1])
+            to_remove = []
+            total = self.total_size
+            for key, (size, _) in by_age:
+                if total <= self.max_size:
+                    break
+                to_remove.append(key)
+                total -= size
+        for key in to_remove:
+            self._remove(key)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "directory": self.directory,
+                "entries": len(self.entries),
+                "size": self.total_size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+            }
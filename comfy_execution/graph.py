@@ -1,6 +1,7 @@
 import nodes
 
 from comfy_execution.graph_utils import is_link
+from comfy_execution import schema_registry
 
 class DependencyCycleError(Exception):
     pass
@@ -55,7 +56,7 @@ class DynamicPrompt:
         return self.original_prompt
 
 def get_input_info(class_def, input_name, valid_inputs=None):
-    valid_inputs = valid_inputs or class_def.INPUT_TYPES()
+    valid_inputs = valid_inputs or schema_registry.get_input_types(class_def)
     input_info = None
     input_category = None
     if "required" in valid_inputs and input_name in valid_inputs["required"]:
@@ -159,6 +160,8 @@ class ExecutionList(TopologicalSort):
         super().__init__(dynprompt)
         self.output_cache = output_cache
         self.staged_node_id = None
+        # Used instead of staged_node_id when several nodes execute at once
+        self.parallel_staged_node_ids = set()
 
     def is_cached(self, node_id):
         return self.output_cache.get(node_id) is not None
@@ -232,6 +235,20 @@ class ExecutionList(TopologicalSort):
         self.pop_node(node_id)
         self.staged_node_id = None
 
+    def get_parallel_ready_nodes(self):
+        return [node_id for node_id in self.get_ready_nodes() if node_id not in self.parallel_staged_node_ids]
+
+    def stage_parallel_node_execution(self, node_id):
+        assert self.staged_node_id is None
+        self.parallel_staged_node_ids.add(node_id)
+
+    def unstage_parallel_node_execution(self, node_id):
+        self.parallel_staged_node_ids.remove(node_id)
+
+    def complete_parallel_node_execution(self, node_id):
+        self.parallel_staged_node_ids.remove(node_id)
+        self.pop_node(node_id)
+
     def get_nodes_in_cycle(self):
         # We'll dissolve the graph in reverse topological order to leave only the nodes in the cycle.
         # We're skipping some of the performance optimizations from the original TopologicalSort to keep
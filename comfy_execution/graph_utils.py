@@ -1,3 +1,5 @@
+import threading
+
 def is_link(obj):
     if not isinstance(obj, list):
         return False
@@ -11,9 +13,8 @@ def is_link(obj):
 
 # The GraphBuilder is just a utility class that outputs graphs in the form expected by the ComfyUI back-end
 class GraphBuilder:
-    _default_prefix_root = ""
-    _default_prefix_call_index = 0
-    _default_prefix_graph_index = 0
+    # Per thread, so nodes executing at the same time expand into subgraphs with their own prefixes
+    _default_prefix = threading.local()
 
     def __init__(self, prefix = None):
         if prefix is None:
@@ -23,22 +24,31 @@ class GraphBuilder:
         self.nodes = {}
         self.id_gen = 1
 
+    @classmethod
+    def _prefix_state(cls):
+        state = GraphBuilder._default_prefix
+        if not hasattr(state, "root"):
+            state.root, state.call_index, state.graph_index = "", 0, 0
+        return state
+
     @classmethod
     def set_default_prefix(cls, prefix_root, call_index, graph_index = 0):
-        cls._default_prefix_root = prefix_root
-        cls._default_prefix_call_index = call_index
-        cls._default_prefix_graph_index = graph_index
+        state = cls._prefix_state()
+        state.root = prefix_root
+        state.call_index = call_index
+        state.graph_index = graph_index
 
     @classmethod
     def alloc_prefix(cls, root=None, call_index=None, graph_index=None):
+        state = cls._prefix_state()
         if root is None:
-            root = GraphBuilder._default_prefix_root
+            root = state.root
         if call_index is None:
-            call_index = GraphBuilder._default_prefix_call_index
+            call_index = state.call_index
         if graph_index is None:
-            graph_index = GraphBuilder._default_prefix_graph_index
+            graph_index = state.graph_index
         result = f"{root}.{call_index}.{graph_index}."
-        GraphBuilder._default_prefix_graph_index += 1
+        state.graph_index += 1
         return result
 
     def node(self, class_type, id=None, **kwargs):
@@ -0,0 +1,122 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+class HistoryStore:
+    """
+    Prompt history kept in SQLite instead of a dict of full entries. Every entry is stored as
+    zlib compressed JSON next to the columns used for lookups (prompt_id, client_id, status and the
+    time it finished), so listing and filtering only decode the rows that are returned. Pass a
+    file path to keep the history across restarts; the default is an in-memory database.
+
+    The store has its own lock, so reading history never waits on the prompt queue.
+    """
+    def __init__(self, path=None, max_items=10000):
+        self.path = path or ":memory:"
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if path is not None:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS history (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_id TEXT NOT NULL UNIQUE,
+            client_id TEXT,
+            status TEXT,
+            completed_at REAL NOT NULL,
+            entry BLOB NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_completed_at ON history (completed_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_client_id ON history (client_id, seq)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_status ON history (status, seq)")
+        self.count = self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        if path is not None:
+            logging.info("Prompt history: {} entries in {}".format(len(self), path))
+
+    @staticmethod
+    def encode(entry):
+        return zlib.compress(json.dumps(entry, separators=(",", ":"), default=repr).encode("utf-8"), 1)
+
+    @staticmethod
+    def decode(blob):
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, prompt_id, entry):
+        prompt = entry.get("prompt", None)
+        client_id = None
+        if prompt is not None and len(prompt) > 3 and isinstance(prompt[3], dict):
+            client_id = prompt[3].get("client_id", None)
+        status = entry.get("status", None) or {}
+        blob = self.encode(entry)
+        with self.lock:
+            # Commits on success and rolls back if any statement fails, so a failed add neither
+            # loses the entry it was replacing nor leaves the connection inside a transaction
+            with self.db:
+                self.db.execute("BEGIN")
+                replaced = self.db.execute("DELETE FROM history WHERE prompt_id = ?", (prompt_id,)).rowcount
+                self.db.execute("INSERT INTO history (prompt_id, client_id, status, completed_at, entry) VALUES (?, ?, ?, ?, ?)",
+                                (prompt_id, client_id, status.get("status_str", None), time.time(), blob))
+                count = self.count + 1 - replaced
+                if count > self.max_items:
+                    self.db.execute("DELETE FROM history WHERE seq IN (SELECT seq FROM history ORDER BY seq LIMIT ?)", (count - self.max_items,))
+                    count = self.max_items
+            self.count = count
+
+    def get(self, prompt_id):
+        with self.lock:
+            row = self.db.execute("SELECT entry FROM history WHERE prompt_id = ?", (prompt_id,)).fetchone()
+        if row is None:
+            return None
+        return self.decode(row[0])
+
+    def list(self, max_items=None, offset=-1):
+        """Oldest first, like iterating the old history dict. A negative offset returns the newest max_items."""
+        if offset < 0:
+            offset = 0
+            if max_items is not None:
+                offset = max(len(self) - max_items, 0)
+        limit = -1 if max_items is None else max_items
+        with self.lock:
+            rows = self.db.execute("SELECT prompt_id, entry FROM history ORDER BY seq LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return {prompt_id: self.decode(blob) for prompt_id, blob in rows}
+
+    def page(self, cursor=None, limit=100, status=None, client_id=None):
+        """
+        Newest first, starting after cursor (the value returned by the previous call). Returns the
+        entries and the cursor for the next page, which is None once there is nothing left.
+        """
+        query = "SELECT seq, prompt_id, entry FROM history WHERE 1=1"
+        params = []
+        if cursor is not None:
+            query += " AND seq < ?"
+            params.append(cursor)
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if client_id is not None:
+            query += " AND client_id = ?"
+            params.append(client_id)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(limit + 1)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return {prompt_id: self.decode(blob) for _, prompt_id, blob in rows}, next_cursor
+
+    def delete(self, prompt_id):
+        with self.lock:
+            self.count -= self.db.execute("DELETE FROM history WHERE prompt_id = ?", (prompt_id,)).rowcount
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM history")
+            self.count = 0
@@ -0,0 +1,170 @@
+import collections
+import logging
+import os
+import re
+import threading
+import time
+
+import torch
+
+import comfy.utils
+import comfy.weight_store
+import folder_paths
+
+# Model folders to look in for a loader input, by the input's name without trailing digits
+INPUT_FOLDERS = {
+    "ckpt_name": ["checkpoints"],
+    "unet_name": ["diffusion_models"],
+    "lora_name": ["loras"],
+    "vae_name": ["vae"],
+    "clip_name": ["text_encoders"],
+    "control_net_name": ["controlnet"],
+    "style_model_name": ["style_models"],
+    "clip_vision_name": ["clip_vision"],
+    "gligen_name": ["gligen"],
+    "hypernetwork_name": ["hypernetworks"],
+    "model_name": ["upscale_models"],
+}
+FALLBACK_FOLDERS = ["checkpoints", "diffusion_models", "loras", "vae", "text_encoders", "controlnet"]
+EXTENSIONS = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin")
+WARM_CHUNK = 16 * 1024 * 1024
+
+
+def prompt_model_paths(prompt):
+    """Full paths of the model files loader inputs of the prompt reference, in node order."""
+    paths = []
+    for node in prompt.values():
+        inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+        for name, value in inputs.items():
+            if not name.endswith("_name") or not isinstance(value, str) or not value.lower().endswith(EXTENSIONS):
+                continue
+            for folder in INPUT_FOLDERS.get(re.sub(r"\d+$", "", name), FALLBACK_FOLDERS):
+                try:
+                    path = folder_paths.get_full_path(folder, value)
+                except KeyError:  # unknown folder
+                    path = None
+                if path is not None:
+                    if path not in paths:
+                        paths.append(path)
+                    break
+    return paths
+
+
+def warm_page_cache(path):
+    """Reads a file once so the memory mapped loader finds it in the page cache."""
+    with open(path, "rb", buffering=0) as f:
+        buffer = bytearray(WARM_CHUNK)
+        while f.readinto(buffer):
+            pass
+
+
+def prefetch_file(path, pin_memory=False):
+    """
+    Loads a model file into the weight store and returns the state dict, which keeps it there
+    while it is held. With pin_memory safetensors files are read into page locked memory so
+    copying their weights to the GPU needs no staging; otherwise memory mapped files are read
+    once to bring them into the page cache.
+    """
+    if pin_memory and path.lower().endswith((".safetensors", ".sft")):
+        sd, _ = comfy.weight_store.store.load(path, lambda: comfy.utils.load_safetensors_pinned(path) + (False,), safe_load=True)
+    else:
+        sd = comfy.utils.load_torch_file(path, safe_load=True)
+    tensors = [v for v in sd.values() if torch.is_tensor(v)]
+    if len(tensors) > 0 and comfy.utils.mapped_file_location(tensors[0]) is not None:
+        warm_page_cache(path)
+    return sd
+
+
+class ModelPrefetcher:
+    """
+    Loads the model files of the next queued prompts on a background thread while the current
+    prompt runs, so their loader nodes find them in the weight store instead of reading the disk.
+    Files are fetched in queue order until ram_budget bytes are held. They are held until no
+    queued prompt in the window or running prompt references them any more.
+    """
+    def __init__(self, prompt_queue, depth=2, ram_budget=0, pin_memory=False, load=None, resolve=None):
+        self.prompt_queue = prompt_queue
+        self.depth = depth
+        self.ram_budget = ram_budget
+        self.pin_memory = pin_memory
+        self.load = load or (lambda path: prefetch_file(path, self.pin_memory))
+        self.resolve = resolve or prompt_model_paths
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.held = collections.OrderedDict()  # path -> (state_dict, size)
+        self.stats = {"prefetched": 0, "prefetched_bytes": 0, "over_budget": 0, "errors": 0, "load_time": 0.0}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True, name="model_prefetch")
+        self.thread.start()
+        self.notify()
+
+    def notify(self):
+        """Called when the queue changes"""
+        self.wake.set()
+
+    def upcoming_paths(self):
+        """(files of the next queued prompts in queue order, files of the running prompts)"""
+        with self.prompt_queue.mutex:
+            running = list(self.prompt_queue.currently_running.values())
+            queued = self.prompt_queue.queue.items()[:self.depth]
+        paths = []
+        for item in queued:
+            for path in self.resolve(item[2]):
+                if path not in paths:
+                    paths.append(path)
+        return paths, set(path for item in running for path in self.resolve(item[2]))
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            try:
+                self.update()
+            except Exception as e:
+                logging.warning("Model prefetch failed: {}".format(e))
+
+    def update(self):
+        wanted, running = self.upcoming_paths()
+        with self.lock:
+            # Files of a prompt that just started stay until its loaders had them
+            for path in list(self.held.keys()):
+                if path not in wanted and path not in running:
+                    del self.held[path]
+            used = sum(size for _, size in self.held.values())
+        for path in wanted:
+            if self.wake.is_set():
+                return  # the queue changed, start over
+            with self.lock:
+                if path in self.held:
+                    continue
+            size = os.path.getsize(path)
+            if used + size > self.ram_budget:
+                with self.lock:
+                    self.stats["over_budget"] += 1
+                return
+            start = time.perf_counter()
+            try:
+                state_dict = self.load(path)
+            except Exception as e:
+                logging.warning("Could not prefetch {}: {}".format(path, e))
+                with self.lock:
+                    self.stats["errors"] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            logging.debug("Prefetched {} in {:.2f} seconds".format(path, elapsed))
+            with self.lock:
+                self.held[path] = (state_dict, size)
+                self.stats["prefetched"] += 1
+                self.stats["prefetched_bytes"] += size
+                self.stats["load_time"] += elapsed
+            used += size
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats,
+                        depth=self.depth,
+                        ram_budget=self.ram_budget,
+                        pin_memory=self.pin_memory,
+                        held={path: size for path, (_, size) in self.held.items()})
@@ -0,0 +1,123 @@
+import copy
+import json
+
+# Widgets that may differ between prompts fused into one execution. Sampler seeds become a list of
+# [seed, batch_size] pairs (see comfy.sample.prepare_noise) and the latent batch sizes are summed.
+FUSABLE_SEED_INPUTS = {
+    "KSampler": "seed",
+    "KSamplerAdvanced": "noise_seed",
+}
+FUSABLE_BATCH_INPUTS = {
+    "EmptyLatentImage": "batch_size",
+}
+# Nodes that treat every element of a batch independently and keep the batch order, so a fused
+# batch produces the same images as the prompts run one by one.
+FUSABLE_CLASS_TYPES = {
+    "CheckpointLoaderSimple", "CheckpointLoader", "unCLIPCheckpointLoader", "VAELoader", "LoraLoader",
+    "LoraLoaderModelOnly", "CLIPLoader", "DualCLIPLoader", "UNETLoader", "CLIPSetLastLayer",
+    "CLIPTextEncode", "ConditioningCombine", "ConditioningSetArea", "ConditioningZeroOut",
+    "EmptyLatentImage", "KSampler", "KSamplerAdvanced", "VAEDecode", "VAEDecodeTiled",
+    "SaveImage", "PreviewImage", "ImageInvert", "ImageScale", "ImageScaleBy",
+}
+# Samplers that add no noise after the initial latent noise. Ancestral, SDE and similar samplers draw
+# their per-step noise from the one seed the sampler gets, so fused prompts after the first would
+# get different images than they would unfused.
+DETERMINISTIC_SAMPLERS = {
+    "euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+    "ipndm", "ipndm_v", "deis", "res_multistep", "res_multistep_cfg_pp", "gradient_estimation",
+    "ddim", "uni_pc", "uni_pc_bh2",
+}
+
+def fusion_key(prompt):
+    """
+    Returns a key shared by prompts that only differ in sampler seeds and latent batch size, or
+    None if the prompt can't be fused (unknown nodes, a sampler that adds noise while sampling or
+    not exactly one latent batch source).
+    """
+    batch_nodes = 0
+    seed_nodes = 0
+    normalized = []
+    for node_id in sorted(prompt.keys()):
+        node = prompt[node_id]
+        class_type = node["class_type"]
+        if class_type not in FUSABLE_CLASS_TYPES:
+            return None
+        inputs = dict(node["inputs"])
+        if class_type in FUSABLE_BATCH_INPUTS:
+            inputs.pop(FUSABLE_BATCH_INPUTS[class_type], None)
+            batch_nodes += 1
+        if class_type in FUSABLE_SEED_INPUTS:
+            if inputs.get("sampler_name", None) not in DETERMINISTIC_SAMPLERS:
+                return None
+            inputs.pop(FUSABLE_SEED_INPUTS[class_type], None)
+            seed_nodes += 1
+        normalized.append((node_id, class_type, inputs))
+    if batch_nodes != 1 or seed_nodes == 0:
+        return None
+    try:
+        return json.dumps(normalized, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+def get_batch_size(prompt):
+    for node in prompt.values():
+        name = FUSABLE_BATCH_INPUTS.get(node["class_type"], None)
+        if name is not None:
+            return int(node["inputs"].get(name, 1))
+    return 1
+
+def group_prompts(prompts, max_batch_size):
+    """
+    Splits a list of validated prompts into groups that can run as one execution. Returns lists of
+    indices into prompts; prompts that can't be fused end up in a group of their own.
+    """
+    groups = []
+    open_groups = {}
+    for i, prompt in enumerate(prompts):
+        key = fusion_key(prompt)
+        if key is None:
+            groups.append([i])
+            continue
+        size = get_batch_size(prompt)
+        group = open_groups.get(key, None)
+        if group is not None and group[1] + size <= max_batch_size:
+            group[0].append(i)
+            group[1] += size
+            continue
+        group = [[i], size]
+        open_groups[key] = group
+        groups.append(group[0])
+    return groups
+
+def fuse_prompts(prompts):
+    """Builds the prompt that runs all prompts of a group as one latent batch."""
+    batch_sizes = [get_batch_size(p) for p in prompts]
+    fused = copy.deepcopy(prompts[0])
+    for node_id, node in fused.items():
+        class_type = node["class_type"]
+        if class_type in FUSABLE_BATCH_INPUTS:
+            node["inputs"][FUSABLE_BATCH_INPUTS[class_type]] = sum(batch_sizes)
+        if class_type in FUSABLE_SEED_INPUTS:
+            name = FUSABLE_SEED_INPUTS[class_type]
+            node["inputs"][name] = [[int(p[node_id]["inputs"][name]), size] for p, size in zip(prompts, batch_sizes)]
+    return fused, batch_sizes
+
+def split_outputs(outputs, batch_sizes):
+    """
+    Splits the ui outputs of a fused execution into one dict per original prompt. Lists with one
+    entry per batch element (images, for example) are sliced; everything else is copied.
+    """
+    total = sum(batch_sizes)
+    out = [{} for _ in batch_sizes]
+    for node_id, ui in outputs.items():
+        for i in range(len(batch_sizes)):
+            out[i][node_id] = {}
+        for name, value in ui.items():
+            offset = 0
+            for i, size in enumerate(batch_sizes):
+                if isinstance(value, list) and len(value) == total:
+                    out[i][node_id][name] = value[offset:offset + size]
+                else:
+                    out[i][node_id][name] = value
+                offset += size
+    return out
@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import time
+
+PRIORITY_CLASSES = ("interactive", "normal", "batch")
+DEFAULT_PRIORITY = "normal"
+
+def get_priority(extra_data):
+    priority = extra_data.get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITY_CLASSES:
+        return DEFAULT_PRIORITY
+    return priority
+
+class QueueEntry:
+    __slots__ = ("number", "sequence", "item", "priority", "client_id", "deadline", "removed")
+
+    def __init__(self, number, sequence, item, priority, client_id, deadline):
+        self.number = number
+        self.sequence = sequence
+        self.item = item
+        self.priority = priority
+        self.client_id = client_id
+        self.deadline = deadline
+        self.removed = False
+
+    def __lt__(self, other):
+        return (self.number, self.sequence) < (other.number, other.sequence)
+
+class PromptScheduler:
+    """
+    Orders queued prompts for PromptQueue. Prompts are served strictly by priority class
+    (extra_data["priority"]: interactive, normal or batch). Inside a class every client_id has its
+    own heap ordered by number, and the client that was served the least so far goes next, so one
+    client submitting hundreds of prompts doesn't hold back the others. Prompts whose
+    extra_data["deadline"] (a time.time() value) has passed are dropped instead of executed.
+    The affinity callback passed to pop() reorders a client's next few prompts so that prompts
+    using models the worker already has loaded go first.
+
+    Cancelling marks the entry as removed and leaves it in its heap until it reaches the top, which
+    keeps cancellation by prompt_id O(1) plus the O(log n) pop that eventually discards it.
+    """
+    def __init__(self, affinity_window=8):
+        self.affinity_window = affinity_window
+        self.sequence = itertools.count()
+        self.entries = {} # prompt_id -> QueueEntry
+        self.heaps = {priority: {} for priority in PRIORITY_CLASSES} # priority -> client_id -> heap
+        self.served = {priority: {} for priority in PRIORITY_CLASSES} # priority -> client_id -> count
+        self.depths = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.deadlines = [] # heap of (deadline, sequence, QueueEntry)
+        self.removed_count = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, item):
+        extra_data = item[3]
+        priority = get_priority(extra_data)
+        client_id = extra_data.get("client_id", None)
+        entry = QueueEntry(item[0], next(self.sequence), item, priority, client_id, extra_data.get("deadline", None))
+        old = self.entries.get(item[1], None)
+        if old is not None:
+            self._remove(old)
+        self.entries[item[1]] = entry
+        heaps = self.heaps[priority]
+        if client_id not in heaps:
+            heaps[client_id] = []
+            # A client that was idle starts level with the least served active client
+            served = self.served[priority]
+            active = [served.get(c, 0) for c in heaps if c != client_id]
+            served[client_id] = max(served.get(client_id, 0), min(active, default=0))
+        heapq.heappush(heaps[client_id], entry)
+        self.depths[priority] += 1
+        if entry.deadline is not None:
+            heapq.heappush(self.deadlines, (entry.deadline, entry.sequence, entry))
+
+    def _remove(self, entry):
+        entry.removed = True
+        del self.entries[entry.item[1]]
+        self.depths[entry.priority] -= 1
+        self.removed_count += 1
+        if self.removed_count > 1024 and self.removed_count > len(self.entries):
+            self._compact()
+
+    def _compact(self):
+        for priority, heaps in self.heaps.items():
+            for client_id in list(heaps.keys()):
+                heap = [e for e in heaps[client_id] if not e.removed]
+                if len(heap) == 0:
+                    del heaps[client_id]
+                    self.served[priority].pop(client_id, None)
+                else:
+                    heapq.heapify(heap)
+                    heaps[client_id] = heap
+        self.deadlines = [x for x in self.deadlines if not x[2].removed]
+        heapq.heapify(self.deadlines)
+        self.removed_count = 0
+
+    def _head(self, priority, client_id):
+        heaps = self.heaps[priority]
+        heap = heaps[client_id]
+        while len(heap) > 0 and heap[0].removed:
+            heapq.heappop(heap)
+            self.removed_count -= 1
+        if len(heap) == 0:
+            del heaps[client_id]
+            self.served[priority].pop(client_id, None)
+            return None
+        return heap[0]
+
+    def cancel(self, prompt_id):
+        entry = self.entries.get(prompt_id, None)
+        if entry is None:
+            return False
+        self._remove(entry)
+        return True
+
+    def remove_if(self, function):
+        for entry in sorted(self.entries.values()):
+            if function(entry.item):
+                self._remove(entry)
+                return True
+        return False
+
+    def clear(self):
+        self.__init__(self.affinity_window)
+
+    def pop_expired(self, now=None):
+        if now is None:
+            now = time.time()
+        expired = []
+        while len(self.deadlines) > 0 and self.deadlines[0][0] < now:
+            _, _, entry = heapq.heappop(self.deadlines)
+            if not entry.removed:
+                self._remove(entry)
+                expired.append(entry.item)
+        return expired
+
+    def pop(self, affinity=None):
+        """Returns the next item to run or None if nothing is queued."""
+        for priority in PRIORITY_CLASSES:
+            if self.depths[priority] == 0:
+                continue
+            heaps = self.heaps[priority]
+            served = self.served[priority]
+            best = None
+            for client_id in list(heaps.keys()):
+                head = self._head(priority, client_id)
+                if head is None:
+                    continue
+                # Prompts queued with "front" (negative numbers) skip the fair share rotation
+                key = (head.number >= 0, served.get(client_id, 0), head.number, head.sequence)
+                if best is None or key < best[0]:
+                    best = (key, client_id)
+            if best is None:
+                continue
+            client_id = best[1]
+            entry = self._pick(heaps[client_id], affinity)
+            if entry.number >= 0:
+                served[client_id] = served.get(client_id, 0) + 1
+            self._remove(entry)
+            return entry.item
+        return None
+
+    def _pick(self, heap, affinity):
+        # Within a client's own backlog prefer prompts that use models the worker already has loaded.
+        if affinity is None or len(heap) == 1:
+            return heap[0]
+        best = heap[0]
+        best_score = 0
+        for candidate in heapq.nsmallest(self.affinity_window, heap):
+            if candidate.removed:
+                continue
+            score = affinity(candidate.item[2])
+            if score > best_score:
+                best = candidate
+                best_score = score
+        return best
+
+    def items(self):
+        return [e.item for e in sorted(self.entries.values())]
+
+    def get_depths(self):
+        return dict(self.depths)
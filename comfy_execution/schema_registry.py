@@ -0,0 +1,103 @@
+import copy
+import logging
+import threading
+import time
+
+import folder_paths
+
+class SchemaRegistry:
+    """
+    Caches the result of INPUT_TYPES() per node class. Loader nodes build their combo lists from
+    folder_paths.get_filename_list or os.listdir, so calling INPUT_TYPES() for every node on every
+    prompt hits the disk. Schemas are kept for one filesystem generation: check_filesystem() compares
+    the mtimes of the model and input directories with the last snapshot and drops every cached
+    schema when one of them changed. It is meant to be called once per prompt (or per /object_info
+    request); lookups in between never touch the disk.
+
+    Callers get their own copy of the schema and may modify it. Node classes whose INPUT_TYPES()
+    changes for other reasons can set DYNAMIC_INPUT_TYPES = True to be asked every time.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.schemas = {}
+        self.input_orders = {}
+        self.generation = 0
+        self.directory_mtimes = None
+        self.last_check = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def check_filesystem(self):
+        mtimes = folder_paths.get_directory_mtimes()
+        with self.lock:
+            self.last_check = time.time()
+            if mtimes == self.directory_mtimes:
+                return False
+            if self.directory_mtimes is not None:
+                logging.debug("Model or input directories changed, invalidating node schemas")
+            self.directory_mtimes = mtimes
+            self._invalidate_all()
+            return True
+
+    def _invalidate_all(self):
+        self.schemas.clear()
+        self.input_orders.clear()
+        self.generation += 1
+
+    def invalidate(self, class_def=None):
+        with self.lock:
+            if class_def is None:
+                self._invalidate_all()
+            else:
+                self.schemas.pop(class_def, None)
+                self.input_orders.pop(class_def, None)
+
+    def get_input_types(self, class_def):
+        if not is_cacheable(class_def):
+            with self.lock:
+                self.misses += 1
+            return class_def.INPUT_TYPES()
+        with self.lock:
+            schema = self.schemas.get(class_def, None)
+            if schema is not None:
+                self.hits += 1
+                return copy.deepcopy(schema)
+            self.misses += 1
+            generation = self.generation
+        schema = class_def.INPUT_TYPES()
+        with self.lock:
+            # Don't store a schema computed from a listing that has since been invalidated
+            if generation == self.generation:
+                self.schemas[class_def] = copy.deepcopy(schema)
+        return schema
+
+    def get_input_order(self, class_def):
+        if not is_cacheable(class_def):
+            return {key: list(value.keys()) for (key, value) in class_def.INPUT_TYPES().items()}
+        with self.lock:
+            order = self.input_orders.get(class_def, None)
+            generation = self.generation
+        if order is not None:
+            return copy.deepcopy(order)
+        order = {key: list(value.keys()) for (key, value) in self.get_input_types(class_def).items()}
+        with self.lock:
+            if generation == self.generation:
+                self.input_orders[class_def] = copy.deepcopy(order)
+        return order
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "generation": self.generation,
+                "schemas": len(self.schemas),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+def is_cacheable(class_def):
+    return not getattr(class_def, "DYNAMIC_INPUT_TYPES", False)
+
+registry = SchemaRegistry()
+
+def get_input_types(class_def):
+    return registry.get_input_types(class_def)
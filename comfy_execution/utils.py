@@ -0,0 +1,30 @@
+import contextvars
+from typing import NamedTuple, Optional
+
+
+class ExecutionContext(NamedTuple):
+    prompt_id: str
+    node_id: str
+    display_node_id: str
+
+
+# Each thread has its own context, so nodes executing at the same time see their own node
+current_executing_context: contextvars.ContextVar[Optional[ExecutionContext]] = contextvars.ContextVar("current_executing_context", default=None)
+
+
+def get_executing_context() -> Optional[ExecutionContext]:
+    """The node executing on the calling thread, or None outside of node execution."""
+    return current_executing_context.get()
+
+
+class CurrentNodeContext:
+    def __init__(self, prompt_id, node_id, display_node_id=None):
+        self.context = ExecutionContext(prompt_id, node_id, display_node_id if display_node_id is not None else node_id)
+        self.token = None
+
+    def __enter__(self):
+        self.token = current_executing_context.set(self.context)
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        current_executing_context.reset(self.token)
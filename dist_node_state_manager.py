@@ -1,10 +1,8 @@
 import torch
-import torch.distributed as dist
 from node_state_manager import NodeStateManager
-from dist_utils import tensor_to_bytes, bytes_to_tensor
-import pickle
-import io
-import threading
+from dist_utils import broadcast_object
+from dist_rpc import NodeOutputRPC
+from dist_placement import PlacementEngine
 import logging
 
 class DistributedNodeStateManager(NodeStateManager):
@@ -16,9 +14,15 @@ class DistributedNodeStateManager(NodeStateManager):
         self.local_rank = 0
         self.node_assignments = {}  # 节点ID到GPU的映射
         self.node_specs = {} # 节点专业化，指示哪些节点类型在哪些GPU上运行
+        self.rpc = None
+        self.placement = PlacementEngine(1)
+        self.migrating = set() # 正在新rank上重新执行的节点，所有rank都知道迁移，输出不需要广播
         
-    def initialize(self, is_distributed, rank, world_size, local_rank, node_specs=None):
-        """初始化分布式模式"""
+    def initialize(self, is_distributed, rank, world_size, local_rank, node_specs=None, memory_capacity=None):
+        """
+        初始化分布式模式，所有rank都需要调用。memory_capacity是本rank可以放置的节点输出字节数，
+        默认使用vram_budget，没有设置时使用设备的总显存。
+        """
         self.distributed_mode = is_distributed
         self.rank = rank
         self.world_size = world_size
@@ -26,188 +30,211 @@ class DistributedNodeStateManager(NodeStateManager):
         
         if node_specs:
             self.node_specs = node_specs
+        if memory_capacity is None:
+            memory_capacity = self._device_memory_capacity()
+        # 每个rank只知道自己的容量，依次广播组成完整的容量表
+        capacities = {rank: memory_capacity}
+        if is_distributed:
+            capacities = {src: broadcast_object(memory_capacity if src == rank else None, src=src) for src in range(world_size)}
+        self.placement = PlacementEngine(world_size, self.node_specs, default_rank=rank,
+                                         memory_capacity={r: c for r, c in capacities.items() if c is not None})
+            
+        if is_distributed:
+            # 响应带上槽位是否是列表输出，请求方才能按本地输出相同的格式传给下游节点
+            self.rpc = NodeOutputRPC(rank, lambda node_id, output_index: NodeStateManager.get_output_slot(self, node_id, output_index))
             
         logging.info(f"DistributedNodeStateManager initialized: rank={rank}, world_size={world_size}")
+
+    def _device_memory_capacity(self):
+        if self.vram_budget > 0:
+            return self.vram_budget
+        if not torch.cuda.is_available():
+            return None
+        import comfy.model_management
+        return comfy.model_management.get_total_memory(torch.device("cuda", self.local_rank))
             
     def register_persistent_node(self, node_id, node_data):
-        """注册持久化节点，支持通配符节点类型匹配"""
+        """注册持久化节点，由放置引擎根据负载、内存和传输代价选择rank"""
+        if self.distributed_mode:
+            self.exchange_measurements()
         with self.lock:
-            # 根据节点类型决定该节点应该运行在哪个GPU上
             if self.distributed_mode and "class_type" in node_data:
-                class_type = node_data["class_type"]
-                assigned_gpu = None
-                
-                # 1. 检查是否有精确匹配
-                for gpu_id, specs in self.node_specs.items():
-                    if class_type in specs:
-                        self.node_assignments[node_id] = int(gpu_id)
-                        assigned_gpu = int(gpu_id)
-                        break
-                
-                # 2. 如果没有精确匹配，检查通配符
-                if assigned_gpu is None:
-                    for gpu_id, specs in self.node_specs.items():
-                        if "*" in specs or "ALL" in specs:
-                            self.node_assignments[node_id] = int(gpu_id)
-                            assigned_gpu = int(gpu_id)
-                            break
-                
-                #     # 2. 如果没有精确匹配，检查通配符并应用负载均衡
-                # if assigned_gpu is None:
-                #     wildcard_gpus = []
-                #     for gpu_id, specs in self.node_specs.items():
-                #         if "*" in specs or "ALL" in specs:
-                #             wildcard_gpus.append(int(gpu_id))
-                    
-                #     if wildcard_gpus:
-                #         # 简单轮询均衡 - 可以根据节点ID或类型hash来分配
-                #         assigned_gpu = wildcard_gpus[hash(node_id) % len(wildcard_gpus)]
-                #         self.node_assignments[node_id] = assigned_gpu
+                assigned_gpu = self.placement.place(node_id, node_data)
+            else:
+                # 默认分配给当前GPU
+                assigned_gpu = self.placement.place(node_id, node_data, rank=self.rank)
             
-            # 默认分配给当前GPU
-            if node_id not in self.node_assignments:
-                self.node_assignments[node_id] = self.rank
+            # 广播节点分配信息，各rank的测量数据不同，统一使用rank 0的决定
+            if self.distributed_mode:
+                assigned_gpu = self._broadcast_node_assignment(node_id, assigned_gpu)
+                self.placement.assignments[node_id] = assigned_gpu
+            self.node_assignments[node_id] = assigned_gpu
                 
             # 只有负责该节点的GPU需要存储完整数据
-            if self.node_assignments.get(node_id, 0) == self.rank:
+            if assigned_gpu == self.rank:
                 super().register_persistent_node(node_id, node_data)
                 
-            # 广播节点分配信息
+        # 迁移时会执行节点并拉取远程输入，不能持有self.lock，否则其他rank的请求处理会被挡住
+        if self.distributed_mode:
+            self.rebalance_nodes()
+    
+    def record_node_execution(self, node_id, class_type, seconds, outputs):
+        """记录执行时间和输出大小，供放置引擎估计负载、内存和传输代价"""
+        self.placement.record_execution(class_type, seconds)
+        self.placement.record_outputs(node_id, outputs)
+
+    def exchange_measurements(self):
+        """
+        所有rank都需要调用。每个rank只测量在自己上面执行的节点，放置和rebalance由rank 0决定，
+        所以先把各rank新记录的测量数据广播出去合并，rank 0的负载、内存和传输代价才包含其他rank的节点。
+        """
+        local = self.placement.take_measurements()
+        for src in range(self.world_size):
+            measurements = broadcast_object(local if src == self.rank else None, src=src)
+            if src != self.rank:
+                self.placement.merge_measurements(measurements)
+    
+    def rebalance_nodes(self):
+        """
+        rank 0计算迁移方案并广播，所有rank都需要调用。
+        原rank上已有输出的节点先在新rank上重新执行，成功后才切换分配并丢弃原rank的输出，
+        下游随时都能取到输出；重新执行失败的节点留在原rank。返回实际完成的迁移。
+        """
+        if self.distributed_mode:
+            self.exchange_measurements()
+        moves = self.placement.rebalance() if self.rank == 0 else None
+        if self.distributed_mode:
+            moves = broadcast_object(moves, src=0)
+        done = []
+        for node_id, old_rank, new_rank in moves:
+            with self.lock:
+                had_output = self.has_node_output(node_id) if old_rank == self.rank else None
+            if self.distributed_mode:
+                had_output = broadcast_object(had_output, src=old_rank)
+            error = None
+            if new_rank == self.rank:
+                node_data = self.placement.nodes[node_id]
+                NodeStateManager.register_persistent_node(self, node_id, node_data)
+                if had_output:
+                    error = self._execute_moved_node(node_id, node_data)
             if self.distributed_mode:
-                self._broadcast_node_assignment(node_id)
+                error = broadcast_object(error, src=new_rank)
+            with self.lock:
+                if error is not None:
+                    logging.warning(f"Could not move node {node_id} to rank {new_rank}, keeping it on rank {old_rank}: {error}")
+                    self.placement.assignments[node_id] = old_rank
+                    if new_rank == self.rank:
+                        self.persistent_nodes.pop(node_id, None)
+                        self.remove_node_output(node_id)
+                    continue
+                self.placement.assignments[node_id] = new_rank
+                self.node_assignments[node_id] = new_rank
+                if old_rank == self.rank:
+                    self.persistent_nodes.pop(node_id, None)
+                    self.remove_node_output(node_id)
+                if self.rpc is not None:
+                    self.rpc.invalidate(node_id)
+            done.append((node_id, old_rank, new_rank))
+        return done
+
+    def _execute_moved_node(self, node_id, node_data):
+        """在本rank上重新计算迁移过来的节点的输出，返回错误信息"""
+        import execution
+        self.migrating.add(node_id)
+        try:
+            _, error = execution.execute_single_node(None, node_id, node_data, {}, self, force=True)
+        except Exception as e:
+            error = str(e)
+        finally:
+            self.migrating.discard(node_id)
+        return error
+    
+    def get_placement_table(self):
+        """当前的节点分配表以及各rank的负载和内存估计"""
+        table = self.placement.get_table()
+        table["rank"] = self.rank
+        table["world_size"] = self.world_size
+        return table
     
+    def is_remote(self, node_id):
+        """节点是否分配在其他rank上"""
+        with self.lock:
+            return self.distributed_mode and self.node_assignments.get(node_id, 0) != self.rank
+
     def get_node_output(self, node_id, output_index=0):
         """获取节点输出，如果在远程则获取远程节点输出"""
-        with self.lock:
-            # 如果节点在当前进程，直接获取
-            if not self.distributed_mode or self.node_assignments.get(node_id, 0) == self.rank:
-                return super().get_node_output(node_id, output_index)
-            
-            # 否则从远程获取
-            return self._fetch_remote_output(node_id, output_index)
+        # 如果节点在当前进程，直接获取
+        if not self.is_remote(node_id):
+            return super().get_node_output(node_id, output_index)
+        
+        # 否则从远程获取，网络往返期间不持有self.lock
+        slot = self._fetch_remote_output(node_id, output_index)
+        return slot[0] if slot is not None else None
+
+    def get_output_slot(self, node_id, output_index=0):
+        """(槽位的值, 是否是列表输出)，远程节点的由负责它的rank返回"""
+        if not self.is_remote(node_id):
+            return super().get_output_slot(node_id, output_index)
+        return self._fetch_remote_output(node_id, output_index)
+    
+    def prefetch_node_inputs(self, node_data):
+        """节点即将执行时，提前拉取它引用的远程上游节点输出"""
+        if self.rpc is None:
+            return
+        for value in node_data.get("inputs", {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int):
+                if self.is_remote(value[0]):
+                    self.rpc.prefetch(self.node_assignments[value[0]], value[0], value[1])
     
     def set_node_output(self, node_id, outputs):
         """设置节点输出，并在分布式模式下广播可用性"""
         with self.lock:
             super().set_node_output(node_id, outputs)
             
-            if self.distributed_mode:
+            if self.distributed_mode and node_id not in self.migrating:
                 self._broadcast_output_available(node_id)
     
-    def _broadcast_node_assignment(self, node_id):
-        """广播节点分配信息"""
+    def _broadcast_node_assignment(self, node_id, assigned_rank):
+        """广播节点分配信息，返回rank 0决定的分配"""
         if not self.distributed_mode:
-            return
+            return assigned_rank
             
-        data = pickle.dumps({
+        return broadcast_object({
             "node_id": node_id,
-            "assigned_rank": self.node_assignments[node_id]
-        })
-        size_tensor = torch.tensor([len(data)], dtype=torch.long, device="cuda")
-        dist.broadcast(size_tensor, src=0)
-        
-        data_tensor = torch.ByteTensor(list(data)).to("cuda")
-        data_tensor_padded = torch.zeros(size_tensor.item(), dtype=torch.uint8, device="cuda")
-        data_tensor_padded[:len(data)] = data_tensor
-        dist.broadcast(data_tensor_padded, src=0)
+            "assigned_rank": assigned_rank
+        }, src=0)["assigned_rank"]
     
     def _broadcast_output_available(self, node_id):
         """广播节点输出可用性"""
         if not self.distributed_mode:
             return
             
-        data = pickle.dumps({
+        broadcast_object({
             "node_id": node_id,
             "has_output": True,
             "source_rank": self.rank
-        })
-        size_tensor = torch.tensor([len(data)], dtype=torch.long, device="cuda")
-        dist.broadcast(size_tensor, src=self.rank)
-        
-        data_tensor = torch.ByteTensor(list(data)).to("cuda")
-        data_tensor_padded = torch.zeros(size_tensor.item(), dtype=torch.uint8, device="cuda")
-        data_tensor_padded[:len(data)] = data_tensor
-        dist.broadcast(data_tensor_padded, src=self.rank)
+        }, src=self.rank)
     
     def _fetch_remote_output(self, node_id, output_index):
-        """从远程获取节点输出"""
+        """从远程获取节点输出，已经预取的直接使用在途的结果"""
         if not self.distributed_mode:
             return None
             
         # 向负责该节点的GPU请求数据
-        target_rank = self.node_assignments.get(node_id, 0)
-        
-        # 发送请求
-        req_data = pickle.dumps({
-            "node_id": node_id, 
-            "output_index": output_index,
-            "requester_rank": self.rank
-        })
-        req_size = torch.tensor([len(req_data)], dtype=torch.long, device="cuda")
-        dist.send(req_size, dst=target_rank)
-        
-        req_tensor = torch.ByteTensor(list(req_data)).to("cuda")
-        req_tensor_padded = torch.zeros(req_size.item(), dtype=torch.uint8, device="cuda")
-        req_tensor_padded[:len(req_data)] = req_tensor
-        dist.send(req_tensor_padded, dst=target_rank)
-        
-        # 接收响应大小
-        resp_size = torch.zeros(1, dtype=torch.long, device="cuda")
-        dist.recv(resp_size, src=target_rank)
-        
-        # 接收响应数据
-        resp_data = torch.zeros(resp_size.item(), dtype=torch.uint8, device="cuda")
-        dist.recv(resp_data, src=target_rank)
-        
-        # 解析响应
-        resp_bytes = resp_data.cpu().numpy().tobytes()
-        output_data = pickle.loads(resp_bytes)
-        
-        return output_data["output"]
+        with self.lock:
+            target_rank = self.node_assignments.get(node_id, 0)
+        return self.rpc.fetch(target_rank, node_id, output_index)
         
     def handle_remote_requests(self):
         """处理来自其他GPU的请求"""
         if not self.distributed_mode:
             return
             
-        threading.Thread(target=self._request_handler_loop, daemon=True).start()
-        
-    def _request_handler_loop(self):
-        """请求处理循环"""
-        while True:
-            try:
-                # 接收请求大小
-                req_size = torch.zeros(1, dtype=torch.long, device="cuda")
-                dist.recv(req_size)
-                
-                # 接收请求数据
-                req_data = torch.zeros(req_size.item(), dtype=torch.uint8, device="cuda")
-                dist.recv(req_data)
-                
-                # 解析请求
-                req_bytes = req_data.cpu().numpy().tobytes()
-                request = pickle.loads(req_bytes)
-                
-                # 处理请求
-                node_id = request["node_id"]
-                output_index = request["output_index"]
-                requester_rank = request["requester_rank"]
-                
-                # 获取输出
-                output = super().get_node_output(node_id, output_index)
-                
-                # 序列化响应
-                resp_data = pickle.dumps({"output": output})
-                resp_size = torch.tensor([len(resp_data)], dtype=torch.long, device="cuda")
-                
-                # 发送响应大小
-                dist.send(resp_size, dst=requester_rank)
-                
-                # 发送响应数据
-                resp_tensor = torch.ByteTensor(list(resp_data)).to("cuda")
-                resp_tensor_padded = torch.zeros(resp_size.item(), dtype=torch.uint8, device="cuda")
-                resp_tensor_padded[:len(resp_data)] = resp_tensor
-                dist.send(resp_tensor_padded, dst=requester_rank)
-                
-            except Exception as e:
-                logging.error(f"Error handling remote request: {e}") 
\ No newline at end of file
+        self.rpc.start()
+
+    def shutdown(self):
+        """停止处理远程请求，所有rank都要调用，之后才能销毁进程组"""
+        if self.rpc is None:
+            return
+        self.rpc.stop()
+        self.rpc = None
@@ -0,0 +1,195 @@
+import logging
+import threading
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+def estimate_memory(outputs):
+    """节点输出占用的内存（字节），模型按ModelPatcher.model_size计算，张量按存储计算"""
+    from comfy_execution.caching import measure_output_size
+    ram, vram = measure_output_size(outputs)
+    return ram + vram
+
+class PlacementEngine:
+    """
+    分布式节点放置引擎。
+
+    每个节点的候选rank来自node_specs（先精确匹配类名，再通配符），在候选rank中选代价最小的：
+    该rank已有的计算负载（按类统计的平均执行时间）+ 该节点的执行时间 + 与上下游节点不在同一rank时的
+    传输代价（输出大小 / 带宽）。模型等大输出的传输代价很高，所以生产者会和它的重型消费者放在一起。
+    显存估计超过容量的rank不会被选中。rebalance()在某个rank的负载明显高于平均值时把节点迁走。
+    """
+    def __init__(self, world_size, node_specs=None, default_rank=0, memory_capacity=None,
+                 transfer_bandwidth=8 * 1024 ** 3, default_execution_time=0.05, hot_ratio=1.5, smoothing=0.3):
+        self.world_size = world_size
+        self.node_specs = {int(k): v for k, v in (node_specs or {}).items()}
+        self.default_rank = default_rank
+        self.memory_capacity = memory_capacity or {} # rank -> 字节，没有的rank不限制
+        self.transfer_bandwidth = transfer_bandwidth # 字节/秒
+        self.default_execution_time = default_execution_time
+        self.hot_ratio = hot_ratio
+        self.smoothing = smoothing
+        self.lock = threading.RLock()
+        self.nodes = {} # node_id -> node_data
+        self.assignments = {} # node_id -> rank
+        self.pinned = set() # 手动指定rank的节点，不参与rebalance
+        self.class_times = {} # class_type -> 平均执行时间
+        self.node_memory = {} # node_id -> 估计内存
+        self.output_sizes = {} # node_id -> 输出字节数（跨rank传输量）
+        # 本rank记录的、还没有交换给其他rank的测量数据，见take_measurements()
+        self.unshared_times = [] # [(class_type, 秒)]
+        self.unshared_outputs = {} # node_id -> 输出字节数
+
+    def candidate_ranks(self, class_type):
+        exact = [rank for rank, specs in sorted(self.node_specs.items()) if class_type in specs]
+        if len(exact) > 0:
+            return exact
+        wildcard = [rank for rank, specs in sorted(self.node_specs.items()) if "*" in specs or "ALL" in specs]
+        if len(wildcard) > 0:
+            return wildcard
+        return [self.default_rank]
+
+    def record_execution(self, class_type, seconds):
+        with self.lock:
+            self._add_execution_time(class_type, seconds)
+            self.unshared_times.append((class_type, seconds))
+
+    def _add_execution_time(self, class_type, seconds):
+        old = self.class_times.get(class_type, None)
+        self.class_times[class_type] = seconds if old is None else old * (1 - self.smoothing) + seconds * self.smoothing
+
+    def record_outputs(self, node_id, outputs):
+        """执行后记录输出大小，用于内存和传输代价估计"""
+        size = estimate_memory(outputs)
+        with self.lock:
+            self.node_memory[node_id] = size
+            self.output_sizes[node_id] = size
+            self.unshared_outputs[node_id] = size
+
+    def take_measurements(self):
+        """取出上次调用之后本rank记录的执行时间和输出大小，交给其他rank的merge_measurements()"""
+        with self.lock:
+            measurements = {"times": self.unshared_times, "outputs": self.unshared_outputs}
+            self.unshared_times = []
+            self.unshared_outputs = {}
+            return measurements
+
+    def merge_measurements(self, measurements):
+        """合并其他rank上执行的节点的测量数据"""
+        with self.lock:
+            for class_type, seconds in measurements["times"]:
+                self._add_execution_time(class_type, seconds)
+            for node_id, size in measurements["outputs"].items():
+                self.node_memory[node_id] = size
+                self.output_sizes[node_id] = size
+
+    def execution_time(self, node_id):
+        class_type = self.nodes.get(node_id, {}).get("class_type", None)
+        return self.class_times.get(class_type, self.default_execution_time)
+
+    def rank_loads(self, exclude=None):
+        loads = {rank: 0.0 for rank in range(self.world_size)}
+        for node_id, rank in self.assignments.items():
+            if node_id != exclude:
+                loads[rank] = loads.get(rank, 0.0) + self.execution_time(node_id)
+        return loads
+
+    def rank_memory(self, exclude=None):
+        memory = {rank: 0 for rank in range(self.world_size)}
+        for node_id, rank in self.assignments.items():
+            if node_id != exclude:
+                memory[rank] = memory.get(rank, 0) + self.node_memory.get(node_id, 0)
+        return memory
+
+    def transfer_cost(self, node_id, rank):
+        cost = 0.0
+        node = self.nodes.get(node_id, {})
+        # 上游输出需要传到这个rank
+        for value in node.get("inputs", {}).values():
+            if is_link(value) and value[0] in self.assignments and self.assignments[value[0]] != rank:
+                cost += self.output_sizes.get(value[0], 0) / self.transfer_bandwidth
+        # 这个节点的输出需要传给已放置的下游节点
+        for other_id, other in self.nodes.items():
+            if other_id == node_id or other_id not in self.assignments or self.assignments[other_id] == rank:
+                continue
+            for value in other.get("inputs", {}).values():
+                if is_link(value) and value[0] == node_id:
+                    cost += self.output_sizes.get(node_id, 0) / self.transfer_bandwidth
+        return cost
+
+    def placement_cost(self, node_id, rank, loads, memory):
+        capacity = self.memory_capacity.get(rank, None)
+        if capacity is not None and memory.get(rank, 0) + self.node_memory.get(node_id, 0) > capacity:
+            return float("inf")
+        return loads.get(rank, 0.0) + self.execution_time(node_id) + self.transfer_cost(node_id, rank)
+
+    def place(self, node_id, node_data, rank=None):
+        """为节点选择rank并记录，rank不为None时直接使用指定的rank"""
+        with self.lock:
+            self.nodes[node_id] = node_data
+            if rank is not None:
+                self.assignments[node_id] = rank
+                self.pinned.add(node_id)
+                return rank
+            candidates = self.candidate_ranks(node_data.get("class_type", None))
+            loads = self.rank_loads(exclude=node_id)
+            memory = self.rank_memory(exclude=node_id)
+            best = min(candidates, key=lambda r: (self.placement_cost(node_id, r, loads, memory), loads.get(r, 0.0), r))
+            self.assignments[node_id] = best
+            return best
+
+    def remove(self, node_id):
+        with self.lock:
+            self.nodes.pop(node_id, None)
+            self.assignments.pop(node_id, None)
+            self.pinned.discard(node_id)
+
+    def rebalance(self):
+        """
+        负载最高的rank超过平均负载hot_ratio倍时，反复把最热rank上的节点移到代价更低的候选rank。
+        返回[(node_id, 原rank, 新rank)]。
+        """
+        moves = []
+        with self.lock:
+            if len(self.assignments) == 0:
+                return moves
+            loads = self.rank_loads()
+            mean = sum(loads.values()) / max(len(loads), 1)
+            if mean == 0 or max(loads.values()) <= mean * self.hot_ratio:
+                return moves
+            # 触发后一直迁移到没有能降低代价的移动为止
+            for _ in range(len(self.assignments)):
+                loads = self.rank_loads()
+                hot = max(loads, key=lambda r: loads[r])
+                moved = False
+                # 先移动执行时间长的节点
+                nodes = sorted([n for n, r in self.assignments.items() if r == hot and n not in self.pinned], key=lambda n: -self.execution_time(n))
+                for node_id in nodes:
+                    candidates = [r for r in self.candidate_ranks(self.nodes[node_id].get("class_type", None)) if r != hot]
+                    if len(candidates) == 0:
+                        continue
+                    loads = self.rank_loads(exclude=node_id)
+                    memory = self.rank_memory(exclude=node_id)
+                    current = self.placement_cost(node_id, hot, loads, memory)
+                    target = min(candidates, key=lambda r: (self.placement_cost(node_id, r, loads, memory), r))
+                    # 只有移动后新rank不会比原来的热点更热，且总代价下降时才移动
+                    if self.placement_cost(node_id, target, loads, memory) < current:
+                        self.assignments[node_id] = target
+                        moves.append((node_id, hot, target))
+                        moved = True
+                        break
+                if not moved:
+                    break
+        for node_id, old, new in moves:
+            logging.info(f"Rebalanced node {node_id} from rank {old} to rank {new}")
+        return moves
+
+    def get_table(self):
+        """发布的分配表"""
+        with self.lock:
+            return {
+                "assignments": dict(self.assignments),
+                "load": self.rank_loads(),
+                "memory": self.rank_memory(),
+                "class_times": dict(self.class_times),
+            }
@@ -0,0 +1,191 @@
+import collections
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+
+import torch.distributed as dist
+
+from dist_utils import get_transport_group, isend_object, send_object, recv_object, REQUEST_TAG
+
+# 每个请求的响应使用自己的tag，多个请求可以同时在途，互不干扰
+RESPONSE_TAG_BASE = 1024
+RESPONSE_TAG_SPACE = 1 << 20
+# 接收请求连续失败时的退避，超过次数认为对端已经不在，停止服务
+RECEIVE_BACKOFF_MAX = 5.0
+RECEIVE_MAX_FAILURES = 10
+
+class NodeOutputRPC:
+    """
+    跨rank获取节点输出的RPC层。
+
+    请求都发到REQUEST_TAG上，带上请求编号和响应tag；服务端在线程池里取输出并用该tag回复，
+    所以一个慢的大张量响应不会挡住其他请求。请求方每个请求返回一个Future，同一个输出的并发请求
+    只发一次，prefetch()提前发起请求，之后fetch()直接拿已经在途或已经到达的结果。
+    预取的结果超过prefetch_ttl秒没被取走，或者未取走的预取超过max_prefetched个时丢掉最早的。
+    服务线程阻塞在任意来源的recv上，serving = False打断不了它，退出前所有rank都要调用stop()。
+    """
+    def __init__(self, rank, get_local_output, max_workers=4, device=None, prefetch_ttl=300.0, max_prefetched=64):
+        self.rank = rank
+        self.get_local_output = get_local_output
+        self.device = device
+        self.request_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.send_locks = {} # 目标rank -> 锁，同一个tag上的请求不能交错发送
+        self.pending = {} # (rank, node_id, output_index) -> Future
+        self.prefetched = collections.OrderedDict() # 还没被取走的预取 key -> 发起时间
+        self.prefetch_ttl = prefetch_ttl
+        self.max_prefetched = max_prefetched
+        self.recv_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="node_rpc_recv")
+        self.serve_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="node_rpc_serve")
+        self.stats = {"requests": 0, "prefetched": 0, "prefetch_hits": 0, "prefetch_expired": 0, "served": 0}
+        self.serving = False
+        self.thread = None
+
+    def _send_lock(self, rank):
+        with self.lock:
+            if rank not in self.send_locks:
+                self.send_locks[rank] = threading.Lock()
+            return self.send_locks[rank]
+
+    def request(self, target_rank, node_id, output_index=0):
+        """发起请求并返回Future，同一个输出已经在途时复用"""
+        key = (target_rank, node_id, output_index)
+        with self.lock:
+            future = self.pending.get(key, None)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+            request_id = next(self.request_ids)
+            response_tag = RESPONSE_TAG_BASE + request_id % RESPONSE_TAG_SPACE
+            self.stats["requests"] += 1
+        # 先挂起接收再发请求，响应到达时已经有人在等
+        future = self.recv_pool.submit(self._receive, target_rank, response_tag)
+        with self.lock:
+            self.pending[key] = future
+        with self._send_lock(target_rank):
+            isend_object({
+                "request_id": request_id,
+                "node_id": node_id,
+                "output_index": output_index,
+                "response_tag": response_tag,
+            }, dst=target_rank, tag=REQUEST_TAG, device=self.device).wait()
+        return future
+
+    def _receive(self, target_rank, response_tag):
+        response, _ = recv_object(src=target_rank, tag=response_tag, device=self.device)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["output"]
+
+    def prefetch(self, target_rank, node_id, output_index=0):
+        """推测性地提前拉取，传输和本地计算重叠"""
+        key = (target_rank, node_id, output_index)
+        with self.lock:
+            self._expire_prefetched()
+            if key in self.pending:
+                return self.pending[key]
+            self.stats["prefetched"] += 1
+        future = self.request(target_rank, node_id, output_index)
+        with self.lock:
+            if self.pending.get(key, None) is future:
+                self.prefetched[key] = time.monotonic()
+                self._expire_prefetched()
+        return future
+
+    def _expire_prefetched(self):
+        # 需要持有self.lock
+        deadline = time.monotonic() - self.prefetch_ttl
+        while len(self.prefetched) > 0:
+            key, started = next(iter(self.prefetched.items()))
+            if started >= deadline and len(self.prefetched) <= self.max_prefetched:
+                break
+            del self.prefetched[key]
+            self.pending.pop(key, None)
+            self.stats["prefetch_expired"] += 1
+
+    def fetch(self, target_rank, node_id, output_index=0, timeout=None):
+        """阻塞获取远程输出，结果被取走后从缓存中移除"""
+        key = (target_rank, node_id, output_index)
+        with self.lock:
+            future = self.pending.get(key, None)
+            if future is not None:
+                self.stats["prefetch_hits"] += 1
+        if future is None:
+            future = self.request(target_rank, node_id, output_index)
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            with self.lock:
+                if self.pending.get(key, None) is future:
+                    del self.pending[key]
+                    self.prefetched.pop(key, None)
+
+    def invalidate(self, node_id):
+        """节点输出变了，丢掉还没被取走的预取结果"""
+        with self.lock:
+            for key in [k for k in self.pending if k[1] == node_id]:
+                del self.pending[key]
+                self.prefetched.pop(key, None)
+
+    def start(self):
+        if self.serving:
+            return
+        self.serving = True
+        self.thread = threading.Thread(target=self._serve_loop, daemon=True, name="node_rpc_server")
+        self.thread.start()
+
+    def stop(self, timeout=30.0):
+        """
+        停止服务，所有rank都要在不再发请求之后调用（比如barrier之后）。gloo不能给自己发消息，
+        每个rank给环上的下一个rank发停止请求，每个服务线程正好收到一个，然后等本rank的服务线程退出。
+        """
+        world_size = dist.get_world_size(get_transport_group())
+        if world_size > 1:
+            with self._send_lock((self.rank + 1) % world_size):
+                isend_object({"stop": True}, dst=(self.rank + 1) % world_size, tag=REQUEST_TAG, device=self.device).wait()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logging.warning("Node output server did not stop within {} seconds".format(timeout))
+            self.thread = None
+        self.serving = False
+        self.serve_pool.shutdown(wait=True)
+        self.recv_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _serve_loop(self):
+        failures = 0
+        while self.serving:
+            try:
+                request, requester_rank = recv_object(tag=REQUEST_TAG, device=self.device)
+            except Exception as e:
+                failures += 1
+                if failures >= RECEIVE_MAX_FAILURES:
+                    logging.error(f"Error receiving remote request, stopping the node output server after {failures} failures: {e}")
+                    self.serving = False
+                    break
+                logging.error(f"Error receiving remote request: {e}")
+                time.sleep(min(0.1 * 2 ** (failures - 1), RECEIVE_BACKOFF_MAX))
+                continue
+            failures = 0
+            if request.get("stop", False):
+                break
+            self.serve_pool.submit(self._serve, request, requester_rank)
+        self.serving = False
+
+    def _serve(self, request, requester_rank):
+        try:
+            response = {"request_id": request["request_id"], "output": self.get_local_output(request["node_id"], request["output_index"])}
+        except Exception as e:
+            logging.error(f"Error handling remote request: {e}")
+            response = {"request_id": request["request_id"], "error": str(e)}
+        try:
+            send_object(response, dst=requester_rank, tag=request["response_tag"], device=self.device)
+            with self.lock:
+                self.stats["served"] += 1
+        except Exception as e:
+            logging.error(f"Error sending remote response: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.pending))
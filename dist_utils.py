@@ -1,6 +1,12 @@
 import torch
 import torch.distributed as dist
 import os
+import io
+import pickle
+
+# 请求和响应使用不同的tag，避免请求处理线程收到发给请求方的响应
+REQUEST_TAG = 1
+RESPONSE_TAG = 2
 
 def init_distributed_env(backend="nccl"):
     """初始化分布式环境"""
@@ -13,15 +19,167 @@ def init_distributed_env(backend="nccl"):
         torch.cuda.set_device(local_rank)
         # 初始化进程组
         dist.init_process_group(backend=backend)
+        init_transport_group()
         return True, rank, world_size, local_rank
     return False, 0, 1, 0
 
-def tensor_to_bytes(tensor):
-    """将张量序列化为字节"""
-    buffer = torch.ByteStorage.from_buffer(tensor.contiguous().cpu().numpy().tobytes())
-    return torch.ByteTensor(buffer)
+# 点对点传输和控制消息使用的进程组。依赖tag和任意来源的recv，nccl两者都不支持，
+# 所以默认进程组是nccl时另建一个gloo进程组
+_transport_group = None
+
+def init_transport_group():
+    """默认进程组初始化之后由所有rank调用"""
+    global _transport_group
+    if dist.get_backend() != "gloo":
+        _transport_group = dist.new_group(backend="gloo")
+    else:
+        _transport_group = None
+
+def get_transport_group():
+    """传输使用的进程组，None表示默认进程组（已经是gloo）"""
+    if _transport_group is None and dist.get_backend() != "gloo":
+        raise RuntimeError("Node output transport needs tagged and any-source point to point messages, which the {} backend does not support. "
+                           "Initialize the process group with init_distributed_env or call init_transport_group on every rank.".format(dist.get_backend()))
+    return _transport_group
+
+def get_transport_device():
+    """传输走gloo，缓冲区放在CPU上"""
+    return torch.device("cpu")
+
+def bytes_to_uint8_tensor(data, device="cpu"):
+    """字节转uint8张量，直接使用缓冲区，不经过Python int列表"""
+    tensor = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+    return tensor.to(device)
+
+def uint8_tensor_to_bytes(tensor):
+    return tensor.cpu().numpy().tobytes()
+
+class _TensorPickler(pickle.Pickler):
+    """把张量替换成编号，张量本身单独发送"""
+    def __init__(self, file, tensors):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tensors = tensors
+        self.tensor_ids = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, torch.Tensor) and obj.layout == torch.strided:
+            index = self.tensor_ids.get(id(obj), None)
+            if index is None:
+                index = len(self.tensors)
+                self.tensor_ids[id(obj)] = index
+                self.tensors.append(obj)
+            return index
+        return None
+
+class _TensorUnpickler(pickle.Unpickler):
+    def __init__(self, file, tensors):
+        super().__init__(file)
+        self.tensors = tensors
+
+    def persistent_load(self, pid):
+        return self.tensors[pid]
+
+def pack_object(obj):
+    """
+    拆分对象：返回(header, tensors)。header是不含张量数据的pickle字节（包含每个张量的dtype、shape、device），
+    tensors是需要单独发送的张量列表。
+    """
+    tensors = []
+    body = io.BytesIO()
+    _TensorPickler(body, tensors).dump(obj)
+    metas = [(t.dtype, tuple(t.shape), t.device.type) for t in tensors]
+    header = pickle.dumps((metas, body.getvalue()), protocol=pickle.HIGHEST_PROTOCOL)
+    return header, tensors
+
+def unpack_object(header, tensors):
+    _, body = pickle.loads(header)
+    return _TensorUnpickler(io.BytesIO(body), tensors).load()
+
+def _as_bytes(tensor, device):
+    """张量按字节视图发送，所有dtype走同一路径（bfloat16、bool等gloo未必支持的类型也可以）"""
+    return tensor.detach().to(device).contiguous().reshape(-1).view(torch.uint8)
+
+class PendingSend:
+    """isend_object返回的句柄，wait()之前要保持发送缓冲区存活"""
+    def __init__(self, works, buffers):
+        self.works = works
+        self.buffers = buffers
+
+    def wait(self):
+        for work in self.works:
+            work.wait()
+        self.buffers = None
+
+def isend_object(obj, dst, tag=0, device=None):
+    """
+    异步发送任意对象：header长度、header和每个张量的存储一次性全部用isend发出，
+    张量数据不经过pickle也不转换成Python列表。同一个(dst, tag)上同时只能有一个对象在发送。
+    """
+    if device is None:
+        device = get_transport_device()
+    group = get_transport_group()
+    header, tensors = pack_object(obj)
+    buffers = [torch.tensor([len(header)], dtype=torch.long, device=device), bytes_to_uint8_tensor(header, device)]
+    for tensor in tensors:
+        if tensor.numel() > 0:
+            buffers.append(_as_bytes(tensor, device))
+    works = [dist.isend(buffer, dst=dst, group=group, tag=tag) for buffer in buffers]
+    return PendingSend(works, buffers)
+
+def send_object(obj, dst, tag=0, device=None):
+    isend_object(obj, dst, tag=tag, device=device).wait()
+
+def recv_object(src=None, tag=0, device=None):
+    """
+    接收send_object发送的对象，返回(对象, 发送方rank)。知道header后所有张量的irecv同时挂起。
+    张量恢复到发送方张量所在的设备类型上。
+    """
+    if device is None:
+        device = get_transport_device()
+    group = get_transport_group()
+    size = torch.zeros(1, dtype=torch.long, device=device)
+    src = dist.recv(size, src=src, group=group, tag=tag)
+    header = torch.empty(int(size.item()), dtype=torch.uint8, device=device)
+    dist.recv(header, src=src, group=group, tag=tag)
+    header = uint8_tensor_to_bytes(header)
+    metas, _ = pickle.loads(header)
+    buffers = []
+    works = []
+    for dtype, shape, device_type in metas:
+        count = 1
+        for dim in shape:
+            count *= dim
+        nbytes = count * torch.empty((), dtype=dtype).element_size()
+        data = torch.empty(nbytes, dtype=torch.uint8, device=device)
+        if nbytes > 0:
+            works.append(dist.irecv(data, src=src, group=group, tag=tag))
+        buffers.append(data)
+    for work in works:
+        work.wait()
+    tensors = []
+    for data, (dtype, shape, device_type) in zip(buffers, metas):
+        tensor = data.view(dtype).reshape(shape)
+        if device_type == "cpu":
+            tensor = tensor.cpu()
+        elif device_type == "cuda" and tensor.device.type != "cuda" and torch.cuda.is_available():
+            tensor = tensor.cuda()
+        tensors.append(tensor)
+    return unpack_object(header, tensors), src
 
-def bytes_to_tensor(bytes_tensor, dtype=torch.float32, device="cuda"):
-    """将字节反序列化为张量"""
-    tensor = torch.FloatTensor(torch.frombuffer(bytes_tensor.cpu().numpy(), dtype=torch.float32))
-    return tensor.to(device=device, dtype=dtype)
\ No newline at end of file
+def broadcast_object(obj, src, device=None):
+    """广播小对象（不含大张量），所有rank都需要调用"""
+    if device is None:
+        device = get_transport_device()
+    group = get_transport_group()
+    if dist.get_rank() == src:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        size = torch.tensor([len(data)], dtype=torch.long, device=device)
+    else:
+        size = torch.zeros(1, dtype=torch.long, device=device)
+    dist.broadcast(size, src=src, group=group)
+    if dist.get_rank() == src:
+        payload = bytes_to_uint8_tensor(data, device)
+    else:
+        payload = torch.empty(int(size.item()), dtype=torch.uint8, device=device)
+    dist.broadcast(payload, src=src, group=group)
+    return pickle.loads(uint8_tensor_to_bytes(payload))
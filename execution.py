@@ -1,8 +1,10 @@
 import sys
 import copy
+import collections
+import contextlib
+import concurrent.futures
 import logging
 import threading
-import heapq
 import time
 import traceback
 from enum import Enum
@@ -13,10 +15,15 @@ import torch
 import nodes
 
 import comfy.model_management
-from comfy_execution.graph import get_input_info, ExecutionList, DynamicPrompt, ExecutionBlocker
+from comfy_execution.graph import get_input_info, ExecutionList, DynamicPrompt, ExecutionBlocker, TopologicalSort
 from comfy_execution.graph_utils import is_link, GraphBuilder
-from comfy_execution.caching import HierarchicalCache, LRUCache, CacheKeySetInputSignature, CacheKeySetID
+from comfy_execution.utils import CurrentNodeContext
+from comfy_execution.caching import HierarchicalCache, LRUCache, SizeAwareCache, CacheKeySetInputSignature, CacheKeySetID, to_hashable
 from comfy_execution.validation import validate_node_input
+from comfy_execution import schema_registry
+from comfy_execution import prompt_batch
+from comfy_execution.prompt_scheduler import PromptScheduler
+from comfy_execution.history_store import HistoryStore
 
 class ExecutionResult(Enum):
     SUCCESS = 0
@@ -60,13 +67,22 @@ class IsChangedCache:
         return self.is_changed[node_id]
 
 class CacheSet:
-    def __init__(self, lru_size=None):
-        if lru_size is None or lru_size == 0:
+    def __init__(self, lru_size=None, ram_budget=0, vram_budget=0, disk=None):
+        self.disk = disk
+        if ram_budget > 0 or vram_budget > 0:
+            self.init_size_aware_cache(ram_budget, vram_budget)
+        elif lru_size is None or lru_size == 0:
             self.init_classic_cache()
         else:
             self.init_lru_cache(lru_size)
         self.all = [self.outputs, self.ui, self.objects]
 
+    # Keeps as much as fits in the given RAM/VRAM budgets (in bytes)
+    def init_size_aware_cache(self, ram_budget, vram_budget):
+        self.outputs = SizeAwareCache(CacheKeySetInputSignature, ram_budget=ram_budget, vram_budget=vram_budget)
+        self.ui = LRUCache(CacheKeySetInputSignature, max_size=10000)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
     # Useful for those with ample RAM/VRAM -- allows experimenting without
     # blowing away the cache every time
     def init_lru_cache(self, cache_size):
@@ -87,8 +103,45 @@ class CacheSet:
         }
         return result
 
+    def get_stats(self):
+        stats = {
+            "outputs": self.outputs.get_stats(),
+            "ui": self.ui.get_stats(),
+        }
+        if self.disk is not None:
+            stats["disk"] = self.disk.get_stats()
+        return stats
+
+    def populate_from_disk(self, dynprompt, output_node_ids):
+        # Walk up from the outputs and stop at anything we already have, so we only read
+        # the files for the nodes closest to the outputs and skip their whole ancestry.
+        if self.disk is None:
+            return []
+        loaded = []
+        visited = set()
+        to_visit = list(output_node_ids)
+        while len(to_visit) > 0:
+            node_id = to_visit.pop()
+            if node_id in visited:
+                continue
+            visited.add(node_id)
+            if self.outputs.get(node_id) is not None:
+                continue
+            node = dynprompt.get_node(node_id)
+            key = self.outputs.cache_key_set.get_data_key(node_id)
+            if self.disk.is_cacheable(key, node["class_type"]) and self.disk.contains(key):
+                output = self.disk.get(key)
+                if output is not None:
+                    self.outputs.set(node_id, output)
+                    loaded.append(node_id)
+                    continue
+            for value in node["inputs"].values():
+                if is_link(value):
+                    to_visit.append(value[0])
+        return loaded
+
 def get_input_data(inputs, class_def, unique_id, outputs=None, dynprompt=None, extra_data={}):
-    valid_inputs = class_def.INPUT_TYPES()
+    valid_inputs = schema_registry.get_input_types(class_def)
     input_data_all = {}
     missing_keys = {}
     for x in inputs:
@@ -237,6 +290,26 @@ def get_output_data(obj, input_data_all, execution_block_cb=None, pre_execute_cb
         ui = {k: [y for x in uis for y in x[k]] for k in uis[0].keys()}
     return output, ui, has_subgraph
 
+# Nodes can declare EXECUTION_RESOURCE = "cpu" or "io" when they never touch the GPU or
+# comfy.model_management. The parallel scheduler runs those on a thread pool next to the
+# GPU work. Everything else is treated as "gpu" and executes one node at a time.
+def get_node_resource_type(class_def):
+    resource = getattr(class_def, "EXECUTION_RESOURCE", "gpu")
+    if resource not in ("gpu", "cpu", "io"):
+        return "gpu"
+    return resource
+
+@contextlib.contextmanager
+def released_lock(lock):
+    if lock is None:
+        yield
+        return
+    lock.release()
+    try:
+        yield
+    finally:
+        lock.acquire()
+
 def format_value(x):
     if x is None:
         return None
@@ -245,7 +318,7 @@ def format_value(x):
     else:
         return str(x)
 
-def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results):
+def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, state_lock=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -260,6 +333,7 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
         return (ExecutionResult.SUCCESS, None, None)
 
     input_data_all = None
+    execution_time = None
     try:
         if unique_id in pending_subgraph_results:
             cached_results = pending_subgraph_results[unique_id]
@@ -294,7 +368,8 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
                 caches.objects.set(unique_id, obj)
 
             if hasattr(obj, "check_lazy_status"):
-                required_inputs = _map_node_over_list(obj, input_data_all, "check_lazy_status", allow_interrupt=True)
+                with CurrentNodeContext(prompt_id, unique_id, display_node_id):
+                    required_inputs = _map_node_over_list(obj, input_data_all, "check_lazy_status", allow_interrupt=True)
                 required_inputs = set(sum([r for r in required_inputs if isinstance(r,list)], []))
                 required_inputs = [x for x in required_inputs if isinstance(x,str) and (
                     x not in input_data_all or x in missing_keys
@@ -324,7 +399,11 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
                     return block
             def pre_execute_cb(call_index):
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb)
+            execution_start_time = time.perf_counter()
+            # When running in parallel, the caller holds state_lock for everything but the node itself
+            with released_lock(state_lock), CurrentNodeContext(prompt_id, unique_id, display_node_id):
+                output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb)
+            execution_time = time.perf_counter() - execution_start_time
         if len(output_ui) > 0:
             caches.ui.set(unique_id, {
                 "meta": {
@@ -375,6 +454,10 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
             pending_subgraph_results[unique_id] = cached_outputs
             return (ExecutionResult.PENDING, None, None)
         caches.outputs.set(unique_id, output_data)
+        if execution_time is not None:
+            caches.outputs.record_execution_time(unique_id, execution_time)
+            if caches.disk is not None and parent_node_id is None:
+                caches.disk.put(caches.outputs.cache_key_set.get_data_key(unique_id), class_type, output_data, execution_time)
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
 
@@ -414,13 +497,24 @@ def execute(server, dynprompt, caches, current_item, extra_data, executed, promp
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, lru_size=None):
+    def __init__(self, server, lru_size=None, cache_ram_gb=0, cache_vram_gb=0, disk_cache=None, parallel_workers=0, device=None):
         self.lru_size = lru_size
+        self.device = device
+        self.parallel_workers = parallel_workers
+        self.gpu_pool = None
+        self.cpu_pool = None
+        if parallel_workers > 0:
+            self.gpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="comfy-gpu")
+            self.cpu_pool = concurrent.futures.ThreadPoolExecutor(max_workers=parallel_workers, thread_name_prefix="comfy-cpu")
+        self.cache_ram_budget = int(cache_ram_gb * 1024 * 1024 * 1024)
+        self.cache_vram_budget = int(cache_vram_gb * 1024 * 1024 * 1024)
+        # The disk cache outlives reset() on purpose
+        self.disk_cache = disk_cache
         self.server = server
         self.reset()
 
     def reset(self):
-        self.caches = CacheSet(self.lru_size)
+        self.caches = CacheSet(self.lru_size, ram_budget=self.cache_ram_budget, vram_budget=self.cache_vram_budget, disk=self.disk_cache)
         self.status_messages = []
         self.success = True
 
@@ -461,7 +555,14 @@ class PromptExecutor:
             }
             self.add_message("execution_error", mes, broadcast=False)
 
+    def bind_current_thread(self):
+        if self.device is not None:
+            comfy.model_management.set_current_thread_device(self.device)
+        self.server.bind_current_thread()
+
     def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
+        # Bind first so only this worker's interrupt flag is cleared
+        self.bind_current_thread()
         nodes.interrupt_processing(False)
 
         if "client_id" in extra_data:
@@ -478,6 +579,7 @@ class PromptExecutor:
             for cache in self.caches.all:
                 cache.set_prompt(dynamic_prompt, prompt.keys(), is_changed_cache)
                 cache.clean_unused()
+            self.caches.populate_from_disk(dynamic_prompt, execute_outputs)
 
             cached_nodes = []
             for node_id in prompt:
@@ -495,24 +597,28 @@ class PromptExecutor:
             for node_id in list(execute_outputs):
                 execution_list.add_node(node_id)
 
-            while not execution_list.is_empty():
-                node_id, error, ex = execution_list.stage_node_execution()
-                if error is not None:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-
-                result, error, ex = execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results)
-                self.success = result != ExecutionResult.FAILURE
-                if result == ExecutionResult.FAILURE:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-                elif result == ExecutionResult.PENDING:
-                    execution_list.unstage_node_execution()
-                else: # result == ExecutionResult.SUCCESS:
-                    execution_list.complete_node_execution()
+            if self.parallel_workers > 0:
+                if self.execute_parallel(dynamic_prompt, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, current_outputs):
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
             else:
-                # Only execute when the while-loop ends without break
-                self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
+                while not execution_list.is_empty():
+                    node_id, error, ex = execution_list.stage_node_execution()
+                    if error is not None:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+
+                    result, error, ex = execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results)
+                    self.success = result != ExecutionResult.FAILURE
+                    if result == ExecutionResult.FAILURE:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_node_execution()
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_node_execution()
+                else:
+                    # Only execute when the while-loop ends without break
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
 
             ui_outputs = {}
             meta_outputs = {}
@@ -530,6 +636,79 @@ class PromptExecutor:
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
 
+    def execute_parallel(self, dynamic_prompt, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, current_outputs):
+        """
+        Runs every ready node at once: "gpu" nodes one at a time on their own thread and "cpu"/"io"
+        nodes on a thread pool. All graph, cache and pending_subgraph_results bookkeeping happens
+        under state_lock, which execute() only releases while the node function itself runs, so
+        the scheduling state sees the same sequence of updates as the sequential loop.
+        Returns True if every node completed.
+        """
+        state_lock = threading.Lock()
+
+        def run_node(node_id):
+            self.bind_current_thread()
+            with torch.inference_mode():
+                with state_lock:
+                    return execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, state_lock=state_lock)
+
+        in_flight = {}
+        gpu_busy = False
+        failure = None
+        while True:
+            with state_lock:
+                if failure is None:
+                    ready = execution_list.get_parallel_ready_nodes()
+                    gpu_ready = []
+                    for node_id in ready:
+                        class_type = dynamic_prompt.get_node(node_id)["class_type"]
+                        resource = get_node_resource_type(nodes.NODE_CLASS_MAPPINGS[class_type])
+                        if resource == "gpu":
+                            gpu_ready.append(node_id)
+                            continue
+                        execution_list.stage_parallel_node_execution(node_id)
+                        in_flight[self.cpu_pool.submit(run_node, node_id)] = (node_id, resource)
+                    if not gpu_busy and len(gpu_ready) > 0:
+                        node_id = execution_list.ux_friendly_pick_node(gpu_ready)
+                        execution_list.stage_parallel_node_execution(node_id)
+                        in_flight[self.gpu_pool.submit(run_node, node_id)] = (node_id, "gpu")
+                        gpu_busy = True
+
+                    if len(in_flight) == 0:
+                        if execution_list.is_empty():
+                            break
+                        # Nothing is ready or running but work remains, which means a cycle.
+                        # Let the sequential staging code work out which node to blame.
+                        node_id, error, ex = execution_list.stage_node_execution()
+                        if error is not None:
+                            failure = (error, ex)
+                            break
+                        execution_list.unstage_node_execution()
+                        continue
+                elif len(in_flight) == 0:
+                    break
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            with state_lock:
+                for future in done:
+                    node_id, resource = in_flight.pop(future)
+                    if resource == "gpu":
+                        gpu_busy = False
+                    result, error, ex = future.result()
+                    if result == ExecutionResult.FAILURE:
+                        execution_list.unstage_parallel_node_execution(node_id)
+                        if failure is None:
+                            failure = (error, ex)
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_parallel_node_execution(node_id)
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_parallel_node_execution(node_id)
+
+        self.success = failure is None
+        if failure is not None:
+            self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, failure[0], failure[1])
+            return False
+        return True
 
 def validate_inputs(prompt, item, validated):
     unique_id = item
@@ -540,7 +719,7 @@ def validate_inputs(prompt, item, validated):
     class_type = prompt[unique_id]['class_type']
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
+    class_inputs = schema_registry.get_input_types(obj_class)
     valid_inputs = set(class_inputs.get('required',{})).union(set(class_inputs.get('optional',{})))
 
     errors = []
@@ -765,7 +944,7 @@ def full_type_name(klass):
         return klass.__qualname__
     return module + '.' + klass.__qualname__
 
-def validate_prompt(prompt):
+def validate_prompt_uncached(prompt):
     outputs = set()
     for x in prompt:
         if 'class_type' not in prompt[x]:
@@ -873,39 +1052,210 @@ def validate_prompt(prompt):
 
     return (True, None, list(good_outputs), node_errors)
 
+def is_widget_value(value):
+    # Lists are links, everything else is a widget value (see validate_inputs)
+    return not isinstance(value, list)
+
+def same_value(a, b):
+    # 1, 1.0 and True compare equal but don't convert to the same widget value
+    return type(a) is type(b) and a == b
+
+class ValidationCache:
+    """
+    Memoizes validate_prompt per graph structure: node ids, class types, links and the set of widget
+    inputs, plus the schema registry generation so that combo choices are part of the key. Clients
+    usually resubmit the same workflow with only seeds and prompts changed; for a structure that
+    validated cleanly before, only nodes whose widget values changed go through validate_inputs
+    again (conversion, range, combo and VALIDATE_INPUTS checks) while links and unchanged widgets
+    are taken from the previous result. Any failure falls back to a full validation so the error
+    report is the same as without the cache.
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated_nodes = 0
+
+    def structure_key(self, prompt):
+        key = [schema_registry.registry.generation]
+        for node_id in sorted(prompt.keys()):
+            node = prompt[node_id]
+            class_type = node.get("class_type", None)
+            class_def = nodes.NODE_CLASS_MAPPINGS.get(class_type, None)
+            # The schema of these nodes isn't tied to the registry generation
+            if class_def is None or not isinstance(node.get("inputs", None), dict) or not schema_registry.is_cacheable(class_def):
+                return None
+            links = []
+            widgets = []
+            for name, value in node["inputs"].items():
+                if is_widget_value(value):
+                    widgets.append(name)
+                elif len(value) == 2:
+                    links.append((name, value[0], value[1]))
+                else:
+                    return None
+            key.append((node_id, class_type, id(class_def), tuple(sorted(links)), tuple(sorted(widgets))))
+        return tuple(key)
+
+    def snapshot_widgets(self, prompt):
+        return {node_id: {name: value for name, value in node["inputs"].items() if is_widget_value(value)} for node_id, node in prompt.items()}
+
+    def validate(self, prompt):
+        try:
+            key = self.structure_key(prompt)
+            hash(key)
+        except (TypeError, AttributeError):
+            key = None
+        if key is None:
+            return validate_prompt_uncached(prompt)
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is not None:
+            result = self.validate_changed(prompt, entry)
+            if result is not None:
+                with self.lock:
+                    self.hits += 1
+                return result
+
+        raw_widgets = self.snapshot_widgets(prompt)
+        result = validate_prompt_uncached(prompt)
+        with self.lock:
+            self.misses += 1
+            if result[0] is True and len(result[3]) == 0:
+                converted = self.snapshot_widgets(prompt)
+                widgets = {}
+                for node_id, values in raw_widgets.items():
+                    widgets[node_id] = {name: (value, converted[node_id][name]) for name, value in values.items()}
+                self.entries[key] = {"widgets": widgets, "outputs": result[2]}
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return result
+
+    def validate_changed(self, prompt, entry):
+        changed = []
+        converted = {}
+        for node_id, node in prompt.items():
+            previous = entry["widgets"][node_id]
+            values = {}
+            for name, value in node["inputs"].items():
+                if not is_widget_value(value):
+                    continue
+                old_raw, old_converted = previous[name]
+                if not same_value(value, old_raw):
+                    changed.append(node_id)
+                    break
+                values[name] = old_converted
+            else:
+                converted[node_id] = values
+
+        validated = {node_id: (True, [], node_id) for node_id in prompt if node_id not in changed}
+        for node_id in changed:
+            try:
+                m = validate_inputs(prompt, node_id, validated)
+            except Exception:
+                return None
+            if m[0] is not True:
+                return None
+        with self.lock:
+            self.revalidated_nodes += len(changed)
+        for node_id, values in converted.items():
+            prompt[node_id]["inputs"].update(values)
+        return (True, None, list(entry["outputs"]), {})
+
+    def get_stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+                "revalidated_nodes": self.revalidated_nodes,
+            }
+
+validation_cache = ValidationCache()
+
+def validate_prompt(prompt):
+    schema_registry.registry.check_filesystem()
+    return validation_cache.validate(prompt)
+
+def get_prompt_model_files(prompt):
+    # Model files referenced by loader widgets (ckpt_name, lora_name, vae_name, ...)
+    files = set()
+    for node in prompt.values():
+        inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+        for name, value in inputs.items():
+            if name.endswith("_name") and isinstance(value, str) and "." in value:
+                files.add(value)
+    return files
+
 MAXIMUM_HISTORY_SIZE = 10000
 
+# How far down the queue a worker may look for a prompt that reuses its loaded models
+AFFINITY_WINDOW = 8
+
 class PromptQueue:
-    def __init__(self, server):
+    def __init__(self, server, history_path=None):
         self.server = server
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
         self.task_counter = 0
-        self.queue = []
+        self.queue = PromptScheduler(affinity_window=AFFINITY_WINDOW)
         self.currently_running = {}
-        self.history = {}
+        self.history = HistoryStore(history_path, max_items=MAXIMUM_HISTORY_SIZE)
         self.flags = {}
+        self.worker_flags = {}
         server.prompt_queue = self
 
+    def register_worker(self, worker_id):
+        with self.mutex:
+            self.worker_flags[worker_id] = {}
+
     def put(self, item):
         with self.mutex:
-            heapq.heappush(self.queue, item)
+            self.queue.push(item)
             self.server.queue_updated()
             self.not_empty.notify()
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, affinity=None):
         with self.not_empty:
-            while len(self.queue) == 0:
+            while True:
+                self._drop_expired()
+                item = self.queue.pop(affinity)
+                if item is not None:
+                    break
                 self.not_empty.wait(timeout=timeout)
                 if timeout is not None and len(self.queue) == 0:
                     return None
-            item = heapq.heappop(self.queue)
             i = self.task_counter
             self.currently_running[i] = copy.deepcopy(item)
             self.task_counter += 1
             self.server.queue_updated()
             return (item, i)
 
+    def _drop_expired(self):
+        expired = self.queue.pop_expired()
+        for item in expired:
+            logging.info("Prompt {} passed its deadline before it could run, dropping it".format(item[1]))
+            self.history.add(item[1], {
+                "prompt": item,
+                "outputs": {},
+                "status": {
+                    "status_str": "expired",
+                    "completed": False,
+                    "messages": [("execution_expired", {"prompt_id": item[1], "deadline": item[3].get("deadline", None), "timestamp": int(time.time() * 1000)})],
+                },
+            })
+        if len(expired) > 0:
+            self.server.queue_updated()
+
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
         completed: bool
@@ -913,21 +1263,35 @@ class PromptQueue:
 
     def task_done(self, item_id, history_result,
                   status: Optional['PromptQueue.ExecutionStatus']):
+        status_dict: Optional[dict] = None
+        if status is not None:
+            status_dict = copy.deepcopy(status._asdict())
+
+        # The prompt leaves currently_running and enters history in one step, so it is never
+        # missing from both for someone looking at the queue and the history in between
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
-
-            status_dict: Optional[dict] = None
-            if status is not None:
-                status_dict = copy.deepcopy(status._asdict())
-
-            self.history[prompt[1]] = {
-                "prompt": prompt,
-                "outputs": {},
-                'status': status_dict,
-            }
-            self.history[prompt[1]].update(history_result)
+            fused_prompts = prompt[3].get("fused_prompts", None)
+            if fused_prompts is None:
+                entry = {
+                    "prompt": prompt,
+                    "outputs": {},
+                    'status': status_dict,
+                }
+                entry.update(history_result)
+                self.history.add(prompt[1], entry)
+            else:
+                # One execution for several submitted prompts, give each its own share of the outputs
+                outputs = prompt_batch.split_outputs(history_result.get("outputs", {}), [m["batch_size"] for m in fused_prompts])
+                for member, member_outputs in zip(fused_prompts, outputs):
+                    entry = {
+                        "prompt": (member["number"], member["prompt_id"], member["prompt"], member["extra_data"], member["outputs_to_execute"]),
+                        'status': copy.deepcopy(status_dict),
+                    }
+                    entry.update(history_result)
+                    entry["outputs"] = member_outputs
+                    entry["fused_into"] = prompt[1]
+                    self.history.add(member["prompt_id"], entry)
             self.server.queue_updated()
 
     def get_current_queue(self):
@@ -935,7 +1299,11 @@ class PromptQueue:
             out = []
             for x in self.currently_running.values():
                 out += [x]
-            return (out, copy.deepcopy(self.queue))
+            return (out, copy.deepcopy(self.queue.items()))
+
+    def get_queue_depths(self):
+        with self.mutex:
+            return self.queue.get_depths()
 
     def get_tasks_remaining(self):
         with self.mutex:
@@ -943,56 +1311,56 @@ class PromptQueue:
 
     def wipe_queue(self):
         with self.mutex:
-            self.queue = []
+            self.queue.clear()
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
         with self.mutex:
-            for x in range(len(self.queue)):
-                if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
-                    self.server.queue_updated()
-                    return True
+            if self.queue.remove_if(function):
+                self.server.queue_updated()
+                return True
         return False
 
-    def get_history(self, prompt_id=None, max_items=None, offset=-1):
+    def cancel(self, prompt_id):
         with self.mutex:
-            if prompt_id is None:
-                out = {}
-                i = 0
-                if offset < 0 and max_items is not None:
-                    offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        out[k] = self.history[k]
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
-                return out
-            elif prompt_id in self.history:
-                return {prompt_id: copy.deepcopy(self.history[prompt_id])}
-            else:
-                return {}
+            if self.queue.cancel(prompt_id):
+                self.server.queue_updated()
+                return True
+        return False
+
+    def get_history(self, prompt_id=None, max_items=None, offset=-1):
+        # The history store has its own lock, don't wait for the queue mutex here
+        if prompt_id is None:
+            return self.history.list(max_items=max_items, offset=offset)
+        entry = self.history.get(prompt_id)
+        if entry is None:
+            return {}
+        return {prompt_id: entry}
+
+    def get_history_page(self, cursor=None, limit=100, status=None, client_id=None):
+        return self.history.page(cursor=cursor, limit=limit, status=status, client_id=client_id)
 
     def wipe_history(self):
-        with self.mutex:
-            self.history = {}
+        self.history.clear()
 
     def delete_history_item(self, id_to_delete):
-        with self.mutex:
-            self.history.pop(id_to_delete, None)
+        self.history.delete(id_to_delete)
 
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            for flags in self.worker_flags.values():
+                flags[name] = data
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def get_flags(self, reset=True, worker_id=None):
         with self.mutex:
+            if worker_id is not None and worker_id in self.worker_flags:
+                if reset:
+                    ret = self.worker_flags[worker_id]
+                    self.worker_flags[worker_id] = {}
+                    return ret
+                return self.worker_flags[worker_id].copy()
             if reset:
                 ret = self.flags
                 self.flags = {}
@@ -1000,118 +1368,253 @@ class PromptQueue:
             else:
                 return self.flags.copy()
 
-def execute_single_node(server, node_id, node_data, extra_data, state_manager):
+class SingleNodeClassInfo:
+    """execute_single_node按类缓存的解析结果：函数、参数顺序和输出格式，避免每次调用都inspect"""
+    def __init__(self, class_def):
+        self.class_def = class_def
+        self.function = getattr(class_def, "FUNCTION", None)
+        self.callable = getattr(class_def, self.function, None) if self.function else None
+        self.param_names = []
+        self.required_params = []
+        self.accepts_kwargs = False
+        if self.callable is not None:
+            params = list(inspect.signature(self.callable).parameters.values())
+            if len(params) > 0 and params[0].name == "self":
+                params = params[1:]
+            self.param_names = [p.name for p in params]
+            self.accepts_kwargs = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params)
+            self.required_params = [p.name for p in params if p.default is inspect.Parameter.empty and p.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)]
+        return_types = getattr(class_def, "RETURN_TYPES", ())
+        self.output_is_list = list(getattr(class_def, "OUTPUT_IS_LIST", [False] * len(return_types)))
+
+single_node_class_cache = {}
+
+def get_single_node_class_info(class_type):
+    class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+    info = single_node_class_cache.get(class_type, None)
+    # 自定义节点重新加载后类对象会变，需要重新解析
+    if info is None or info.class_def is not class_def:
+        info = SingleNodeClassInfo(class_def)
+        single_node_class_cache[class_type] = info
+    return info
+
+def persistent_output_slots(outputs, list_slots=None):
+    """把持久化存储的原始输出转换成get_input_data使用的格式：每个输出槽位是一个值列表"""
+    if not isinstance(outputs, (list, tuple)):
+        outputs = (outputs,)
+    list_slots = list_slots or []
+    return [value if i < len(list_slots) and list_slots[i] else [value] for i, value in enumerate(outputs)]
+
+def single_node_input_hash(class_type, class_def, inputs, input_data_all, state_manager):
+    """
+    节点输入的哈希：常量输入 + 上游输出的版本号 + IS_CHANGED的结果。
+    上游版本未知或者节点是NOT_IDEMPOTENT时返回None，节点总会重新执行。
+    """
+    if getattr(class_def, "NOT_IDEMPOTENT", False):
+        return None
+    values = []
+    for input_name, value in sorted(inputs.items()):
+        if is_link(value):
+            ref_node_id, output_idx = value
+            version = state_manager.get_output_version(ref_node_id)
+            if version is None or (hasattr(state_manager, "is_remote") and state_manager.is_remote(ref_node_id)):
+                return None
+            values.append((input_name, ("link", ref_node_id, output_idx, version)))
+        else:
+            values.append((input_name, to_hashable(value)))
+    if hasattr(class_def, "IS_CHANGED"):
+        # NaN和无法哈希的结果每次比较都不相等，节点总会重新执行
+        values.append(("IS_CHANGED", to_hashable(_map_node_over_list(class_def, input_data_all, "IS_CHANGED"))))
+    return (class_type, tuple(values))
+
+def execute_single_node(server, node_id, node_data, extra_data, state_manager, force=False):
+    """
+    单独执行一个节点，上游输出从state_manager中获取。
+
+    输入解析和执行使用和完整工作流相同的get_input_data/get_output_data，所以optional、hidden输入、
+    INPUT_IS_LIST和列表批处理都能正常工作。持久化节点的实例保存在persistent_nodes[node_id]["instance"]中，
+    输入哈希和上次执行相同时直接返回已有的输出（force为True时总是执行）。返回(outputs, error)。
+    """
     class_type = node_data["class_type"]
+    extra_data = extra_data or {}
+    inputs = node_data.get("inputs", {})
     
     # 确保节点类型存在
     if class_type not in nodes.NODE_CLASS_MAPPINGS:
         return None, f"Node class {class_type} not found"
     
-    # 获取节点类和实例
-    node_class = nodes.NODE_CLASS_MAPPINGS[class_type]
-    
-    # 获取需要的输入参数
-    input_types = node_class().INPUT_TYPES()
-    required_inputs = input_types.get("required", {})
-    
-    # 构建输入值字典
-    input_names_to_values = {}
-    
-    for input_name in required_inputs:
-        if input_name in node_data["inputs"]:
-            input_value = node_data["inputs"][input_name]
-            
-            # 处理引用其他节点输出的情况
-            if isinstance(input_value, list) and len(input_value) == 2:
-                if isinstance(input_value[0], str) and isinstance(input_value[1], int):
-                    ref_node_id, output_idx = input_value
-                    print(f"  Input {input_name} references node {ref_node_id} output {output_idx}")
-                    
-                    if state_manager and ref_node_id in state_manager.node_outputs:
-                        raw_outputs = state_manager.node_outputs[ref_node_id]
-                        
-                        # 正确处理输出类型
-                        if isinstance(raw_outputs, (list, tuple)):
-                            if 0 <= output_idx < len(raw_outputs):
-                                resolved_value = raw_outputs[output_idx]
-                                print(f"  Retrieved output type: {type(resolved_value).__name__}")
-                                input_names_to_values[input_name] = resolved_value  # 存储到字典
-                            else:
-                                return None, f"Output index {output_idx} out of range for node {ref_node_id}"
-                        else:
-                            # 单一输出处理
-                            if output_idx == 0:
-                                print(f"  Retrieved single output type: {type(raw_outputs).__name__}")
-                                input_names_to_values[input_name] = raw_outputs  # 存储到字典
-                            else:
-                                return None, f"Single output node {ref_node_id} does not have output index {output_idx}"
-                    else:
-                        return None, f"Referenced node output {ref_node_id}:{output_idx} not found"
-            else:
-                # 直接值输入
-                input_names_to_values[input_name] = input_value  # 存储到字典
-        else:
-            return None, f"Missing required input: {input_name}"
-    
-    # 获取函数定义和参数顺序
-    func_name = getattr(node_class, "FUNCTION", None)
-    if not func_name:
+    info = get_single_node_class_info(class_type)
+    class_def = info.class_def
+    if info.function is None:
         return None, f"Node {class_type} does not define a FUNCTION attribute"
+    if info.callable is None:
+        return None, f"Function {info.function} not found in node {class_type}"
     
-    func = getattr(node_class(), func_name)
-    if not func:
-        return None, f"Function {func_name} not found in node {class_type}"
+    # 分布式模式下提前拉取远程上游输出，和下面的准备工作重叠
+    if state_manager is not None and hasattr(state_manager, "prefetch_node_inputs"):
+        state_manager.prefetch_node_inputs(node_data)
     
-    # 使用inspect获取函数签名和参数顺序
-    import inspect
-    signature = inspect.signature(func)
-    param_names = list(signature.parameters.keys())
+    valid_inputs = schema_registry.get_input_types(class_def)
+    for input_name in valid_inputs.get("required", {}):
+        if input_name not in inputs:
+            return None, f"Missing required input: {input_name}"
     
-    # 移除self参数(如果存在)
-    if len(param_names) > 0 and param_names[0] == 'self':
-        param_names = param_names[1:]
+    # 收集引用的上游输出，同一个上游节点被引用的所有槽位合并成一个完整长度的输出列表
+    linked_outputs = {}
+    unresolved = set() # 取不到的远程(节点, 槽位)
+    if state_manager is not None:
+        remote_slots = {}
+        for value in inputs.values():
+            if not is_link(value):
+                continue
+            ref_node_id, output_idx = value
+            if hasattr(state_manager, "is_remote") and state_manager.is_remote(ref_node_id):
+                remote_slots.setdefault(ref_node_id, set()).add(output_idx)
+            elif ref_node_id not in linked_outputs:
+                raw_outputs = state_manager.get_node_outputs(ref_node_id)
+                if raw_outputs is not None:
+                    list_slots = state_manager.persistent_nodes.get(ref_node_id, {}).get("list_outputs", None)
+                    linked_outputs[ref_node_id] = persistent_output_slots(raw_outputs, list_slots)
+        for ref_node_id, slots in remote_slots.items():
+            slot_values = [None] * (max(slots) + 1)
+            for output_idx in slots:
+                # 远程rank同时返回槽位是否是列表输出，和本地输出一样转换
+                slot = state_manager.get_output_slot(ref_node_id, output_idx)
+                if slot is None or slot[0] is None:
+                    unresolved.add((ref_node_id, output_idx))
+                    continue
+                value, is_list = slot
+                slot_values[output_idx] = value if is_list else [value]
+            linked_outputs[ref_node_id] = slot_values
     
-    print(f"Function signature for {class_type}.{func_name}: {param_names}")
+    input_data_all, missing_keys = get_input_data(inputs, class_def, node_id, linked_outputs, None, extra_data)
+    for input_name, value in inputs.items():
+        if is_link(value) and tuple(value) in unresolved:
+            missing_keys[input_name] = True
+    for input_name in missing_keys:
+        _, input_category, _ = get_input_info(class_def, input_name, valid_inputs)
+        if input_category == "required":
+            ref_node_id, output_idx = inputs[input_name]
+            return None, f"Referenced node output {ref_node_id}:{output_idx} not found"
+        del input_data_all[input_name]
     
-    # 根据函数签名排序参数
-    input_args = []
-    for param in param_names:
-        if param in input_names_to_values:
-            input_args.append(input_names_to_values[param])
-        else:
-            # 检查参数是否有默认值，如果没有则报错
-            if signature.parameters[param].default == inspect.Parameter.empty:
-                return None, f"Missing required parameter: {param} for {class_type}.{func_name}"
+    if not info.accepts_kwargs:
+        for param in info.required_params:
+            if param not in input_data_all:
+                return None, f"Missing required parameter: {param} for {class_type}.{info.function}"
     
-    # 特殊处理SaveImage节点的张量输入 - 分离梯度
-    if class_type == "SaveImage" and "images" in input_names_to_values:
-        images = input_names_to_values["images"]
-        if hasattr(images, "detach"):
-            detached_images = images.detach()
-            input_names_to_values["images"] = detached_images
-            print("Detaching tensor gradients for SaveImage node")
-            
-            # 确保更新到input_args列表
-            img_index = param_names.index("images") if "images" in param_names else -1
-            if img_index >= 0 and img_index < len(input_args):
-                input_args[img_index] = detached_images
+    entry = None
+    input_hash = None
+    if state_manager is not None:
+        with state_manager.lock:
+            entry = state_manager.persistent_nodes.get(node_id, None)
+        if entry is not None:
+            try:
+                input_hash = single_node_input_hash(class_type, class_def, inputs, input_data_all, state_manager)
+            except Exception as e:
+                logging.warning(f"IS_CHANGED failed for node {node_id}: {e}")
+            # 输入没有变化，直接复用上次的输出
+            if not force and input_hash is not None and entry.get("input_hash") == input_hash and state_manager.has_node_output(node_id):
+                logging.debug(f"Node {node_id} inputs unchanged, reusing outputs")
+                return state_manager.get_node_outputs(node_id), None
     
-    # 验证参数
-    print(f"Executing node {node_id} with {len(input_args)} inputs")
-    for i, arg in enumerate(input_args):
-        param_name = param_names[i] if i < len(param_names) else f"param{i}"
-        print(f"  Input {i} ({param_name}): {type(arg).__name__} at {id(arg)}")
+    # 持久化节点复用实例
+    obj = entry.get("instance") if entry is not None else None
+    if not isinstance(obj, class_def):
+        obj = class_def()
+        if entry is not None:
+            entry["instance"] = obj
     
     # 执行节点
     try:
-        print(f"Calling {func_name} on {class_type}")
-        outputs = func(*input_args)
+        logging.debug(f"Executing node {node_id} ({class_type}.{info.function}) with inputs {list(input_data_all.keys())}")
+        start_time = time.perf_counter()
+        with torch.inference_mode():
+            output_data, output_ui, has_subgraph = get_output_data(obj, input_data_all)
+        if has_subgraph:
+            return None, f"Node {class_type} expands into a subgraph, which is not supported for single node execution"
+        
+        # 转回原始输出格式：每个槽位一个值，列表输出和批处理产生的多个结果保持为列表
+        list_outputs = [bool(i < len(info.output_is_list) and info.output_is_list[i]) or len(values) != 1 for i, values in enumerate(output_data)]
+        outputs = tuple(values if is_list else values[0] for values, is_list in zip(output_data, list_outputs))
+        if len(outputs) == 0 and len(output_ui) > 0:
+            outputs = {"ui": output_ui}
+        if state_manager is not None and hasattr(state_manager, "record_node_execution"):
+            state_manager.record_node_execution(node_id, class_type, time.perf_counter() - start_time, outputs)
         
         # 保存输出 - 直接存储原始对象引用
-        if state_manager:
-            state_manager.node_outputs[node_id] = outputs
+        if state_manager is not None:
+            state_manager.set_node_output(node_id, outputs)
+            if entry is not None:
+                with state_manager.lock:
+                    entry["list_outputs"] = list_outputs
+                    entry["input_hash"] = input_hash
+                    entry["ui"] = output_ui
+                    entry["last_executed"] = time.time()
             
         return outputs, None
     except Exception as e:
         traceback.print_exc()  # 打印完整堆栈跟踪以便调试
         return None, str(e)
+
+def execute_persistent_graph(server, node_ids, extra_data, state_manager, inputs=None, force=False):
+    """
+    一次执行已注册持久化节点组成的子图。
+
+    node_ids为需要的节点（None表示全部已注册节点），它们依赖的已注册上游节点会一起加入子图，
+    用TopologicalSort排序后逐个调用execute_single_node，由它按输入哈希决定执行还是复用已有的输出。
+    inputs为{node_id: {input_name: value}}，覆盖注册时的输入。
+    返回(结果字典, 错误信息, 出错的节点)。
+    """
+    inputs = inputs or {}
+    with state_manager.lock:
+        registered = {node_id: entry["data"] for node_id, entry in state_manager.persistent_nodes.items()}
+    if node_ids is None:
+        node_ids = list(registered.keys())
+    for node_id in node_ids:
+        if node_id not in registered:
+            return None, f"Node {node_id} is not registered", node_id
+
+    # 收集子图：请求的节点和它们已注册的上游
+    graph = {}
+    pending = list(node_ids)
+    while len(pending) > 0:
+        node_id = pending.pop()
+        if node_id in graph:
+            continue
+        node_data = copy.deepcopy(registered[node_id])
+        node_data.setdefault("inputs", {})
+        node_data["inputs"].update(state_manager.get_custom_inputs(node_id))
+        node_data["inputs"].update(inputs.get(node_id, {}))
+        if node_data["class_type"] not in nodes.NODE_CLASS_MAPPINGS:
+            return None, f"Node class {node_data['class_type']} not found", node_id
+        graph[node_id] = node_data
+        for value in node_data["inputs"].values():
+            if is_link(value) and value[0] in registered:
+                pending.append(value[0])
+
+    sort = TopologicalSort(DynamicPrompt(graph))
+    for node_id in node_ids:
+        sort.add_node(node_id, include_lazy=True, subgraph_nodes=graph)
+
+    result = {"executed": [], "reused": [], "outputs": {}}
+    while not sort.is_empty():
+        ready = sort.get_ready_nodes()
+        if len(ready) == 0:
+            return result, "Dependency cycle detected", None
+        node_id = ready[0]
+        # 输出版本没变说明execute_single_node复用了上次的输出，下游的输入哈希也就不变
+        version = state_manager.get_output_version(node_id)
+        outputs, error = execute_single_node(server, node_id, graph[node_id], extra_data, state_manager, force=force)
+        if error:
+            return result, error, node_id
+        if version is not None and state_manager.get_output_version(node_id) == version:
+            result["reused"].append(node_id)
+        else:
+            result["executed"].append(node_id)
+        sort.pop_node(node_id)
+    result["reused"].sort()
+
+    for node_id in node_ids:
+        result["outputs"][node_id] = state_manager.get_node_outputs(node_id)
+    return result, None, None
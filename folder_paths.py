@@ -390,3 +390,24 @@ def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, im
         os.makedirs(full_output_folder, exist_ok=True)
         counter = 1
     return full_output_folder, filename, counter, subfolder, filename_prefix
+
+def get_directory_mtimes() -> dict[str, float | None]:
+    """
+    Snapshot of the modification times of every directory whose contents can show up in a node's
+    INPUT_TYPES: all registered model folders and the subfolders found while listing them, plus
+    the input directory. Folders that don't exist map to None so that creating them is noticed.
+    """
+    directories = set()
+    for folder_name in folder_names_and_paths:
+        directories.update(folder_names_and_paths[folder_name][0])
+    for _files, folders, _time in filename_list_cache.values():
+        directories.update(folders)
+    directories.add(get_input_directory())
+
+    out = {}
+    for directory in directories:
+        try:
+            out[directory] = os.path.getmtime(directory)
+        except OSError:
+            out[directory] = None
+    return out
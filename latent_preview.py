@@ -9,6 +9,13 @@ import logging
 
 MAX_PREVIEW_RESOLUTION = args.preview_size
 
+# Called before decoding each preview; returns False when nobody would receive it
+preview_filter = None
+
+def set_preview_filter(function):
+    global preview_filter
+    preview_filter = function
+
 def preview_to_image(latent_image):
         latents_ubyte = (((latent_image + 1.0) / 2.0).clamp(0, 1)  # change scale from -1..1 to 0..1
                             .mul(0xFF)  # to 0..255
@@ -101,7 +108,7 @@ def prepare_callback(model, steps, x0_output_dict=None):
             x0_output_dict["x0"] = x0
 
         preview_bytes = None
-        if previewer:
+        if previewer and (preview_filter is None or preview_filter()):
             preview_bytes = previewer.decode_latent_to_preview_image(preview_format, x0)
         pbar.update_absolute(step + 1, total_steps, preview_bytes)
     return callback
@@ -146,12 +146,15 @@ import comfy.utils
 
 import execution
 import server
-from server import BinaryEventTypes
 import nodes
+import latent_preview
 import comfy.model_management
 import comfyui_version
 import app.logger
-from node_state_manager import NodeStateManager
+from comfy_execution.disk_cache import DiskCache
+from node_preloader import NodePreloader
+from comfy_execution.model_prefetch import ModelPrefetcher
+from comfy_execution.utils import get_executing_context
 
 
 def cuda_malloc_warning():
@@ -166,26 +169,39 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+def prompt_worker(q, server_instance, device=None, disk_cache=None):
     current_time: float = 0.0
-    e = execution.PromptExecutor(server_instance, lru_size=args.cache_lru)
+    worker = server_instance.add_worker(device)
+    e = execution.PromptExecutor(worker, lru_size=args.cache_lru, cache_ram_gb=args.cache_ram_gb, cache_vram_gb=args.cache_vram_gb, disk_cache=disk_cache, parallel_workers=args.parallel_execution, device=device)
+    worker.prompt_executor = e
+    if server_instance.prompt_executor is None:
+        server_instance.prompt_executor = e
+    q.register_worker(worker.worker_id)
+    affinity = None
+    if args.worker_devices is not None and len(args.worker_devices) > 1:
+        # Only worth reordering the queue when another worker could take the prompt
+        affinity = worker.model_affinity
+    e.bind_current_thread()
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
 
     while True:
         timeout = 1000.0
+        if args.node_state_ttl > 0:
+            timeout = min(timeout, args.node_state_ttl)
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, affinity=affinity)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
             prompt_id = item[1]
-            server_instance.last_prompt_id = prompt_id
+            worker.last_prompt_id = prompt_id
 
             e.execute(item[2], prompt_id, item[3], item[4])
+            worker.remember_models(item[2])
             need_gc = True
             q.task_done(item_id,
                         e.history_result,
@@ -193,14 +209,16 @@ def prompt_worker(q, server_instance):
                             status_str='success' if e.success else 'error',
                             completed=e.success,
                             messages=e.status_messages))
-            if server_instance.client_id is not None:
-                server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+            if worker.client_id is not None:
+                worker.send_sync("executing", {"node": None, "prompt_id": prompt_id}, worker.client_id)
+                for member in item[3].get("fused_prompts", []):
+                    worker.send_sync("executing", {"node": None, "prompt_id": member["prompt_id"]}, worker.client_id)
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
             logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+        flags = q.get_flags(worker_id=worker.worker_id)
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
@@ -213,6 +231,10 @@ def prompt_worker(q, server_instance):
             need_gc = True
             last_gc_collect = 0
 
+        # 持久化节点的输出也要响应/free，并处理过期和超出预算的输出
+        server_instance.node_state_manager.release(unload_models=flags.get("unload_models", free_memory), free_memory=free_memory)
+        server_instance.node_state_manager.enforce_budget()
+
         if need_gc:
             current_time = time.perf_counter()
             if (current_time - last_gc_collect) > gc_collect_interval:
@@ -234,13 +256,24 @@ async def run(server_instance, address='', port=8188, verbose=True, call_on_star
 def hijack_progress(server_instance):
     def hook(value, total, preview_image):
         comfy.model_management.throw_exception_if_processing_interrupted()
-        progress = {"value": value, "max": total, "prompt_id": server_instance.last_prompt_id, "node": server_instance.last_node_id}
-
-        server_instance.send_sync("progress", progress, server_instance.client_id)
+        worker = server_instance.get_worker_context()
+        # Nodes of one prompt can run at the same time, the node comes from the calling thread
+        executing = get_executing_context()
+        if executing is not None:
+            progress = {"value": value, "max": total, "prompt_id": executing.prompt_id, "node": executing.display_node_id}
+        else:
+            progress = {"value": value, "max": total, "prompt_id": worker.last_prompt_id, "node": worker.last_node_id}
+
+        server_instance.send_sync("progress", progress, worker.client_id)
         if preview_image is not None:
-            server_instance.send_sync(BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, preview_image, server_instance.client_id)
+            server_instance.preview_encoder.submit(preview_image, worker.client_id)
+
+    def preview_filter():
+        # Skip decoding previews that no client would receive or that the rate limit would drop
+        return server_instance.preview_encoder.wants_preview(server_instance.get_worker_context().client_id)
 
     comfy.utils.set_progress_bar_global_hook(hook)
+    latent_preview.set_preview_filter(preview_filter)
 
 
 def cleanup_temp():
@@ -271,7 +304,7 @@ def start_comfyui(asyncio_loop=None):
         asyncio_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(asyncio_loop)
     prompt_server = server.PromptServer(asyncio_loop)
-    q = execution.PromptQueue(prompt_server)
+    q = execution.PromptQueue(prompt_server, history_path=args.history_db)
 
     nodes.init_extra_nodes(init_custom_nodes=not args.disable_all_custom_nodes)
 
@@ -280,7 +313,21 @@ def start_comfyui(asyncio_loop=None):
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(q, prompt_server,)).start()
+    disk_cache = None
+    if args.cache_disk_directory is not None:
+        disk_cache = DiskCache(os.path.abspath(args.cache_disk_directory), int(args.cache_disk_gb * 1024 * 1024 * 1024))
+
+    if args.worker_devices:
+        # One worker per device, all pulling from the same queue
+        for device in args.worker_devices:
+            threading.Thread(target=prompt_worker, daemon=True, args=(q, prompt_server, device, disk_cache)).start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(q, prompt_server, None, disk_cache)).start()
+
+    if args.prefetch_models > 0:
+        pin_memory = args.prefetch_pinned and comfy.model_management.is_nvidia()
+        prompt_server.model_prefetcher = ModelPrefetcher(q, depth=args.prefetch_models, ram_budget=int(args.prefetch_ram_gb * 1024 * 1024 * 1024), pin_memory=pin_memory)
+        prompt_server.model_prefetcher.start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -301,19 +348,20 @@ def start_comfyui(asyncio_loop=None):
         await prompt_server.setup()
         await run(prompt_server, address=args.listen, port=args.port, verbose=not args.dont_print_server, call_on_start=call_on_start)
 
-    # 初始化节点状态管理器
-    server.node_state_manager = NodeStateManager()
+    # 使用服务器的节点状态管理器，预热的节点也能通过/api/node接口访问并计入内存预算
+    server.node_state_manager = prompt_server.node_state_manager
     
-    # 预热指定节点(可选)
-    if hasattr(args, 'preload_nodes') and args.preload_nodes:
-        preload_nodes_from_config(server.node_state_manager)
+    # 预热指定节点(可选)，在后台执行，服务器不用等待
+    if args.preload_nodes:
+        prompt_server.node_preloader = NodePreloader(server.node_state_manager, max_workers=args.preload_workers)
+        preload_nodes_from_config(server.node_state_manager, prompt_server.node_preloader)
 
     # Returning these so that other code can integrate with the ComfyUI loop and server
     return asyncio_loop, prompt_server, start_all
 
 
-def preload_nodes_from_config(state_manager):
-    """从配置文件加载预热节点"""
+def preload_nodes_from_config(state_manager, preloader):
+    """从配置文件注册预热节点，需要立即加载的节点交给preloader在后台按依赖顺序执行"""
     config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "preload_nodes.json")
     if os.path.exists(config_path):
         try:
@@ -323,17 +371,20 @@ def preload_nodes_from_config(state_manager):
             # 检查是否使用API格式
             if isinstance(config, dict) and not config.get("nodes", None):
                 # API格式 - 直接按节点ID遍历
+                to_load = {}
                 for node_id, node_data in config.items():
                     persistent = node_data.get("_meta", {}).get("persistent", True)
                     logging.info(f"Registering persistent node: {node_id}")
                     state_manager.register_persistent_node(node_id, node_data)
                     
-                    # 如果需要立即加载，执行节点
+                    # 如果需要立即加载，交给后台预热
                     if persistent:
-                        execute_single_node(None, node_id, node_data, None, state_manager)
+                        to_load[node_id] = node_data
+                preloader.start(to_load)
             # 检查是否为GUI格式
             elif isinstance(config, dict) and config.get("nodes", None):
                 # GUI格式 - 需要转换为API格式
+                to_load = {}
                 for node in config["nodes"]:
                     node_id = str(node["id"])
                     node_data = {
@@ -349,6 +400,9 @@ def preload_nodes_from_config(state_manager):
                     
                     logging.info(f"Registering node from GUI format: {node_id}")
                     state_manager.register_persistent_node(node_id, node_data)
+                    to_load[node_id] = node_data
+                # 和API格式一样交给后台预热
+                preloader.start(to_load)
             else:
                 logging.warning("Unknown preload_nodes.json format")
                 
@@ -0,0 +1,152 @@
+import json
+import struct
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+from comfy_execution.disk_cache import encode_output, NotSerializable
+
+# 二进制输出格式 -> (Content-Type, 文件扩展名)
+FORMATS = {
+    "safetensors": ("application/octet-stream", "safetensors"),
+    "npy": ("application/octet-stream", "npy"),
+    "png": ("image/png", "png"),
+    "webp": ("image/webp", "webp"),
+}
+
+SAFETENSORS_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+NPY_DESCRS = {
+    torch.float64: "<f8",
+    torch.float32: "<f4",
+    torch.float16: "<f2",
+    torch.int64: "<i8",
+    torch.int32: "<i4",
+    torch.int16: "<i2",
+    torch.int8: "|i1",
+    torch.uint8: "|u1",
+    torch.bool: "|b1",
+}
+
+class UnsupportedOutput(Exception):
+    pass
+
+class BinaryPayload:
+    """
+    由若干字节段组成的响应体：一个小的头部加上张量本身的内存，不会把整个输出复制成一个大的bytes。
+    iter_range按字节范围分块读取，用于HTTP Range请求和分块传输。
+    """
+    def __init__(self, segments, content_type, extension):
+        self.segments = [memoryview(s).cast("B") for s in segments if len(s) > 0]
+        self.length = sum(len(s) for s in self.segments)
+        self.content_type = content_type
+        self.extension = extension
+
+    def iter_range(self, start=0, end=None, chunk_size=1024 * 1024):
+        end = self.length if end is None else min(end, self.length)
+        offset = 0
+        for segment in self.segments:
+            segment_start = offset
+            offset += len(segment)
+            if offset <= start or segment_start >= end:
+                continue
+            low = max(start, segment_start) - segment_start
+            high = min(end, offset) - segment_start
+            for i in range(low, high, chunk_size):
+                yield segment[i:min(i + chunk_size, high)]
+
+    def read(self, start=0, end=None):
+        return b"".join(bytes(chunk) for chunk in self.iter_range(start, end))
+
+def tensor_bytes(tensor):
+    """张量内存的只读视图，非CPU张量会先复制到CPU"""
+    tensor = tensor.detach().to("cpu").contiguous()
+    if tensor.numel() == 0:
+        return b""
+    return tensor.reshape(-1).view(torch.uint8).numpy()
+
+def describe_tensor(tensor):
+    return {"type": "tensor", "dtype": str(tensor.dtype).replace("torch.", ""), "shape": list(tensor.shape), "device": str(tensor.device)}
+
+def safetensors_payload(output):
+    """
+    safetensors格式：8字节头部长度 + JSON头部（每个张量的dtype、shape和偏移） + 原始张量数据。
+    张量以外的结构（元组、列表、字典和普通值，比如CONDITIONING）保存在头部的__metadata__.structure中，
+    格式和磁盘缓存相同。
+    """
+    tensors = {}
+    try:
+        structure = encode_output(output, tensors, {}, clone=False)
+    except NotSerializable:
+        raise UnsupportedOutput("Output contains objects that cannot be sent as tensors")
+    header = {}
+    segments = []
+    offset = 0
+    for name, tensor in tensors.items():
+        if tensor.dtype not in SAFETENSORS_DTYPES:
+            tensor = tensor.float()
+        data = tensor_bytes(tensor)
+        header[name] = {"dtype": SAFETENSORS_DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + len(data)]}
+        offset += len(data)
+        segments.append(data)
+    header["__metadata__"] = {"structure": json.dumps(structure)}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # 按safetensors的约定把头部补齐到8字节
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    return BinaryPayload([struct.pack("<Q", len(header_bytes)), header_bytes] + segments, *FORMATS["safetensors"])
+
+def npy_payload(output):
+    """numpy .npy格式（版本1.0），只支持单个张量，bfloat16等numpy没有的类型转换为float32"""
+    if not isinstance(output, torch.Tensor):
+        raise UnsupportedOutput("npy format requires a tensor output")
+    if output.dtype not in NPY_DESCRS:
+        output = output.float()
+    shape = tuple(output.shape)
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(NPY_DESCRS[output.dtype], repr(shape))
+    # 魔数、版本和头部长度共10字节，整个头部以换行结尾并补齐到64字节
+    header += " " * (-(10 + len(header) + 1) % 64) + "\n"
+    prefix = b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+    return BinaryPayload([prefix, tensor_bytes(output)], *FORMATS["npy"])
+
+def image_payload(output, output_format, batch_index=0, quality=90):
+    """把IMAGE张量（[B, H, W, C]，0到1）中的一张编码为PNG或WebP"""
+    if not isinstance(output, torch.Tensor) or output.ndim not in (3, 4):
+        raise UnsupportedOutput(f"{output_format} format requires an IMAGE output")
+    if output.ndim == 3:
+        output = output.unsqueeze(0)
+    if not 0 <= batch_index < output.shape[0]:
+        raise UnsupportedOutput(f"Batch index {batch_index} out of range for {output.shape[0]} images")
+    if output.shape[-1] not in (1, 3, 4):
+        raise UnsupportedOutput(f"Unsupported channel count {output.shape[-1]} for {output_format}")
+    pixels = (output[batch_index].detach().float().clamp(0, 1) * 255.0).round().to(torch.uint8).cpu().numpy()
+    if pixels.shape[-1] == 1:
+        pixels = pixels[..., 0]
+    image = Image.fromarray(np.ascontiguousarray(pixels))
+    buffer = BytesIO()
+    if output_format == "png":
+        image.save(buffer, format="PNG", compress_level=1)
+    else:
+        image.save(buffer, format="WEBP", quality=quality)
+    return BinaryPayload([buffer.getbuffer()], *FORMATS[output_format])
+
+def encode_payload(output, output_format, batch_index=0, quality=90):
+    if output_format == "safetensors":
+        return safetensors_payload(output)
+    if output_format == "npy":
+        return npy_payload(output)
+    if output_format in ("png", "webp"):
+        return image_payload(output, output_format, batch_index=batch_index, quality=quality)
+    raise UnsupportedOutput(f"Unknown output format {output_format}")
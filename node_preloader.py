@@ -0,0 +1,144 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+def execute_node(node_id, node_data, state_manager):
+    from execution import execute_single_node
+    return execute_single_node(None, node_id, node_data, None, state_manager)
+
+class NodePreloader:
+    """
+    在后台按依赖顺序预热持久化节点。
+
+    互相独立的节点（比如多个模型加载器）在线程池中同时执行，读盘可以重叠；依赖其他预热节点的节点在上游就绪后才提交。
+    服务器不用等预热完成就可以接收请求，需要某个节点时调用wait_for()等待它和它的上游就绪。
+    每个节点的状态为pending、loading、ready或failed。
+    """
+    def __init__(self, state_manager, max_workers=4, execute=None):
+        self.state_manager = state_manager
+        self.execute = execute or execute_node
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="node_preload")
+        self.condition = threading.Condition()
+        self.nodes = {}         # node_id -> node_data
+        self.dependencies = {}  # node_id -> 需要先就绪的预热节点
+        self.status = {}        # node_id -> {"state", "error", "started", "finished"}
+        self.started = None
+        self.finished = None
+
+    def start(self, nodes):
+        """nodes为{node_id: node_data}，节点应已注册到state_manager"""
+        with self.condition:
+            self.started = time.time()
+            for node_id, node_data in nodes.items():
+                self.nodes[node_id] = node_data
+                self.status[node_id] = {"state": "pending", "error": None, "started": None, "finished": None}
+            for node_id, node_data in nodes.items():
+                self.dependencies[node_id] = set(value[0] for value in node_data.get("inputs", {}).values() if is_link(value) and value[0] in nodes)
+            self._submit_ready()
+
+    def _submit_ready(self):
+        """提交所有上游已就绪的节点，上游失败的节点直接标记为失败，必须持有condition"""
+        changed = True
+        while changed:
+            changed = False
+            for node_id, status in self.status.items():
+                if status["state"] != "pending":
+                    continue
+                failed = [dep for dep in self.dependencies[node_id] if self.status[dep]["state"] == "failed"]
+                if len(failed) > 0:
+                    self._finish(node_id, f"Dependency {failed[0]} failed")
+                    changed = True
+                elif all(self.status[dep]["state"] == "ready" for dep in self.dependencies[node_id]):
+                    status["state"] = "loading"
+                    status["started"] = time.time()
+                    self.pool.submit(self._run, node_id)
+        self._check_finished()
+
+    def _check_finished(self):
+        states = [status["state"] for status in self.status.values()]
+        if "loading" in states:
+            return
+        # 没有节点在执行但还有等待中的节点，说明存在循环依赖
+        for node_id, status in self.status.items():
+            if status["state"] == "pending":
+                self._finish(node_id, "Dependency cycle detected")
+        if self.finished is None:
+            self.finished = time.time()
+            ready = len([s for s in self.status.values() if s["state"] == "ready"])
+            logging.info(f"Preloaded {ready}/{len(self.status)} persistent nodes in {self.finished - self.started:.2f} seconds")
+        self.condition.notify_all()
+
+    def _finish(self, node_id, error=None):
+        status = self.status[node_id]
+        status["state"] = "failed" if error else "ready"
+        status["error"] = error
+        status["finished"] = time.time()
+        if error:
+            logging.error(f"Error preloading node {node_id}: {error}")
+        self.condition.notify_all()
+
+    def _run(self, node_id):
+        logging.info(f"Preloading persistent node: {node_id}")
+        try:
+            _, error = self.execute(node_id, self.nodes[node_id], self.state_manager)
+        except Exception as e:
+            error = str(e)
+        with self.condition:
+            self._finish(node_id, error)
+            self._submit_ready()
+
+    def pending_nodes(self, node_ids):
+        """node_ids以及它们的上游（包括已注册的非预热节点引用的预热节点）中还没完成预热的节点"""
+        with self.condition:
+            found = set()
+            visited = set()
+            stack = list(node_ids)
+            while len(stack) > 0:
+                node_id = stack.pop()
+                if node_id in visited:
+                    continue
+                visited.add(node_id)
+                if node_id in self.status and self.status[node_id]["state"] in ("pending", "loading"):
+                    found.add(node_id)
+                node_data = self.nodes.get(node_id, None)
+                if node_data is None:
+                    entry = self.state_manager.persistent_nodes.get(node_id, None)
+                    node_data = entry["data"] if entry is not None else {}
+                for value in node_data.get("inputs", {}).values():
+                    if is_link(value):
+                        stack.append(value[0])
+            return found
+
+    def wait_for(self, node_ids, timeout=None):
+        """阻塞直到相关的预热节点都完成（就绪或失败），超时返回False"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                pending = self.pending_nodes(node_ids)
+                if len(pending) == 0:
+                    return True
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+
+    def is_ready(self):
+        with self.condition:
+            return all(status["state"] in ("ready", "failed") for status in self.status.values())
+
+    def get_status(self):
+        with self.condition:
+            counts = {"pending": 0, "loading": 0, "ready": 0, "failed": 0}
+            for status in self.status.values():
+                counts[status["state"]] += 1
+            return {
+                "ready": counts["pending"] == 0 and counts["loading"] == 0,
+                "counts": counts,
+                "started": self.started,
+                "finished": self.finished,
+                "nodes": {node_id: dict(status) for node_id, status in self.status.items()},
+            }
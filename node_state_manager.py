@@ -1,29 +1,99 @@
+import logging
+import os
 import threading
+import time
+import uuid
+
+def measure_outputs(outputs):
+    """节点输出占用的(内存, 显存)字节数，模型按ModelPatcher计算，张量按存储计算"""
+    from comfy_execution.caching import measure_output_size
+    return measure_output_size(outputs)
+
+def contains_model(obj, depth=0):
+    """输出中是否包含模型（MODEL、CLIP、VAE等持有ModelPatcher的对象），这类输出无法写入磁盘"""
+    if depth > 8 or obj is None or isinstance(obj, (int, float, str, bool)):
+        return False
+    if hasattr(obj, "model_size") and hasattr(obj, "loaded_size"):
+        return True
+    if isinstance(obj, (list, tuple)):
+        return any(contains_model(x, depth + 1) for x in obj)
+    if isinstance(obj, dict):
+        return any(contains_model(x, depth + 1) for x in obj.values())
+    return hasattr(obj, "patcher") or hasattr(obj, "cond_stage_model") or hasattr(obj, "first_stage_model")
+
+def map_tensors(obj, tensor_class, fn, depth=0):
+    """对输出结构中的张量调用fn，列表、元组和字典会被重新构建，其他对象保持不变"""
+    if depth > 8:
+        return obj
+    if isinstance(obj, tensor_class):
+        return fn(obj)
+    if isinstance(obj, tuple):
+        return tuple(map_tensors(x, tensor_class, fn, depth + 1) for x in obj)
+    if isinstance(obj, list):
+        return [map_tensors(x, tensor_class, fn, depth + 1) for x in obj]
+    if isinstance(obj, dict):
+        return {k: map_tensors(v, tensor_class, fn, depth + 1) for k, v in obj.items()}
+    return obj
 
 class NodeStateManager:
-    def __init__(self):
+    """
+    持久化节点的状态和输出。
+
+    每个输出都会统计占用的内存和显存，并记录最后使用时间。超出预算（字节，0表示不限制）时按最近最少使用的顺序释放：
+    显存中的张量先移到CPU，内存超出时能序列化的输出写入spill_directory（没有配置时直接丢弃），模型只能丢弃。
+    超过ttl秒没有使用的输出同样会被写入磁盘或丢弃。被丢弃的节点仍然保持注册状态，下次执行时重新计算。
+    free_memory()注册到comfy.model_management，采样需要显存时先把这里的张量移走。
+    """
+    def __init__(self, ram_budget=0, vram_budget=0, ttl=0, spill_directory=None, measure=None):
         self.persistent_nodes = {}  # 存储持久化节点的状态
         self.node_outputs = {}      # 存储节点的输出
         self.node_inputs = {}       # 存储自定义节点输入
+        self.output_versions = {}   # 节点输出的版本号，每次设置输出加一，用于判断下游输入是否变化
         self.lock = threading.RLock()
-        
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.ttl = ttl
+        self.spill_directory = spill_directory
+        self.measure = measure or measure_outputs
+        self.output_sizes = {}      # node_id -> (内存, 显存)
+        self.last_used = {}         # node_id -> 最后使用时间
+        self.spilled = {}           # node_id -> (磁盘文件路径, 文件大小)
+        self.ram_used = 0
+        self.vram_used = 0
+        self.stats = {"offloaded": 0, "spilled": 0, "reloaded": 0, "evicted": 0}
+
     def register_persistent_node(self, node_id, node_data):
         """注册一个需要持久化的节点"""
         with self.lock:
             self.persistent_nodes[node_id] = {
                 "data": node_data,
                 "instance": None,
-                "last_executed": None
+                "last_executed": None,
+                "input_hash": None  # execute_single_node上次执行时的输入哈希，用于判断输出能否复用
             }
-            
+
+    def has_node_output(self, node_id):
+        """节点是否有输出，包括已经写入磁盘的输出"""
+        with self.lock:
+            return node_id in self.node_outputs or node_id in self.spilled
+
+    def get_node_outputs(self, node_id):
+        """获取节点的全部原始输出，写入磁盘的输出会被重新加载"""
+        with self.lock:
+            if node_id in self.spilled:
+                self._reload(node_id)
+            if node_id not in self.node_outputs:
+                return None
+            self.last_used[node_id] = time.time()
+            return self.node_outputs[node_id]
+
     def get_node_output(self, node_id, output_index=0):
         """获取节点的输出"""
         with self.lock:
-            if node_id not in self.node_outputs:
+            outputs = self.get_node_outputs(node_id)
+            if outputs is None:
                 return None
-                
-            outputs = self.node_outputs[node_id]
-            
+
             # 处理不同类型的输出
             if isinstance(outputs, tuple) or isinstance(outputs, list):
                 # 输出是元组或列表 - 标准ComfyUI节点格式
@@ -37,30 +107,232 @@ class NodeStateManager:
                     return outputs
                 else:
                     return None
-        
+
+    def get_output_slot(self, node_id, output_index=0):
+        """节点一个输出槽位的原始值和该槽位是否是列表输出，返回(value, is_list)，没有输出时返回None"""
+        with self.lock:
+            if not self.has_node_output(node_id):
+                return None
+            value = self.get_node_output(node_id, output_index)
+            list_slots = self.persistent_nodes.get(node_id, {}).get("list_outputs", None) or []
+            return value, bool(output_index < len(list_slots) and list_slots[output_index])
+
     def set_node_output(self, node_id, outputs):
         """设置节点的输出"""
         with self.lock:
+            self._discard_spill(node_id)
             # 直接存储原始输出，不进行任何转换
             self.node_outputs[node_id] = outputs
-            
+            self.output_versions[node_id] = self.output_versions.get(node_id, 0) + 1
+            self.last_used[node_id] = time.time()
+            self._update_size(node_id)
+            self.enforce_budget(keep=(node_id,))
+
+    def remove_node_output(self, node_id):
+        """丢弃节点的输出，节点本身保持注册"""
+        with self.lock:
+            self._discard_spill(node_id)
+            self.node_outputs.pop(node_id, None)
+            self.last_used.pop(node_id, None)
+            ram, vram = self.output_sizes.pop(node_id, (0, 0))
+            self.ram_used -= ram
+            self.vram_used -= vram
+
+    def get_output_version(self, node_id):
+        """节点输出的版本号，没有输出时返回None"""
+        with self.lock:
+            if not self.has_node_output(node_id):
+                return None
+            return self.output_versions.get(node_id, 0)
+
     def set_custom_input(self, node_id, input_name, input_value):
         """设置节点的自定义输入"""
         with self.lock:
             if node_id not in self.node_inputs:
                 self.node_inputs[node_id] = {}
             self.node_inputs[node_id][input_name] = input_value
-            
+
     def get_custom_inputs(self, node_id):
         """获取节点的所有自定义输入"""
         with self.lock:
             return self.node_inputs.get(node_id, {})
 
+    def _update_size(self, node_id):
+        ram, vram = self.output_sizes.get(node_id, (0, 0))
+        self.ram_used -= ram
+        self.vram_used -= vram
+        if node_id in self.node_outputs:
+            ram, vram = self.measure(self.node_outputs[node_id])
+        else:
+            ram, vram = 0, 0
+        self.output_sizes[node_id] = (ram, vram)
+        self.ram_used += ram
+        self.vram_used += vram
+
+    def _lru_order(self, keep=()):
+        return sorted([node_id for node_id in self.node_outputs if node_id not in keep], key=lambda node_id: self.last_used.get(node_id, 0))
+
+    def _offload(self, node_id):
+        """把输出中的显存张量移到CPU，返回释放的显存字节数"""
+        vram = self.output_sizes.get(node_id, (0, 0))[1]
+        if vram == 0:
+            return 0
+        import torch
+        self.node_outputs[node_id] = map_tensors(self.node_outputs[node_id], torch.Tensor, lambda t: t if t.device.type == "cpu" else t.to("cpu"))
+        self._update_size(node_id)
+        freed = vram - self.output_sizes[node_id][1]
+        if freed > 0:
+            self.stats["offloaded"] += 1
+        return freed
+
+    def _spill(self, node_id):
+        """把输出写入磁盘，包含模型等无法序列化的对象时返回False"""
+        if self.spill_directory is None or contains_model(self.node_outputs[node_id]):
+            return False
+        import json
+        import safetensors.torch
+        from comfy_execution.disk_cache import encode_output, NotSerializable
+        tensors = {}
+        try:
+            structure = encode_output(self.node_outputs[node_id], tensors, {})
+        except NotSerializable:
+            return False
+        os.makedirs(self.spill_directory, exist_ok=True)
+        path = os.path.join(self.spill_directory, f"node_{uuid.uuid4().hex}.safetensors")
+        try:
+            safetensors.torch.save_file(tensors, path, metadata={"structure": json.dumps(structure)})
+        except Exception as e:
+            logging.warning(f"Failed to spill output of node {node_id}: {e}")
+            return False
+        self.spilled[node_id] = (path, os.path.getsize(path))
+        del self.node_outputs[node_id]
+        self._update_size(node_id)
+        self.stats["spilled"] += 1
+        return True
+
+    def _reload(self, node_id):
+        import json
+        import safetensors
+        from comfy_execution.disk_cache import decode_output
+        path, _ = self.spilled.pop(node_id)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                structure = json.loads(f.metadata()["structure"])
+                tensors = {k: f.get_tensor(k) for k in f.keys()}
+            self.node_outputs[node_id] = decode_output(structure, tensors)
+            self.stats["reloaded"] += 1
+        except Exception as e:
+            logging.warning(f"Failed to reload spilled output of node {node_id}: {e}")
+        self._remove_file(path)
+        self._update_size(node_id)
+
+    def _discard_spill(self, node_id):
+        if node_id in self.spilled:
+            path, _ = self.spilled.pop(node_id)
+            self._remove_file(path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _release(self, node_id):
+        """先尝试写入磁盘，不行就丢弃"""
+        if not self._spill(node_id):
+            self.remove_node_output(node_id)
+            self.stats["evicted"] += 1
+            logging.info(f"Evicted output of persistent node {node_id}")
+
+    def enforce_budget(self, keep=()):
+        """处理过期的输出，并在超出预算时按最近最少使用的顺序移到CPU、写入磁盘或丢弃"""
+        with self.lock:
+            if self.ttl > 0:
+                expired = time.time() - self.ttl
+                for node_id in self._lru_order(keep):
+                    if self.last_used.get(node_id, 0) >= expired:
+                        break
+                    self._release(node_id)
+            if self.vram_budget > 0:
+                for node_id in self._lru_order(keep):
+                    if self.vram_used <= self.vram_budget:
+                        break
+                    self._offload(node_id)
+            if self.ram_budget > 0:
+                for node_id in self._lru_order(keep):
+                    if self.ram_used <= self.ram_budget:
+                        break
+                    self._release(node_id)
+
+    def free_memory(self, memory_required, device):
+        """comfy.model_management.free_memory的回调：把device上的张量移到CPU直到释放memory_required字节"""
+        freed = 0
+        if getattr(device, "type", None) == "cpu":
+            return freed
+        with self.lock:
+            for node_id in self._lru_order():
+                if freed >= memory_required:
+                    break
+                if self.output_sizes.get(node_id, (0, 0))[1] > 0 and self._has_tensors_on(node_id, device):
+                    freed += self._offload(node_id)
+        if freed > 0:
+            logging.info(f"Moved {freed / (1024 * 1024):.1f} MB of persistent node outputs off {device}")
+        return freed
+
+    def _has_tensors_on(self, node_id, device):
+        import torch
+        found = []
+        map_tensors(self.node_outputs[node_id], torch.Tensor, lambda t: found.append(t.device == device) or t)
+        return any(found)
+
+    def release(self, unload_models=False, free_memory=False):
+        """
+        响应/free：unload_models时把显存张量移到CPU；free_memory时还会丢弃持有模型的输出，
+        让模型权重真正被释放，其他输出尽量写入磁盘。
+        """
+        with self.lock:
+            if unload_models or free_memory:
+                for node_id in self._lru_order():
+                    self._offload(node_id)
+            if free_memory:
+                for node_id in self._lru_order():
+                    if contains_model(self.node_outputs[node_id]):
+                        self.remove_node_output(node_id)
+                        self.stats["evicted"] += 1
+                    elif self.spill_directory is not None:
+                        self._spill(node_id)
+
+    def get_memory_stats(self):
+        with self.lock:
+            return dict(self.stats,
+                        ram_used=self.ram_used,
+                        vram_used=self.vram_used,
+                        ram_budget=self.ram_budget,
+                        vram_budget=self.vram_budget,
+                        ttl=self.ttl,
+                        spill_directory=self.spill_directory,
+                        spilled_bytes=sum(size for _, size in self.spilled.values()))
+
     def export_state(self):
         """导出当前状态管理器的内容，用于调试和检查"""
         with self.lock:
+            now = time.time()
+            outputs = {}
+            for node_id in set(self.node_outputs.keys()).union(self.spilled.keys()):
+                ram, vram = self.output_sizes.get(node_id, (0, 0))
+                outputs[node_id] = {
+                    "location": "disk" if node_id in self.spilled else ("gpu" if vram > 0 else "cpu"),
+                    "ram": ram,
+                    "vram": vram,
+                    "idle_seconds": now - self.last_used.get(node_id, now),
+                }
             return {
-                "persistent_nodes": self.persistent_nodes,
+                "persistent_nodes": {k: {
+                    "data": v["data"],
+                    "instance": type(v["instance"]).__name__ if v.get("instance") is not None else None,
+                    "last_executed": v.get("last_executed"),
+                } for k, v in self.persistent_nodes.items()},
                 "node_outputs": {k: str(type(v)) for k, v in self.node_outputs.items()},  # 只返回类型，避免大量数据
-                "node_inputs": self.node_inputs
-            } 
+                "node_inputs": self.node_inputs,
+                "memory": dict(self.get_memory_stats(), outputs=outputs),
+            }
@@ -1509,7 +1509,7 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
     disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
     samples = comfy.sample.sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image,
                                   denoise=denoise, disable_noise=disable_noise, start_step=start_step, last_step=last_step,
-                                  force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed)
+                                  force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed[0][0] if isinstance(seed, list) else seed)
     out = latent.copy()
     out["samples"] = samples
     return (out, )
@@ -1597,6 +1597,7 @@ class SaveImage:
 
     RETURN_TYPES = ()
     FUNCTION = "save_images"
+    EXECUTION_RESOURCE = "io"
 
     OUTPUT_NODE = True
 
@@ -1658,6 +1659,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    EXECUTION_RESOURCE = "io"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1732,6 +1734,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    EXECUTION_RESOURCE = "io"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
@@ -1801,6 +1804,7 @@ class ImageScale:
                               "crop": (s.crop_methods,)}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    EXECUTION_RESOURCE = "cpu"
 
     CATEGORY = "image/upscaling"
 
@@ -1828,6 +1832,7 @@ class ImageScaleBy:
                               "scale_by": ("FLOAT", {"default": 1.0, "min": 0.01, "max": 8.0, "step": 0.01}),}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    EXECUTION_RESOURCE = "cpu"
 
     CATEGORY = "image/upscaling"
 
@@ -1847,6 +1852,7 @@ class ImageInvert:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "invert"
+    EXECUTION_RESOURCE = "cpu"
 
     CATEGORY = "image"
 
@@ -1862,6 +1868,7 @@ class ImageBatch:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "batch"
+    EXECUTION_RESOURCE = "cpu"
 
     CATEGORY = "image"
 
@@ -7,9 +7,6 @@ server_url = "http://127.0.0.1:8188"
 with open("preload_nodes_sample_api.json", "r") as f:
     nodes_config = json.load(f)
 
-# 按依赖顺序注册和执行节点
-execution_order = ["4", "5", "6", "7", "3", "8", "9"]  # 按依赖顺序排列节点ID
-
 # 先注册所有节点
 for node_id in nodes_config:
     node_data = nodes_config[node_id]
@@ -26,23 +23,15 @@ for node_id in nodes_config:
     if register_response.status_code != 200:
         print(register_response.text)
 
-# 按顺序执行节点
-for node_id in execution_order:
-    node_data = nodes_config[node_id]
-    response = requests.post(
-        f"{server_url}/api/node/execute/{node_id}",
-        json={"node_data": node_data}  # 包装在node_data字段中
-    )
-    print(f"Node {node_id} executed: {response.status_code}")
-    try:
-        print(response.json())
-    except:
-        print("Could not parse JSON response")
-    
-    # 如果是最后一个节点（SaveImage），获取输出
-    if node_id == "9":
-        try:
-            result = response.json()
-            print(f"Final result: {result}")
-        except:
-            print("Could not parse JSON response")
\ No newline at end of file
+# 一次请求执行整个子图，服务器按依赖排序，输入没变的节点直接复用上次的输出
+response = requests.post(
+    f"{server_url}/api/node/execute_graph",
+    json={"node_ids": ["9"]}  # 只需要指定最终节点，上游节点会自动加入
+)
+print(f"Graph executed: {response.status_code}")
+try:
+    result = response.json()
+    print(f"Executed: {result.get('executed')}, reused: {result.get('reused')}")
+    print(f"Final result: {result.get('outputs', {}).get('9')}")
+except:
+    print("Could not parse JSON response")
@@ -11,14 +11,17 @@ import urllib
 import json
 import glob
 import struct
+import time
 import ssl
 import socket
 import ipaddress
-from PIL import Image, ImageOps
+import threading
+from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from io import BytesIO
 
 import aiohttp
+import torch
 from aiohttp import web
 import logging
 
@@ -26,6 +29,7 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.weight_store
 import node_helpers
 from comfyui_version import __version__
 from app.frontend_management import FrontendManager
@@ -35,6 +39,15 @@ from app.custom_node_manager import CustomNodeManager
 from typing import Optional
 from api_server.routes.internal.internal_routes import InternalRoutes
 from node_state_manager import NodeStateManager
+from app.websocket_fanout import PREVIEW_KEY, WebSocketFanout
+from app.preview_encoder import PreviewEncoder, encode_preview
+import node_output_codec
+from comfy_execution import schema_registry
+from comfy_execution import prompt_batch
+from comfy_execution.prompt_scheduler import PRIORITY_CLASSES
+from comfy_execution.graph_utils import is_link
+
+MAXIMUM_HISTORY_PAGE_SIZE = 1000
 
 class BinaryEventTypes:
     PREVIEW_IMAGE = 1
@@ -146,6 +159,107 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+def serialize_node_outputs(outputs):
+    """把节点输出转换为可序列化格式"""
+    if outputs is None:
+        return None
+    if isinstance(outputs, (list, tuple)):
+        serializable_outputs = []
+        for output in outputs:
+            if isinstance(output, torch.Tensor):
+                # 张量只返回dtype和shape，数据通过/api/node/output的二进制格式获取
+                serializable_outputs.append(node_output_codec.describe_tensor(output))
+                continue
+            try:
+                serializable_outputs.append(str(output))
+            except:
+                kind = "tensor" if hasattr(output, "detach") and hasattr(output, "cpu") else "object"
+                serializable_outputs.append(f"<{kind} at {id(output)}>")
+        return serializable_outputs
+    # 单一输出处理
+    if isinstance(outputs, torch.Tensor):
+        return node_output_codec.describe_tensor(outputs)
+    try:
+        return str(outputs)
+    except:
+        return f"<object at {id(outputs)}>"
+
+async def stream_payload(request, payload, filename):
+    """发送BinaryPayload，支持单个字节范围的Range请求，数据分块写出"""
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename=\"{filename}\"",
+    }
+    start, end = 0, payload.length
+    status = 200
+    if "Range" in request.headers:
+        try:
+            http_range = request.http_range
+        except ValueError:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{payload.length}"})
+        start, end = http_range.start, http_range.stop
+        if start is None:
+            start = 0
+        elif start < 0:
+            # bytes=-N 表示最后N个字节
+            start, end = max(payload.length + start, 0), payload.length
+        end = payload.length if end is None else min(end, payload.length)
+        if start >= end:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{payload.length}"})
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{payload.length}"
+    response = web.StreamResponse(status=status, headers=headers)
+    response.content_type = payload.content_type
+    response.content_length = end - start
+    await response.prepare(request)
+    for chunk in payload.iter_range(start, end):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+class PromptWorkerContext():
+    """
+    The per-worker execution state of the server. Each prompt worker hands one of these to its
+    PromptExecutor in place of the PromptServer, so workers running prompts at the same time
+    keep their own client_id / last_node_id / last_prompt_id while sharing the queue, history
+    and websocket fanout of the server.
+    """
+    def __init__(self, server, worker_id, device=None, max_models=32):
+        self.server = server
+        self.worker_id = worker_id
+        self.device = device
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.prompt_executor = None
+        self.max_models = max_models
+        self.recent_models = {}
+        self.interrupt_flag = comfy.model_management.register_interrupt_flag()
+
+    def send_sync(self, event, data, sid=None):
+        self.server.send_sync(event, data, sid)
+
+    def queue_updated(self):
+        self.server.queue_updated()
+
+    def bind_current_thread(self):
+        self.server.worker_local.context = self
+        comfy.model_management.bind_interrupt_flag(self.interrupt_flag)
+
+    def interrupt(self):
+        comfy.model_management.interrupt_current_processing(True, flag=self.interrupt_flag)
+
+    def remember_models(self, prompt):
+        for name in execution.get_prompt_model_files(prompt):
+            self.recent_models.pop(name, None)
+            self.recent_models[name] = True
+        while len(self.recent_models) > self.max_models:
+            self.recent_models.pop(next(iter(self.recent_models)))
+
+    def model_affinity(self, prompt):
+        # How many of the prompt's model files this worker used recently and likely still has loaded
+        return sum(1 for name in execution.get_prompt_model_files(prompt) if name in self.recent_models)
+
 class PromptServer():
     def __init__(self, loop):
         PromptServer.instance = self
@@ -160,6 +274,9 @@ class PromptServer():
         self.internal_routes = InternalRoutes(self)
         self.supports = ["custom_nodes_from_web"]
         self.prompt_queue = None
+        self.prompt_executor = None
+        self.workers = []
+        self.worker_local = threading.local()
         self.loop = loop
         self.messages = asyncio.Queue()
         self.client_session:Optional[aiohttp.ClientSession] = None
@@ -178,6 +295,15 @@ class PromptServer():
         max_upload_size = round(args.max_upload_size * 1024 * 1024)
         self.app = web.Application(client_max_size=max_upload_size, middlewares=middlewares)
         self.sockets = dict()
+        self.fanout = WebSocketFanout(max_queue=args.ws_queue_size)
+        self.preview_encoder = PreviewEncoder(
+            self.deliver_preview,
+            self.fanout.has_preview_subscribers,
+            workers=args.preview_encode_workers,
+            image_format=args.preview_format,
+            quality=args.preview_quality,
+            max_size=args.preview_size,
+            max_fps=args.preview_max_fps)
         self.web_root = (
             FrontendManager.init_frontend(args.front_end_version)
             if args.front_end_root is None
@@ -192,7 +318,16 @@ class PromptServer():
         self.on_prompt_handlers = []
 
         # Create node state manager
-        self.node_state_manager = NodeStateManager()
+        self.node_state_manager = NodeStateManager(
+            ram_budget=int(args.node_state_ram_gb * 1024 * 1024 * 1024),
+            vram_budget=int(args.node_state_vram_gb * 1024 * 1024 * 1024),
+            ttl=args.node_state_ttl,
+            spill_directory=args.node_state_spill_directory)
+        comfy.model_management.register_free_memory_callback(self.node_state_manager.free_memory)
+        # 启动时在后台预热的节点，由main设置
+        self.node_preloader = None
+        # Loads the model files of queued prompts ahead of time, set by main
+        self.model_prefetcher = None
 
         @routes.get('/ws')
         async def websocket_handler(request):
@@ -206,19 +341,24 @@ class PromptServer():
                 sid = uuid.uuid4().hex
 
             self.sockets[sid] = ws
+            previews = request.rel_url.query.get('previews', 'true').lower() not in ('0', 'false', 'no')
+            self.fanout.add(sid, ws, previews=previews)
 
             try:
                 # Send initial state to the new client
                 await self.send("status", { "status": self.get_queue_info(), 'sid': sid }, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                for context in self.get_worker_contexts():
+                    if context.client_id == sid and context.last_node_id is not None:
+                        await self.send("executing", { "node": context.last_node_id }, sid)
 
                 async for msg in ws:
                     if msg.type == aiohttp.WSMsgType.ERROR:
                         logging.warning('ws connection closed with exception %s' % ws.exception())
             finally:
-                self.sockets.pop(sid, None)
+                if self.sockets.get(sid, None) is ws:
+                    self.sockets.pop(sid, None)
+                self.fanout.remove(sid, ws)
             return ws
 
         @routes.get("/")
@@ -551,6 +691,22 @@ class PromptServer():
                     }
                 ]
             }
+            if self.prompt_executor is not None:
+                system_stats["cache"] = self.prompt_executor.caches.get_stats()
+            system_stats["node_schemas"] = schema_registry.registry.get_stats()
+            system_stats["validation"] = execution.validation_cache.get_stats()
+            system_stats["websocket"] = self.fanout.get_stats()
+            system_stats["previews"] = self.preview_encoder.get_stats()
+            system_stats["weight_store"] = comfy.weight_store.store.get_stats()
+            if self.model_prefetcher is not None:
+                system_stats["model_prefetch"] = self.model_prefetcher.get_stats()
+            if len(self.workers) > 1:
+                system_stats["workers"] = [{
+                    "worker_id": w.worker_id,
+                    "device": str(w.device),
+                    "last_prompt_id": w.last_prompt_id,
+                    "cache": w.prompt_executor.caches.get_stats() if w.prompt_executor is not None else None,
+                } for w in self.workers]
             return web.json_response(system_stats)
 
         @routes.get("/prompt")
@@ -560,8 +716,8 @@ class PromptServer():
         def node_info(node_class):
             obj_class = nodes.NODE_CLASS_MAPPINGS[node_class]
             info = {}
-            info['input'] = obj_class.INPUT_TYPES()
-            info['input_order'] = {key: list(value.keys()) for (key, value) in obj_class.INPUT_TYPES().items()}
+            info['input'] = schema_registry.get_input_types(obj_class)
+            info['input_order'] = schema_registry.registry.get_input_order(obj_class)
             info['output'] = obj_class.RETURN_TYPES
             info['output_is_list'] = obj_class.OUTPUT_IS_LIST if hasattr(obj_class, 'OUTPUT_IS_LIST') else [False] * len(obj_class.RETURN_TYPES)
             info['output_name'] = obj_class.RETURN_NAMES if hasattr(obj_class, 'RETURN_NAMES') else info['output']
@@ -589,6 +745,7 @@ class PromptServer():
 
         @routes.get("/object_info")
         async def get_object_info(request):
+            schema_registry.registry.check_filesystem()
             with folder_paths.cache_helper:
                 out = {}
                 for x in nodes.NODE_CLASS_MAPPINGS:
@@ -604,15 +761,29 @@ class PromptServer():
             node_class = request.match_info.get("node_class", None)
             out = {}
             if (node_class is not None) and (node_class in nodes.NODE_CLASS_MAPPINGS):
+                schema_registry.registry.check_filesystem()
                 out[node_class] = node_info(node_class)
             return web.json_response(out)
 
         @routes.get("/history")
         async def get_history(request):
-            max_items = request.rel_url.query.get("max_items", None)
+            query = request.rel_url.query
+            loop = asyncio.get_running_loop()
+            if any(k in query for k in ("cursor", "limit", "status", "client_id")):
+                # Newest first; the cursor for the next page is returned in the X-Next-Cursor header
+                cursor = query.get("cursor", None)
+                cursor = int(cursor) if cursor else None
+                limit = min(int(query.get("limit", 100)), MAXIMUM_HISTORY_PAGE_SIZE)
+                items, next_cursor = await loop.run_in_executor(None, lambda: self.prompt_queue.get_history_page(cursor=cursor, limit=limit, status=query.get("status", None), client_id=query.get("client_id", None)))
+                headers = {}
+                if next_cursor is not None:
+                    headers["X-Next-Cursor"] = str(next_cursor)
+                return web.json_response(items, headers=headers)
+
+            max_items = query.get("max_items", None)
             if max_items is not None:
                 max_items = int(max_items)
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items))
+            return web.json_response(await loop.run_in_executor(None, lambda: self.prompt_queue.get_history(max_items=max_items)))
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
@@ -625,6 +796,7 @@ class PromptServer():
             current_queue = self.prompt_queue.get_current_queue()
             queue_info['queue_running'] = current_queue[0]
             queue_info['queue_pending'] = current_queue[1]
+            queue_info['queue_depth'] = self.prompt_queue.get_queue_depths()
             return web.json_response(queue_info)
 
         @routes.post("/prompt")
@@ -652,6 +824,9 @@ class PromptServer():
 
                 if "client_id" in json_data:
                     extra_data["client_id"] = json_data["client_id"]
+                error = self.apply_scheduling_options(json_data, extra_data)
+                if error is not None:
+                    return web.json_response({"error": error, "node_errors": []}, status=400)
                 if valid[0]:
                     prompt_id = str(uuid.uuid4())
                     outputs_to_execute = valid[2]
@@ -664,6 +839,79 @@ class PromptServer():
             else:
                 return web.json_response({"error": "no prompt", "node_errors": []}, status=400)
 
+        @routes.post("/prompt/batch")
+        async def post_prompt_batch(request):
+            json_data = await request.json()
+            entries = json_data.get("prompts", None)
+            if not isinstance(entries, list) or len(entries) == 0:
+                return web.json_response({"error": "no prompts", "node_errors": []}, status=400)
+            logging.info("got prompt batch of {}".format(len(entries)))
+            fuse = json_data.get("fuse", False)
+            max_batch_size = int(json_data.get("max_batch_size", 64))
+
+            # Validate everything first; prompts sharing a structure hit the validation cache.
+            results = [None] * len(entries)
+            accepted = []
+            for i, entry in enumerate(entries):
+                if not isinstance(entry, dict) or "prompt" not in entry:
+                    results[i] = {"error": "no prompt", "node_errors": []}
+                    continue
+                entry = self.trigger_on_prompt(entry)
+                prompt = entry["prompt"]
+                valid = execution.validate_prompt(prompt)
+                if not valid[0]:
+                    logging.warning("invalid prompt: {}".format(valid[1]))
+                    results[i] = {"error": valid[1], "node_errors": valid[3]}
+                    continue
+                extra_data = entry.get("extra_data", {})
+                client_id = entry.get("client_id", json_data.get("client_id", None))
+                if client_id is not None:
+                    extra_data["client_id"] = client_id
+                error = self.apply_scheduling_options({**json_data, **entry}, extra_data)
+                if error is not None:
+                    results[i] = {"error": error, "node_errors": []}
+                    continue
+                accepted.append((i, prompt, extra_data, valid[2], valid[3]))
+
+            if fuse:
+                groups = prompt_batch.group_prompts([a[1] for a in accepted], max_batch_size)
+            else:
+                groups = [[j] for j in range(len(accepted))]
+
+            for group in groups:
+                number = self.number
+                if json_data.get("front", False):
+                    number = -number
+                self.number += 1
+                members = [accepted[j] for j in group]
+                if len(members) == 1:
+                    i, prompt, extra_data, outputs_to_execute, node_errors = members[0]
+                    prompt_id = str(uuid.uuid4())
+                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
+                    results[i] = {"prompt_id": prompt_id, "number": number, "node_errors": node_errors}
+                    continue
+
+                fused_prompt, batch_sizes = prompt_batch.fuse_prompts([m[1] for m in members])
+                fused_id = str(uuid.uuid4())
+                fused_members = []
+                for (i, prompt, extra_data, outputs_to_execute, node_errors), batch_size in zip(members, batch_sizes):
+                    prompt_id = str(uuid.uuid4())
+                    fused_members.append({
+                        "prompt_id": prompt_id,
+                        "number": number,
+                        "prompt": prompt,
+                        "extra_data": extra_data,
+                        "outputs_to_execute": outputs_to_execute,
+                        "batch_size": batch_size,
+                    })
+                    results[i] = {"prompt_id": prompt_id, "number": number, "node_errors": node_errors, "fused_into": fused_id}
+                extra_data = dict(members[0][2])
+                extra_data["fused_prompts"] = fused_members
+                self.prompt_queue.put((number, fused_id, fused_prompt, extra_data, members[0][3]))
+
+            status = 200 if len(accepted) > 0 else 400
+            return web.json_response({"results": results}, status=status)
+
         @routes.post("/queue")
         async def post_queue(request):
             json_data =  await request.json()
@@ -673,14 +921,28 @@ class PromptServer():
             if "delete" in json_data:
                 to_delete = json_data['delete']
                 for id_to_delete in to_delete:
-                    delete_func = lambda a: a[1] == id_to_delete
-                    self.prompt_queue.delete_queue_item(delete_func)
+                    self.prompt_queue.cancel(id_to_delete)
 
             return web.Response(status=200)
 
         @routes.post("/interrupt")
         async def post_interrupt(request):
-            nodes.interrupt_processing()
+            try:
+                json_data = await request.json()
+            except json.JSONDecodeError:
+                json_data = {}
+
+            # With a prompt_id only the worker running that prompt is interrupted, otherwise all of them
+            prompt_id = json_data.get("prompt_id", None) if isinstance(json_data, dict) else None
+            if prompt_id is None:
+                nodes.interrupt_processing()
+            else:
+                worker = self.get_worker_running(prompt_id)
+                if worker is not None:
+                    logging.info(f"Interrupting prompt {prompt_id}")
+                    worker.interrupt()
+                else:
+                    logging.info(f"Prompt {prompt_id} is not running, nothing to interrupt")
             return web.Response(status=200)
 
         @routes.post("/free")
@@ -759,6 +1021,12 @@ class PromptServer():
                     # 合并自定义输入
                     node_data["inputs"].update(custom_inputs)
                 
+                # 节点或它引用的节点还在预热时等待（wait为false时直接返回503）
+                linked_ids = [value[0] for value in node_data.get("inputs", {}).values() if is_link(value)]
+                not_ready = await self.wait_for_preloaded_nodes([node_id] + linked_ids, wait=data.get("wait", True), timeout=data.get("timeout", None))
+                if not_ready is not None:
+                    return not_ready
+                
                 # 创建模拟的extra_data，适配特殊节点如KSampler
                 extra_data = {}
                 # 确保提供了prompt_id
@@ -772,41 +1040,66 @@ class PromptServer():
                 extra_data["extra_pnginfo"] = data.get("extra_pnginfo", {})
                 
                 # 执行节点 - 传递request.app作为server参数
-                outputs, error = execution.execute_single_node(request.app, node_id, node_data, extra_data, request.app.node_state_manager)
+                outputs, error = execution.execute_single_node(request.app, node_id, node_data, extra_data, request.app.node_state_manager, force=data.get("force", False))
                 
                 if error:
                     return web.json_response({"error": error}, status=400)
                 
-                # 处理输出为可序列化格式
-                if outputs is None:
-                    serializable_outputs = None
-                elif isinstance(outputs, (list, tuple)):
-                    serializable_outputs = []
-                    for output in outputs:
-                        if hasattr(output, "detach") and hasattr(output, "cpu"):
-                            # 处理张量类型
-                            try:
-                                serializable_outputs.append(str(output))
-                            except:
-                                serializable_outputs.append(f"<tensor at {id(output)}>")
-                        else:
-                            # 其他类型转换
-                            try:
-                                # 尝试简单字符串化
-                                serializable_outputs.append(str(output))
-                            except:
-                                serializable_outputs.append(f"<object at {id(output)}>")
-                else:
-                    # 单一输出处理
-                    try:
-                        serializable_outputs = str(outputs)
-                    except:
-                        serializable_outputs = f"<object at {id(outputs)}>"
-                
                 return web.json_response({
                     "status": "success",
                     "node_id": node_id,
-                    "outputs": serializable_outputs
+                    "outputs": serialize_node_outputs(outputs)
+                })
+            except Exception as e:
+                traceback.print_exc()
+                return web.json_response({"error": str(e)}, status=500)
+
+        @routes.post('/api/node/execute_graph')
+        async def execute_node_graph(request):
+            """
+            一次执行持久化节点子图。
+            请求体：{"node_ids": [...]（省略时执行全部已注册节点）, "inputs": {node_id: {name: value}}, "force": false}
+            """
+            try:
+                data = await request.json()
+                manager = getattr(request.app, 'node_state_manager', None)
+                if manager is None:
+                    return web.json_response({"error": "Node state manager not initialized"}, status=500)
+
+                node_ids = data.get("node_ids", None)
+                if node_ids is not None and not isinstance(node_ids, list):
+                    return web.json_response({"error": "node_ids must be a list"}, status=400)
+                inputs = data.get("inputs", {})
+                if not isinstance(inputs, dict):
+                    return web.json_response({"error": "inputs must be an object keyed by node id"}, status=400)
+
+                not_ready = await self.wait_for_preloaded_nodes(node_ids if node_ids is not None else list(manager.persistent_nodes.keys()),
+                                                                wait=data.get("wait", True), timeout=data.get("timeout", None))
+                if not_ready is not None:
+                    return not_ready
+
+                extra_data = {
+                    "prompt_id": data.get("prompt_id", getattr(request.app, 'last_prompt_id', None) or "api_execution"),
+                    "extra_pnginfo": data.get("extra_pnginfo", {}),
+                }
+                request.app.last_prompt_id = extra_data["prompt_id"]
+
+                # 整个子图在线程池中执行，不阻塞事件循环
+                result, error, failed_node = await self.loop.run_in_executor(None, lambda: execution.execute_persistent_graph(
+                    request.app, node_ids, extra_data, manager, inputs=inputs, force=data.get("force", False)))
+
+                if error:
+                    response = {"error": error, "node_id": failed_node}
+                    if result is not None:
+                        response["executed"] = result["executed"]
+                        response["reused"] = result["reused"]
+                    return web.json_response(response, status=400)
+
+                return web.json_response({
+                    "status": "success",
+                    "executed": result["executed"],
+                    "reused": result["reused"],
+                    "outputs": {node_id: serialize_node_outputs(outputs) for node_id, outputs in result["outputs"].items()},
                 })
             except Exception as e:
                 traceback.print_exc()
@@ -814,14 +1107,39 @@ class PromptServer():
 
         @routes.get('/api/node/output/{node_id}')
         async def get_node_output(request):
-            """获取节点的输出"""
+            """
+            获取节点的输出。
+            format=json（默认）返回JSON；format=safetensors/npy返回带dtype和shape头部的原始张量数据，
+            format=png/webp把IMAGE编码为图片（batch选择批次中的图片，quality为WebP质量）。二进制格式支持Range请求。
+            """
             node_id = request.match_info['node_id']
             output_index = int(request.query.get('index', '0'))
+            output_format = request.query.get('format', 'json')
+            
+            timeout = request.query.get('timeout', None)
+            not_ready = await self.wait_for_preloaded_nodes([node_id], wait=request.query.get('wait', 'true') != 'false', timeout=float(timeout) if timeout is not None else None)
+            if not_ready is not None:
+                return not_ready
             
             output = self.node_state_manager.get_node_output(node_id, output_index)
             if output is None:
                 return web.json_response({"error": "Output not found"}, status=404)
             
+            if output_format != "json":
+                if output_format not in node_output_codec.FORMATS:
+                    return web.json_response({"error": f"Unknown format {output_format}, expected one of json, {', '.join(node_output_codec.FORMATS)}"}, status=400)
+                try:
+                    batch_index = int(request.query.get('batch', '0'))
+                    quality = int(request.query.get('quality', '90'))
+                except ValueError:
+                    return web.json_response({"error": "batch and quality must be integers"}, status=400)
+                try:
+                    # 复制到CPU和图片编码在线程池中进行
+                    payload = await self.loop.run_in_executor(None, lambda: node_output_codec.encode_payload(output, output_format, batch_index=batch_index, quality=quality))
+                except node_output_codec.UnsupportedOutput as e:
+                    return web.json_response({"error": str(e)}, status=400)
+                return await stream_payload(request, payload, f"node_{node_id}_{output_index}.{payload.extension}")
+            
             # 处理不同类型的输出
             if isinstance(output, torch.Tensor):
                 # 张量转换为可序列化格式
@@ -862,6 +1180,23 @@ class PromptServer():
             state = request.app.node_state_manager.export_state()
             return web.json_response(state)
 
+        @routes.get("/api/node/preload")
+        async def get_node_preload_status(request):
+            """获取启动预热的进度和每个节点的就绪状态"""
+            if self.node_preloader is None:
+                return web.json_response({"enabled": False, "ready": True, "nodes": {}})
+            return web.json_response(dict(self.node_preloader.get_status(), enabled=True))
+
+        @routes.get("/api/node/placement")
+        async def get_node_placement(request):
+            """获取分布式节点分配表"""
+            manager = getattr(request.app, 'node_state_manager', None)
+            if manager is None:
+                return web.json_response({"error": "Node state manager not initialized"}, status=500)
+            if not hasattr(manager, "get_placement_table"):
+                return web.json_response({"assignments": {}, "rank": 0, "world_size": 1})
+            return web.json_response(manager.get_placement_table())
+
     async def setup(self):
         timeout = aiohttp.ClientTimeout(total=None) # no timeout
         self.client_session = aiohttp.ClientSession(timeout=timeout)
@@ -896,6 +1231,72 @@ class PromptServer():
 
         self.app.node_state_manager = self.node_state_manager
 
+    def add_worker(self, device=None):
+        context = PromptWorkerContext(self, len(self.workers), device)
+        self.workers.append(context)
+        return context
+
+    def get_worker_contexts(self):
+        if len(self.workers) == 0:
+            return [self]
+        return self.workers
+
+    def get_worker_running(self, prompt_id):
+        """The worker context running prompt_id (directly or fused with other prompts), or None"""
+        running, _ = self.prompt_queue.get_current_queue()
+        for item in running:
+            prompt_ids = [item[1]] + [member["prompt_id"] for member in item[3].get("fused_prompts", [])]
+            if prompt_id not in prompt_ids:
+                continue
+            for worker in self.workers:
+                if worker.last_prompt_id == item[1]:
+                    return worker
+        return None
+
+    def bind_current_thread(self):
+        self.worker_local.context = self
+        comfy.model_management.bind_interrupt_flag(None)
+
+    def get_worker_context(self):
+        # The worker context of the prompt running on the calling thread (used by progress hooks)
+        return getattr(self.worker_local, "context", self)
+
+    async def wait_for_preloaded_nodes(self, node_ids, wait=True, timeout=None):
+        """等待相关的预热节点完成，不等待或超时时返回503响应，否则返回None"""
+        preloader = self.node_preloader
+        if preloader is None:
+            return None
+        pending = preloader.pending_nodes(node_ids)
+        if wait and len(pending) > 0:
+            # 在线程中等待preloader的condition，节点完成时立即返回，不用轮询
+            await asyncio.get_running_loop().run_in_executor(None, preloader.wait_for, node_ids, timeout)
+            pending = preloader.pending_nodes(node_ids)
+        if len(pending) == 0:
+            return None
+        return web.json_response({
+            "error": "Nodes are still preloading",
+            "pending": sorted(pending),
+        }, status=503, headers={"Retry-After": "1"})
+
+    def apply_scheduling_options(self, json_data, extra_data):
+        """
+        Copies the optional "priority", "ttl" (seconds from now) and "deadline" (unix time) fields of
+        a /prompt request into extra_data where the queue scheduler reads them. Returns an error
+        message for invalid values.
+        """
+        if "priority" in json_data:
+            if json_data["priority"] not in PRIORITY_CLASSES:
+                return "Unknown priority {}, expected one of {}".format(json_data["priority"], ", ".join(PRIORITY_CLASSES))
+            extra_data["priority"] = json_data["priority"]
+        try:
+            if "deadline" in json_data:
+                extra_data["deadline"] = float(json_data["deadline"])
+            if "ttl" in json_data:
+                extra_data["deadline"] = time.time() + float(json_data["ttl"])
+        except (TypeError, ValueError):
+            return "ttl and deadline must be numbers"
+        return None
+
     def get_queue_info(self):
         prompt_info = {}
         exec_info = {}
@@ -905,7 +1306,8 @@ class PromptServer():
 
     async def send(self, event, data, sid=None):
         if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE:
-            await self.send_image(data, sid=sid)
+            # Encoded on the preview encoder's threads, frames that arrive while it is busy are skipped
+            self.preview_encoder.submit(data, sid)
         elif isinstance(data, (bytes, bytearray)):
             await self.send_bytes(event, data, sid)
         else:
@@ -921,48 +1323,23 @@ class PromptServer():
         return message
 
     async def send_image(self, image_data, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.ANTIALIAS
-
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
-        type_num = 1
-        if image_type == "JPEG":
-            type_num = 1
-        elif image_type == "PNG":
-            type_num = 2
-
-        bytesIO = BytesIO()
-        header = struct.pack(">I", type_num)
-        bytesIO.write(header)
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        preview_bytes = bytesIO.getvalue()
+        encoder = self.preview_encoder
+        preview_bytes = await self.loop.run_in_executor(encoder.pool, encode_preview, image_data, encoder.image_format, encoder.quality, encoder.max_size)
         await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes, sid=sid)
 
+    def deliver_preview(self, preview_bytes, sid=None):
+        # Called from the preview encoder threads
+        message = self.encode_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes)
+        self.loop.call_soon_threadsafe(self.fanout.publish_bytes, message, PREVIEW_KEY, sid)
+
     async def send_bytes(self, event, data, sid=None):
+        # Queued on each client's channel, the channels send concurrently
         message = self.encode_bytes(event, data)
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_bytes, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_bytes, message)
+        key = PREVIEW_KEY if event == BinaryEventTypes.PREVIEW_IMAGE else None
+        self.fanout.publish_bytes(message, key=key, sid=sid)
 
     async def send_json(self, event, data, sid=None):
-        message = {"type": event, "data": data}
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_json, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_json, message)
+        self.fanout.publish_json(event, data, sid)
 
     def send_sync(self, event, data, sid=None):
         self.loop.call_soon_threadsafe(
@@ -970,6 +1347,8 @@ class PromptServer():
 
     def queue_updated(self):
         self.send_sync("status", { "status": self.get_queue_info() })
+        if self.model_prefetcher is not None:
+            self.model_prefetcher.notify()
 
     async def publish_loop(self):
         while True:
@@ -0,0 +1,39 @@
+import pytest
+import torch
+import safetensors.torch
+
+import comfy.utils
+from comfy.checkpoint_stream import load_state_dict_streaming, plan_reads
+
+
+def test_plan_reads_splits_large_tensors_and_merges_small_ones():
+    items = [(0, 40, 4, "a"), (40, 8, 2, "b"), (1000, 100, 4, "c")]
+    reads = list(plan_reads(items, chunk_size=64, max_gap=16))
+    assert [(start, length) for start, length, _ in reads] == [(0, 48), (1000, 64), (1064, 36)]
+    assert [(p[0], p[1], p[2], p[3][3]) for p in reads[0][2]] == [(0, 40, 0, "a"), (40, 8, 0, "b")]
+    # The second part of c starts at element 16
+    assert [(p[0], p[1], p[2]) for p in reads[2][2]] == [(0, 36, 16)]
+
+
+@pytest.mark.parametrize("chunk_size", [64, 1024 * 1024])
+def test_streaming_matches_load_state_dict(tmp_path, chunk_size, monkeypatch):
+    monkeypatch.setattr(comfy.utils.args, "mmap_checkpoints", True)
+    sd = {
+        "0.weight": torch.randn(8, 32),
+        "0.bias": torch.randn(8),
+        "1.weight": torch.randn(4, 8),
+        "1.bias": torch.randn(4),
+        "extra": torch.randn(3),
+    }
+    path = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file(sd, path)
+    model = torch.nn.Sequential(torch.nn.Linear(32, 8), torch.nn.Linear(8, 4)).half()
+    loaded = comfy.utils.load_torch_file(path)
+    loaded["1.bias"] = loaded["1.bias"] * 2  # not a view of the file any more
+    missing, unexpected = load_state_dict_streaming(model, loaded, chunk_size=chunk_size, read_ahead=2)
+    assert missing == []
+    assert unexpected == ["extra"]
+    assert model[0].weight.dtype == torch.float16
+    assert torch.equal(model[0].weight, sd["0.weight"].half())
+    assert torch.equal(model[1].weight, sd["1.weight"].half())
+    assert torch.equal(model[1].bias, (sd["1.bias"] * 2).half())
@@ -0,0 +1,70 @@
+from comfy.eviction import CostAwarePolicy, EvictionCandidate, LegacyPolicy, ModelUsage, simulate
+
+GB = 1024 * 1024 * 1024
+
+
+def used(times, now):
+    usage = ModelUsage()
+    for t in times:
+        usage.record(t)
+    return usage
+
+
+def test_cost_policy_prefers_cheap_reloads_and_rarely_used_models():
+    policy = CostAwarePolicy()
+    candidates = [
+        EvictionCandidate(0, "unet", 6 * GB, 6 * GB, source="disk", partial=False, usage=used([0, 1, 2], 3)),
+        EvictionCandidate(1, "vae", 1 * GB, 1 * GB, source="ram", partial=False, usage=used([0, 1, 2], 3)),
+        EvictionCandidate(2, "upscaler", 1 * GB, 1 * GB, source="ram", partial=False, usage=used([0], 3)),
+    ]
+    order = [c.name for c in policy.order(candidates, 1 * GB, now=3)]
+    assert order == ["upscaler", "vae", "unet"]
+
+
+def test_partial_unload_only_costs_the_missing_bytes():
+    policy = CostAwarePolicy()
+    big = EvictionCandidate(0, "big", 10 * GB, 10 * GB, partial=True)
+    small = EvictionCandidate(1, "small", 2 * GB, 2 * GB, partial=False)
+    assert [c.name for c in policy.order([small, big], 1 * GB, now=0)] == ["big", "small"]
+    # When everything has to go the full size counts
+    assert [c.name for c in policy.order([small, big], None, now=0)] == ["small", "big"]
+
+
+def test_legacy_policy_keeps_the_original_order():
+    a = EvictionCandidate(0, "a", 4, 4, refcount=3)
+    b = EvictionCandidate(1, "b", 4, 2, refcount=5)
+    c = EvictionCandidate(2, "c", 2, 2, refcount=3)
+    assert [x.name for x in LegacyPolicy().order([a, b, c], 1)] == ["b", "c", "a"]
+
+
+def test_usage_decays():
+    usage = used([0, 0, 0], 0)
+    assert usage.frequency(0) == 3
+    assert usage.frequency(600) == 1.5
+
+
+def test_simulation_replays_trace_on_fixed_memory():
+    trace = [
+        {"model": "unet", "size": 6 * GB, "source": "disk", "partial": False},
+        {"model": "clip", "size": 2 * GB, "partial": False},
+        {"model": "unet", "size": 6 * GB, "source": "disk", "partial": False},
+        {"model": "vae", "size": 1 * GB, "partial": False},
+        {"model": "clip", "size": 2 * GB, "partial": False},
+        {"model": "unet", "size": 6 * GB, "source": "disk", "partial": False},
+    ]
+    events = []
+    cost = simulate(CostAwarePolicy(), trace, 8 * GB, on_event=events.append)
+    assert cost["requests"] == 6
+    assert cost["hits"] == 2
+    # The unet is too expensive to reload, clip and vae take turns in the remaining memory
+    assert [e["model"] for e in events] == ["clip", "vae"]
+    assert cost["bytes_loaded"] == 11 * GB
+    legacy = simulate(LegacyPolicy(), trace, 8 * GB)
+    assert legacy["load_seconds"] >= cost["load_seconds"]
+
+
+def test_cost_policy_unloads_unreferenced_models_first():
+    policy = CostAwarePolicy()
+    referenced = EvictionCandidate(0, "referenced", 1 * GB, 1 * GB, refcount=4, partial=False)
+    unreferenced = EvictionCandidate(1, "unreferenced", 8 * GB, 8 * GB, refcount=2, source="disk", partial=False)
+    assert [c.name for c in policy.order([referenced, unreferenced], 1 * GB, now=0)] == ["unreferenced", "referenced"]
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+import comfy.model_management as mm
+
+
+def run_bound(flag, func):
+    result = {}
+
+    def target():
+        mm.bind_interrupt_flag(flag)
+        try:
+            result["value"] = func()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    return result
+
+
+def test_interrupts_stay_with_their_worker():
+    a = mm.register_interrupt_flag()
+    b = mm.register_interrupt_flag()
+    # A worker starting a prompt only clears its own flag
+    mm.interrupt_current_processing(True, flag=a)
+    run_bound(b, lambda: mm.interrupt_current_processing(False))
+    assert run_bound(a, mm.processing_interrupted)["value"]
+    assert not run_bound(b, mm.processing_interrupted)["value"]
+    assert isinstance(run_bound(a, mm.throw_exception_if_processing_interrupted)["error"], mm.InterruptProcessingException)
+    assert not a.value
+
+
+def test_unbound_threads_interrupt_every_worker():
+    a = mm.register_interrupt_flag()
+    b = mm.register_interrupt_flag()
+    mm.interrupt_current_processing(True)
+    assert a.value and b.value
+    mm.interrupt_current_processing(False)
+    assert not a.value and not b.value
+    with pytest.raises(mm.InterruptProcessingException):
+        mm.interrupt_current_processing(True)
+        mm.throw_exception_if_processing_interrupted()
+    mm.interrupt_current_processing(False)
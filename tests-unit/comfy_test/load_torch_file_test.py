@@ -0,0 +1,70 @@
+import json
+import struct
+
+import pytest
+import torch
+import safetensors.torch
+
+import comfy.utils
+import comfy.weight_store
+
+
+@pytest.fixture
+def mmap_checkpoints(monkeypatch):
+    monkeypatch.setattr(comfy.utils.args, "mmap_checkpoints", True)
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    sd = {
+        "model.diffusion_model.weight": torch.randn(16, 8),
+        "model.diffusion_model.bias": torch.randn(16).half(),
+        "cond_stage_model.ids": torch.arange(10, dtype=torch.int64),
+        "first_stage_model.scale": torch.tensor(0.5, dtype=torch.bfloat16),
+        "empty": torch.zeros(0, 4),
+    }
+    path = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file(sd, path, metadata={"format": "pt"})
+    return path, sd
+
+
+def test_checkpoints_are_only_mapped_when_enabled(checkpoint):
+    path, _ = checkpoint
+    sd = comfy.utils.load_torch_file(path)
+    assert comfy.utils.mapped_file_location(sd["model.diffusion_model.weight"]) is None
+
+
+def test_mmap_state_dict_matches_safe_open(checkpoint, mmap_checkpoints):
+    path, expected = checkpoint
+    sd, metadata = comfy.utils.load_torch_file(path, return_metadata=True)
+    assert isinstance(sd, dict)
+    assert comfy.utils.mapped_file_location(sd["model.diffusion_model.weight"])[0] == path
+    assert metadata == {"format": "pt"}
+    assert sd.keys() == expected.keys()
+    for k, v in expected.items():
+        assert sd[k].dtype == v.dtype
+        assert torch.equal(sd[k], v)
+
+
+def test_prefix_replace_and_in_place_changes(checkpoint, mmap_checkpoints):
+    path, expected = checkpoint
+    sd = comfy.utils.load_torch_file(path)
+    unet = comfy.utils.state_dict_prefix_replace(sd, {"model.diffusion_model.": ""}, filter_keys=True)
+    assert set(unet.keys()) == {"weight", "bias"}
+    assert "model.diffusion_model.weight" not in sd
+    unet["weight"].mul_(0)
+    # Drop the shared copy from the weight store, the mapping is copy on write
+    del sd, unet
+    comfy.weight_store.store.clear()
+    assert torch.equal(comfy.utils.load_torch_file(path)["model.diffusion_model.weight"], expected["model.diffusion_model.weight"])
+
+
+def test_unaligned_tensors(tmp_path, mmap_checkpoints):
+    values = torch.arange(4, dtype=torch.float32)
+    header = json.dumps({"a": {"dtype": "U8", "shape": [1], "data_offsets": [0, 1]},
+                         "b": {"dtype": "F32", "shape": [4], "data_offsets": [1, 17]}}).encode()
+    path = tmp_path / "unaligned.safetensors"
+    path.write_bytes(struct.pack("<Q", len(header)) + header + b"\x07" + values.numpy().tobytes())
+    sd = comfy.utils.load_torch_file(str(path))
+    assert sd["a"].tolist() == [7]
+    assert torch.equal(sd["b"], values)
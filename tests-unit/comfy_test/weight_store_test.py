@@ -0,0 +1,124 @@
+import gc
+import os
+import threading
+
+import torch
+
+from comfy.weight_store import WeightStore
+
+
+def make_file(tmp_path, name="model.ckpt", content=b"x"):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def counting_loader(calls, mapped=False, size=16):
+    def loader():
+        calls.append(True)
+        return {"weight": torch.ones(size // 4), "step": 3}, {"format": "pt"}, mapped
+    return loader
+
+
+def test_loaders_share_tensors_and_released_files_stay_cached(tmp_path):
+    store = WeightStore(ram_budget=1024, max_released=16)
+    path = make_file(tmp_path)
+    calls = []
+    a, metadata = store.load(path, counting_loader(calls))
+    b, _ = store.load(path, counting_loader(calls))
+    assert len(calls) == 1
+    assert metadata == {"format": "pt"}
+    assert a["weight"] is b["weight"]
+    a.pop("weight")
+    assert "weight" in b
+    assert store.get_stats()["entries"][0]["refs"] == 2
+    del a, b
+    gc.collect()
+    stats = store.get_stats()
+    assert stats["entries"][0]["refs"] == 0
+    assert stats["released_ram"] == 16
+    store.load(path, counting_loader(calls))
+    assert len(calls) == 1
+    assert store.get_stats()["hits"] == 2
+
+
+def test_budget_evicts_least_recently_released(tmp_path):
+    store = WeightStore(ram_budget=40, max_released=16)
+    paths = [make_file(tmp_path, "{}.ckpt".format(i)) for i in range(3)]
+    calls = []
+    for path in paths:
+        sd, _ = store.load(path, counting_loader(calls, size=16))
+        del sd
+    gc.collect()
+    assert [os.path.basename(e["path"]) for e in store.get_stats()["entries"]] == ["1.ckpt", "2.ckpt"]
+    # Memory mapped files don't count against the budget
+    sd, _ = store.load(make_file(tmp_path, "mapped.sft"), counting_loader(calls, mapped=True, size=1024))
+    del sd
+    gc.collect()
+    assert len(store.get_stats()["entries"]) == 3
+
+
+def test_released_files_are_dropped_by_default(tmp_path):
+    store = WeightStore(ram_budget=1024)
+    path = make_file(tmp_path, "mapped.sft")
+    calls = []
+    sd, _ = store.load(path, counting_loader(calls, mapped=True))
+    del sd
+    gc.collect()
+    assert store.get_stats()["entries"] == []
+    store.load(path, counting_loader(calls, mapped=True))
+    assert len(calls) == 2
+
+
+def test_changed_files_and_dtypes_are_different_entries(tmp_path):
+    store = WeightStore(ram_budget=1024, max_released=16)
+    path = make_file(tmp_path)
+    calls = []
+    sd, _ = store.load(path, counting_loader(calls))
+    half, _ = store.load(path, counting_loader(calls), dtype=torch.float16)
+    assert half["weight"].dtype == torch.float16
+    assert half["step"] == 3
+    del sd, half
+    gc.collect()
+    make_file(tmp_path, content=b"changed")
+    store.load(path, counting_loader(calls))
+    assert len(calls) == 3
+    # The released entry of the old file content is gone, the fp16 one of it too
+    assert len(store.get_stats()["entries"]) == 1
+
+
+def test_safe_load_is_part_of_the_key(tmp_path):
+    store = WeightStore()
+    path = make_file(tmp_path)
+    calls = []
+    unsafe, _ = store.load(path, counting_loader(calls))
+    safe, _ = store.load(path, counting_loader(calls), safe_load=True)
+    again, _ = store.load(path, counting_loader(calls), safe_load=True)
+    assert len(calls) == 2
+    assert safe["weight"] is again["weight"]
+    assert safe["weight"] is not unsafe["weight"]
+
+
+def test_concurrent_loads_read_the_file_once(tmp_path):
+    store = WeightStore()
+    path = make_file(tmp_path)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        calls.append(True)
+        started.set()
+        release.wait(5)
+        return {"weight": torch.ones(2)}, None, False
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.load(path, slow_loader)[0])) for _ in range(3)]
+    for t in threads:
+        t.start()
+    started.wait(5)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r["weight"] is results[0]["weight"] for r in results)
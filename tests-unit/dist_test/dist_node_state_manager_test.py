@@ -0,0 +1,46 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from dist_node_state_manager import DistributedNodeStateManager
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run(rank, port, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=2)
+    manager = DistributedNodeStateManager()
+    manager.initialize(True, rank, 2, 0, node_specs={"0": ["*"], "1": ["*"]}, memory_capacity=1024 ** 3)
+    manager.handle_remote_requests()
+    if rank == 1:
+        # Only rank 1 has run a Slow node, rank 0 has no timing for the class
+        manager.record_node_execution("x", "Slow", 4.0, (torch.zeros(256),))
+    for node_id, class_type in (("a", "Slow"), ("b", "Fast"), ("c", "Fast")):
+        manager.register_persistent_node(node_id, {"class_type": class_type, "inputs": {}})
+    if rank == 0:
+        placement = manager.placement
+        results.put((dict(placement.class_times), placement.output_sizes.get("x", None), dict(placement.assignments)))
+    dist.barrier()
+    manager.shutdown()
+    dist.destroy_process_group()
+
+
+def test_rank_0_places_with_remote_timings():
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    context = mp.start_processes(run, args=(free_port(), results), nprocs=2, join=False, start_method="spawn")
+    class_times, output_size, assignments = results.get(timeout=60)
+    assert context.join(timeout=60)
+    assert class_times["Slow"] == 4.0
+    assert output_size == 256 * 4
+    # With the default timing the slow node would look as cheap as the fast ones and c would go to rank 0
+    assert assignments == {"a": 0, "b": 1, "c": 1}
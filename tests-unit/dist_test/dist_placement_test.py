@@ -0,0 +1,54 @@
+from dist_placement import PlacementEngine
+
+
+def node(class_type, **inputs):
+    return {"class_type": class_type, "inputs": inputs}
+
+
+def test_specs_are_respected():
+    engine = PlacementEngine(2, {"0": ["CheckpointLoaderSimple"], "1": ["KSampler"]})
+    assert engine.place("1", node("CheckpointLoaderSimple")) == 0
+    assert engine.place("2", node("KSampler")) == 1
+    # Unlisted classes without a wildcard go to the default rank
+    assert engine.place("3", node("VAEDecode")) == 0
+
+
+def test_wildcard_nodes_are_spread_by_load():
+    engine = PlacementEngine(2, {"0": ["*"], "1": ["*"]})
+    engine.record_execution("KSampler", 2.0)
+    ranks = [engine.place(str(i), node("KSampler")) for i in range(4)]
+    assert sorted(ranks) == [0, 0, 1, 1]
+
+
+def test_producer_and_heavy_consumer_are_colocated():
+    engine = PlacementEngine(2, {"0": ["*"], "1": ["*"]}, transfer_bandwidth=1024 ** 3)
+    engine.record_execution("Busy", 0.5)
+    engine.place("busy", node("Busy"))
+    engine.place("loader", node("CheckpointLoaderSimple"))
+    engine.output_sizes["loader"] = 4 * 1024 ** 3
+    # The sampler would balance better on the other rank, but moving the model costs more
+    assert engine.place("sampler", node("KSampler", model=["loader", 0])) == engine.assignments["loader"]
+
+
+def test_memory_capacity():
+    engine = PlacementEngine(2, {"0": ["*"], "1": ["*"]}, memory_capacity={0: 100})
+    engine.node_memory["big"] = 200
+    assert engine.place("big", node("CheckpointLoaderSimple")) == 1
+
+
+def test_rebalance_moves_work_off_a_hot_rank():
+    engine = PlacementEngine(2, {"0": ["*"], "1": ["*"]})
+    for i in range(4):
+        engine.place(str(i), node("KSampler"), rank=0)
+        engine.pinned.discard(str(i))
+    engine.record_execution("KSampler", 1.0)
+    moves = engine.rebalance()
+    assert len(moves) == 2
+    assert engine.get_table()["load"] == {0: 2.0, 1: 2.0}
+
+
+def test_manager_places_within_its_memory_capacity():
+    from dist_node_state_manager import DistributedNodeStateManager
+    manager = DistributedNodeStateManager()
+    manager.initialize(False, 0, 1, 0, node_specs={"0": ["*"]}, memory_capacity=100)
+    assert manager.placement.memory_capacity == {0: 100}
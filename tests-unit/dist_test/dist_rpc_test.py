@@ -0,0 +1,78 @@
+import concurrent.futures
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from dist_rpc import NodeOutputRPC
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def outputs_for(node_id):
+    index = int(node_id)
+    return (torch.full((4, 8, 8, 3), float(index)), {"node": node_id})
+
+
+def run(rank, port, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=2)
+    rpc = NodeOutputRPC(rank, lambda node_id, output_index: outputs_for(node_id)[output_index], device=torch.device("cpu"))
+    rpc.start()
+    dist.barrier()
+    if rank == 0:
+        # Several requests in flight at once, one of them prefetched first
+        rpc.prefetch(1, "3", 0)
+        futures = [rpc.request(1, str(i), 0) for i in range(6)]
+        values = [f.result(timeout=30)[0, 0, 0, 0].item() for f in futures]
+        meta = rpc.fetch(1, "5", 1, timeout=30)
+        prefetched = rpc.fetch(1, "3", 0, timeout=30)
+        results.put(("fetched", (values, meta, prefetched[0, 0, 0, 0].item(), rpc.get_stats()["requests"])))
+    dist.barrier()
+    rpc.stop()
+    results.put(("stopped {}".format(rank), rpc.thread is None and not rpc.serving))
+    dist.destroy_process_group()
+
+
+def test_concurrent_requests_over_gloo():
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    context = mp.start_processes(run, args=(free_port(), results), nprocs=2, join=False, start_method="spawn")
+    received = dict(results.get(timeout=60) for _ in range(3))
+    # join raises if a process died, for example aborted with the server thread still in gloo
+    assert context.join(timeout=60)
+    assert received["stopped 0"] and received["stopped 1"]
+    values, meta, prefetched, requests = received["fetched"]
+    assert values == [float(i) for i in range(6)]
+    assert meta == {"node": "5"}
+    assert prefetched == 3.0
+    # The prefetched output is shared with the concurrent request for the same node
+    assert requests == 7
+
+
+def test_unfetched_prefetches_expire():
+    rpc = NodeOutputRPC(0, None, prefetch_ttl=60.0, max_prefetched=2)
+
+    def request(target_rank, node_id, output_index=0):
+        future = concurrent.futures.Future()
+        rpc.pending[(target_rank, node_id, output_index)] = future
+        return future
+
+    rpc.request = request
+    for node_id in ("1", "2", "3"):
+        rpc.prefetch(1, node_id)
+    rpc.prefetch(1, "4")
+    # Only the two most recent prefetches are kept
+    assert sorted(key[1] for key in rpc.pending) == ["3", "4"]
+    assert rpc.get_stats()["prefetch_expired"] == 2
+    for key in rpc.prefetched:
+        rpc.prefetched[key] -= 120.0
+    rpc.prefetch(1, "5")
+    assert list(rpc.pending) == [(1, "5", 0)]
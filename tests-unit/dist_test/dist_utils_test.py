@@ -0,0 +1,28 @@
+import torch
+
+from dist_utils import pack_object, unpack_object, bytes_to_uint8_tensor, uint8_tensor_to_bytes
+
+
+def test_pack_keeps_tensors_out_of_the_header():
+    image = torch.rand((1, 64, 64, 3))
+    obj = {"output": (image, [[torch.zeros((1, 77, 8), dtype=torch.bfloat16), {"pooled_output": None}]]), "text": "a cat"}
+    header, tensors = pack_object(obj)
+    assert len(tensors) == 2
+    assert len(header) < 1024
+    out = unpack_object(header, [t.clone() for t in tensors])
+    assert torch.equal(out["output"][0], image)
+    assert out["output"][1][0][0].dtype == torch.bfloat16
+    assert out["text"] == "a cat"
+
+
+def test_shared_tensors_are_sent_once():
+    t = torch.arange(10)
+    header, tensors = pack_object((t, t, [t]))
+    assert len(tensors) == 1
+    out = unpack_object(header, tensors)
+    assert out[0] is out[1] and out[2][0] is out[0]
+
+
+def test_bytes_round_trip():
+    data = bytes(range(256)) * 4
+    assert uint8_tensor_to_bytes(bytes_to_uint8_tensor(data)) == data
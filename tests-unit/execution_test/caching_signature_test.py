@@ -0,0 +1,110 @@
+import copy
+
+import pytest
+
+import nodes
+from comfy_execution.caching import LRUCache, CacheKeySetInputSignature
+from comfy_execution.graph import DynamicPrompt
+
+
+class DummyNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {}}
+
+
+class NotIdempotentNode(DummyNode):
+    NOT_IDEMPOTENT = True
+
+
+class StaticIsChanged:
+    def get(self, node_id):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def dummy_nodes(monkeypatch):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "DummyNode", DummyNode)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "NotIdempotentNode", NotIdempotentNode)
+
+
+def get_keys(prompt):
+    cache = LRUCache(CacheKeySetInputSignature, max_size=10)
+    cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), StaticIsChanged())
+    return cache.cache_key_set.keys
+
+
+def diamond():
+    return {
+        "1": {"class_type": "DummyNode", "inputs": {"value": 1}},
+        "2": {"class_type": "DummyNode", "inputs": {"a": ["1", 0], "value": 2}},
+        "3": {"class_type": "DummyNode", "inputs": {"a": ["1", 0], "value": 3}},
+        "4": {"class_type": "DummyNode", "inputs": {"a": ["2", 0], "b": ["3", 0]}},
+    }
+
+
+def test_signature_is_stable_across_prompts():
+    assert get_keys(diamond()) == get_keys(diamond())
+
+
+def test_signature_ignores_node_ids():
+    prompt = diamond()
+    renamed = {f"x{k}": copy.deepcopy(v) for k, v in prompt.items()}
+    for node in renamed.values():
+        for name, value in node["inputs"].items():
+            if isinstance(value, list):
+                node["inputs"][name] = [f"x{value[0]}", value[1]]
+    keys = get_keys(prompt)
+    renamed_keys = get_keys(renamed)
+    assert all(keys[k] == renamed_keys[f"x{k}"] for k in keys)
+
+
+def test_change_only_invalidates_descendants():
+    keys = get_keys(diamond())
+    changed = diamond()
+    changed["2"]["inputs"]["value"] = 5
+    changed_keys = get_keys(changed)
+    assert keys["1"] == changed_keys["1"]
+    assert keys["3"] == changed_keys["3"]
+    assert keys["2"] != changed_keys["2"]
+    assert keys["4"] != changed_keys["4"]
+
+
+def test_socket_index_is_part_of_signature():
+    prompt = diamond()
+    other = diamond()
+    other["2"]["inputs"]["a"] = ["1", 1]
+    assert get_keys(prompt)["2"] != get_keys(other)["2"]
+
+
+def test_nan_makes_node_and_descendants_uncacheable():
+    prompt = diamond()
+    prompt["1"]["inputs"]["value"] = float("NaN")
+    first = get_keys(prompt)
+    second = get_keys(prompt)
+    for node_id in prompt:
+        assert first[node_id] != second[node_id]
+
+
+def test_not_idempotent_includes_node_id():
+    prompt = {
+        "1": {"class_type": "NotIdempotentNode", "inputs": {"value": 1}},
+        "2": {"class_type": "NotIdempotentNode", "inputs": {"value": 1}},
+    }
+    keys = get_keys(prompt)
+    assert keys["1"] != keys["2"]
+
+
+def test_cycle_does_not_hang():
+    prompt = diamond()
+    prompt["1"]["inputs"]["a"] = ["4", 0]
+    keys = get_keys(prompt)
+    assert set(keys.keys()) == set(prompt.keys())
+
+
+def test_long_chain_does_not_recurse():
+    prompt = {"0": {"class_type": "DummyNode", "inputs": {"value": 0}}}
+    for i in range(1, 5000):
+        prompt[str(i)] = {"class_type": "DummyNode", "inputs": {"a": [str(i - 1), 0]}}
+    keys = get_keys(prompt)
+    assert len(set(keys.values())) == len(prompt)
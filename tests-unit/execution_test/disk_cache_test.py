@@ -0,0 +1,69 @@
+import os
+
+import pytest
+import torch
+
+import nodes
+from comfy_execution.disk_cache import DiskCache, encode_output, decode_output, NotSerializable
+
+
+class DeterministicNode:
+    pass
+
+
+class RandomNode:
+    NOT_IDEMPOTENT = True
+
+
+@pytest.fixture(autouse=True)
+def dummy_nodes(monkeypatch):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "DeterministicNode", DeterministicNode)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "RandomNode", RandomNode)
+
+
+def conditioning():
+    cond = torch.randn(1, 77, 768)
+    return [[[cond, {"pooled_output": torch.randn(1, 768), "strength": 1.0}]]]
+
+
+def test_encode_roundtrip():
+    output = [[{"samples": torch.randn(1, 4, 8, 8)}], [("a", 1)]]
+    tensors = {}
+    decoded = decode_output(encode_output(output, tensors, {}), tensors)
+    assert torch.equal(decoded[0][0]["samples"], output[0][0]["samples"])
+    assert decoded[1][0] == ("a", 1)
+
+
+def test_encode_rejects_objects():
+    with pytest.raises(NotSerializable):
+        encode_output([[object()]], {}, {})
+
+
+def test_put_get_survives_new_instance(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=1024 * 1024 * 1024, min_execution_time=0)
+    output = conditioning()
+    assert cache.put("abc", "DeterministicNode", output, execution_time=1.0)
+    cache.flush()
+
+    reopened = DiskCache(str(tmp_path), max_size=1024 * 1024 * 1024)
+    loaded = reopened.get("abc")
+    assert torch.equal(loaded[0][0][0], output[0][0][0])
+    assert torch.equal(loaded[0][0][1]["pooled_output"], output[0][0][1]["pooled_output"])
+    assert loaded[0][0][1]["strength"] == 1.0
+
+
+def test_skips_uncacheable(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=1024 * 1024, min_execution_time=0)
+    assert not cache.put("uncacheable:1234", "DeterministicNode", [[torch.zeros(1)]], execution_time=1.0)
+    assert not cache.put("abc", "RandomNode", [[torch.zeros(1)]], execution_time=1.0)
+    assert not cache.put("abc", "DeterministicNode", [[object()]], execution_time=1.0)
+
+
+def test_evicts_oldest_over_size(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=3 * 1024 * 1024, min_execution_time=0)
+    for i in range(5):
+        cache.put(f"key{i}", "DeterministicNode", [[torch.zeros(256 * 1024)]], execution_time=1.0)
+        cache.flush()
+    assert cache.get_stats()["size"] <= 3 * 1024 * 1024
+    assert not os.path.exists(os.path.join(str(tmp_path), "key0.safetensors"))
+    assert cache.get("key4") is not None
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from comfy_execution.history_store import HistoryStore
+
+
+def make_entry(number, client_id="a", status="success"):
+    prompt = (number, f"prompt-{number}", {"1": {"class_type": "SaveImage", "inputs": {}}}, {"client_id": client_id}, ["1"])
+    return {"prompt": prompt, "outputs": {"1": {"images": [{"filename": f"{number}.png"}]}}, "status": {"status_str": status, "completed": True, "messages": []}}
+
+
+def fill(store, count, **kwargs):
+    for n in range(count):
+        store.add(f"prompt-{n}", make_entry(n, **kwargs))
+
+
+def test_get_and_list():
+    store = HistoryStore()
+    fill(store, 5)
+    assert store.get("prompt-2")["outputs"]["1"]["images"][0]["filename"] == "2.png"
+    assert store.get("missing") is None
+    assert list(store.list()) == [f"prompt-{n}" for n in range(5)]
+    assert list(store.list(max_items=2)) == ["prompt-3", "prompt-4"]
+    assert list(store.list(max_items=2, offset=1)) == ["prompt-1", "prompt-2"]
+
+
+def test_max_items_drops_oldest():
+    store = HistoryStore(max_items=3)
+    fill(store, 5)
+    assert len(store) == 3
+    assert list(store.list()) == ["prompt-2", "prompt-3", "prompt-4"]
+
+
+def test_cursor_pagination_and_filters():
+    store = HistoryStore()
+    for n in range(7):
+        store.add(f"prompt-{n}", make_entry(n, client_id="a" if n % 2 == 0 else "b", status="error" if n == 4 else "success"))
+    items, cursor = store.page(limit=3)
+    assert list(items) == ["prompt-6", "prompt-5", "prompt-4"]
+    items, cursor = store.page(cursor=cursor, limit=3)
+    assert list(items) == ["prompt-3", "prompt-2", "prompt-1"]
+    items, cursor = store.page(cursor=cursor, limit=3)
+    assert list(items) == ["prompt-0"]
+    assert cursor is None
+
+    assert list(store.page(client_id="b")[0]) == ["prompt-5", "prompt-3", "prompt-1"]
+    assert list(store.page(status="error")[0]) == ["prompt-4"]
+
+
+def test_delete_and_clear():
+    store = HistoryStore()
+    fill(store, 3)
+    store.delete("prompt-1")
+    assert len(store) == 2
+    store.add("prompt-0", make_entry(0))
+    assert len(store) == 2
+    store.clear()
+    assert len(store) == 0
+    assert store.list() == {}
+
+
+def test_failed_add_rolls_back():
+    store = HistoryStore()
+    fill(store, 2)
+    broken = make_entry(1)
+    broken["status"]["status_str"] = ["not", "a", "column", "value"]
+    with pytest.raises(sqlite3.Error):
+        store.add("prompt-1", broken)
+    # The replaced entry is still there and the connection is usable
+    assert len(store) == 2
+    assert store.get("prompt-1")["status"]["status_str"] == "success"
+    store.add("prompt-2", make_entry(2))
+    assert list(store.list()) == ["prompt-0", "prompt-1", "prompt-2"]
+
+
+def test_survives_reopen():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, "history.db")
+        store = HistoryStore(path)
+        fill(store, 3)
+        store.db.close()
+        store = HistoryStore(path)
+        assert len(store) == 3
+        assert store.get("prompt-1")["prompt"][1] == "prompt-1"
+        store.db.close()
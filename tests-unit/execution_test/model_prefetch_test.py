@@ -0,0 +1,81 @@
+import threading
+import time
+
+from comfy_execution.model_prefetch import ModelPrefetcher
+from comfy_execution.prompt_scheduler import PromptScheduler
+
+
+class FakeQueue:
+    def __init__(self):
+        self.mutex = threading.RLock()
+        self.queue = PromptScheduler()
+        self.currently_running = {}
+
+    def put(self, number, files):
+        prompt = {str(i): {"class_type": "Loader", "inputs": {"ckpt_name": name}} for i, name in enumerate(files)}
+        self.queue.push((number, "prompt{}".format(number), prompt, {}, []))
+
+    def start_next(self):
+        item = self.queue.pop()
+        self.currently_running[item[0]] = item
+        return item[0]
+
+
+def make_prefetcher(queue, sizes, depth=2, ram_budget=100):
+    loaded = []
+
+    def load(path):
+        loaded.append(path)
+        return {"weight": path}
+
+    def resolve(prompt):
+        return [node["inputs"]["ckpt_name"] for node in prompt.values()]
+
+    prefetcher = ModelPrefetcher(queue, depth=depth, ram_budget=ram_budget, load=load, resolve=resolve)
+    return prefetcher, loaded
+
+
+def test_prefetches_queued_files_in_order_within_budget(monkeypatch):
+    sizes = {"a": 40, "b": 40, "c": 40}
+    monkeypatch.setattr("os.path.getsize", lambda path: sizes[path])
+    queue = FakeQueue()
+    queue.put(1, ["a", "b"])
+    queue.put(2, ["c"])
+    prefetcher, loaded = make_prefetcher(queue, sizes)
+    prefetcher.update()
+    assert loaded == ["a", "b"]
+    stats = prefetcher.get_stats()
+    assert stats["over_budget"] == 1
+    assert list(stats["held"].keys()) == ["a", "b"]
+
+
+def test_running_prompts_keep_their_files_until_done(monkeypatch):
+    monkeypatch.setattr("os.path.getsize", lambda path: 10)
+    queue = FakeQueue()
+    queue.put(1, ["a"])
+    queue.put(2, ["b"])
+    queue.put(3, ["c"])
+    prefetcher, loaded = make_prefetcher(queue, {}, depth=1)
+    prefetcher.update()
+    assert loaded == ["a"]
+    number = queue.start_next()
+    prefetcher.update()
+    # a is still needed by the running prompt, the running prompt's files are never fetched again
+    assert loaded == ["a", "b"]
+    assert set(prefetcher.get_stats()["held"].keys()) == {"a", "b"}
+    del queue.currently_running[number]
+    prefetcher.update()
+    assert set(prefetcher.get_stats()["held"].keys()) == {"b"}
+
+
+def test_background_thread_follows_queue_updates(monkeypatch):
+    monkeypatch.setattr("os.path.getsize", lambda path: 10)
+    queue = FakeQueue()
+    prefetcher, loaded = make_prefetcher(queue, {})
+    prefetcher.start()
+    queue.put(1, ["a"])
+    prefetcher.notify()
+    deadline = time.time() + 5
+    while loaded != ["a"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert loaded == ["a"]
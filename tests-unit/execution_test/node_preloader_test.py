@@ -0,0 +1,88 @@
+import threading
+import time
+
+from node_preloader import NodePreloader
+from node_state_manager import NodeStateManager
+
+
+def make_nodes():
+    return {
+        "ckpt": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "vae": {"class_type": "VAELoader", "inputs": {"vae_name": "b.safetensors"}},
+        "text": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["ckpt", 1], "text": "a cat"}},
+    }
+
+
+def start(nodes, execute, max_workers=4):
+    manager = NodeStateManager(measure=lambda outputs: (0, 0))
+    for node_id, node_data in nodes.items():
+        manager.register_persistent_node(node_id, node_data)
+    preloader = NodePreloader(manager, max_workers=max_workers, execute=execute)
+    preloader.start(nodes)
+    return preloader, manager
+
+
+def test_independent_loaders_overlap_and_dependents_wait():
+    running = set()
+    overlapped = []
+    order = []
+    lock = threading.Lock()
+
+    def execute(node_id, node_data, state_manager):
+        with lock:
+            running.add(node_id)
+            if {"ckpt", "vae"} <= running:
+                overlapped.append(True)
+        time.sleep(0.05)
+        with lock:
+            running.discard(node_id)
+            order.append(node_id)
+        state_manager.set_node_output(node_id, (node_id,))
+        return (node_id,), None
+
+    preloader, manager = start(make_nodes(), execute)
+    assert preloader.wait_for(["text"], timeout=5)
+    assert overlapped
+    assert order.index("text") > order.index("ckpt")
+    status = preloader.get_status()
+    assert status["ready"]
+    assert status["counts"]["ready"] == 3
+
+
+def test_failures_propagate_to_dependents():
+    def execute(node_id, node_data, state_manager):
+        if node_id == "ckpt":
+            return None, "file not found"
+        return (node_id,), None
+
+    preloader, _ = start(make_nodes(), execute)
+    assert preloader.wait_for(["text", "vae"], timeout=5)
+    nodes = preloader.get_status()["nodes"]
+    assert nodes["ckpt"]["error"] == "file not found"
+    assert nodes["text"]["state"] == "failed"
+    assert nodes["vae"]["state"] == "ready"
+
+
+def test_unregistered_consumers_wait_for_linked_nodes():
+    release = threading.Event()
+
+    def execute(node_id, node_data, state_manager):
+        release.wait(5)
+        return (node_id,), None
+
+    preloader, manager = start({"ckpt": make_nodes()["ckpt"]}, execute)
+    manager.register_persistent_node("sampler", {"class_type": "KSampler", "inputs": {"model": ["ckpt", 0]}})
+    assert preloader.pending_nodes(["sampler"]) == {"ckpt"}
+    assert not preloader.wait_for(["sampler"], timeout=0.05)
+    release.set()
+    assert preloader.wait_for(["sampler"], timeout=5)
+
+
+def test_cycles_fail_instead_of_hanging():
+    nodes = {
+        "a": {"class_type": "A", "inputs": {"x": ["b", 0]}},
+        "b": {"class_type": "B", "inputs": {"x": ["a", 0]}},
+    }
+    preloader, _ = start(nodes, lambda node_id, node_data, state_manager: ((1,), None))
+    assert preloader.wait_for(["a"], timeout=1)
+    assert preloader.get_status()["nodes"]["a"]["error"] == "Dependency cycle detected"
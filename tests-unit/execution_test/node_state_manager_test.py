@@ -0,0 +1,75 @@
+import time
+
+from node_state_manager import NodeStateManager, contains_model
+
+
+class FakeModel:
+    def model_size(self):
+        return 100
+
+    def loaded_size(self):
+        return 0
+
+
+def measure(outputs):
+    # Each output is (label, ram_bytes)
+    return outputs[1], 0
+
+
+def test_outputs_within_ram_budget_are_kept():
+    manager = NodeStateManager(ram_budget=100, measure=measure)
+    manager.set_node_output("1", ("a", 40))
+    manager.set_node_output("2", ("b", 40))
+    assert manager.has_node_output("1") and manager.has_node_output("2")
+    assert manager.get_memory_stats()["ram_used"] == 80
+
+
+def test_least_recently_used_output_is_evicted():
+    manager = NodeStateManager(ram_budget=100, measure=measure)
+    manager.register_persistent_node("1", {"class_type": "A", "inputs": {}})
+    manager.set_node_output("1", ("a", 40))
+    manager.set_node_output("2", ("b", 40))
+    time.sleep(0.01)
+    manager.get_node_output("1")
+    manager.set_node_output("3", ("c", 40))
+    assert not manager.has_node_output("2")
+    assert manager.get_node_output("1") == "a"
+    assert manager.get_output_version("2") is None
+    # The node stays registered so it can be recomputed
+    assert "1" in manager.persistent_nodes
+    stats = manager.get_memory_stats()
+    assert stats["evicted"] == 1
+    assert stats["ram_used"] == 80
+
+
+def test_expired_outputs_are_released():
+    manager = NodeStateManager(ttl=0.05, measure=measure)
+    manager.set_node_output("1", ("a", 10))
+    time.sleep(0.1)
+    manager.set_node_output("2", ("b", 10))
+    assert not manager.has_node_output("1")
+    assert manager.has_node_output("2")
+
+
+def test_release_drops_model_outputs():
+    manager = NodeStateManager(measure=lambda outputs: (0, 0))
+    manager.set_node_output("model", (FakeModel(),))
+    manager.set_node_output("value", (1,))
+    manager.release(free_memory=True)
+    assert not manager.has_node_output("model")
+    assert manager.has_node_output("value")
+
+
+def test_contains_model():
+    assert contains_model((FakeModel(), 1))
+    assert contains_model([{"model": FakeModel()}])
+    assert not contains_model(([1, 2], {"a": "b"}))
+
+
+def test_export_state_reports_memory():
+    manager = NodeStateManager(ram_budget=1000, measure=measure)
+    manager.set_node_output("1", ("a", 10))
+    state = manager.export_state()
+    assert state["memory"]["ram_budget"] == 1000
+    assert state["memory"]["outputs"]["1"]["ram"] == 10
+    assert state["memory"]["outputs"]["1"]["location"] == "cpu"
@@ -0,0 +1,211 @@
+import threading
+import time
+
+import pytest
+
+import nodes
+from comfy_execution.graph_utils import GraphBuilder
+from comfy_execution.utils import CurrentNodeContext, get_executing_context
+from execution import PromptExecutor
+
+
+class DummyServer:
+    def __init__(self):
+        self.client_id = None
+        self.last_node_id = None
+        self.messages = []
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data))
+
+    def bind_current_thread(self):
+        pass
+
+
+executed = []
+executed_lock = threading.Lock()
+
+
+def record(name):
+    with executed_lock:
+        executed.append(name)
+
+
+class Constant:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    EXECUTION_RESOURCE = "cpu"
+
+    def run(self, value):
+        record(f"constant {value}")
+        return (value,)
+
+
+class Rendezvous:
+    """Only completes when the other branch runs at the same time."""
+    barrier = None
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    EXECUTION_RESOURCE = "cpu"
+
+    def run(self, value):
+        Rendezvous.barrier.wait()
+        return (value,)
+
+
+class IoRendezvous(Rendezvous):
+    EXECUTION_RESOURCE = "io"
+
+
+class GpuWork:
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, value):
+        with GpuWork.lock:
+            GpuWork.active += 1
+            GpuWork.max_active = max(GpuWork.max_active, GpuWork.active)
+        time.sleep(0.05)
+        with GpuWork.lock:
+            GpuWork.active -= 1
+        return (value,)
+
+
+class Fail:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    EXECUTION_RESOURCE = "cpu"
+
+    def run(self, value):
+        raise ValueError("broken branch")
+
+
+class Sum:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"a": ("INT", {}), "b": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    EXECUTION_RESOURCE = "cpu"
+
+    def run(self, a, b):
+        record(f"sum {a + b}")
+        return (a + b,)
+
+
+class LazySwitch:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"use_a": ("BOOLEAN", {}), "a": ("INT", {"lazy": True}), "b": ("INT", {"lazy": True})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    EXECUTION_RESOURCE = "cpu"
+
+    def check_lazy_status(self, use_a, a=None, b=None):
+        if use_a:
+            return ["a"] if a is None else []
+        return ["b"] if b is None else []
+
+    def run(self, use_a, a=None, b=None):
+        record(f"switch {a if use_a else b}")
+        return (a if use_a else b,)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executed.clear()
+    GpuWork.active = 0
+    GpuWork.max_active = 0
+    for cls in (Constant, Rendezvous, IoRendezvous, GpuWork, Fail, Sum, LazySwitch):
+        monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, cls.__name__, cls)
+    return PromptExecutor(DummyServer(), parallel_workers=4)
+
+
+def node(class_type, **inputs):
+    return {"class_type": class_type, "inputs": inputs}
+
+
+def test_cpu_and_io_branches_run_concurrently(executor):
+    Rendezvous.barrier = threading.Barrier(2, timeout=10)
+    prompt = {
+        "1": node("Rendezvous", value=1),
+        "2": node("IoRendezvous", value=2),
+        "3": node("Sum", a=["1", 0], b=["2", 0]),
+    }
+    executor.execute(prompt, "p", {}, ["3"])
+    assert executor.success
+    assert executed == ["sum 3"]
+
+
+def test_one_gpu_node_at_a_time(executor):
+    prompt = {str(i): node("GpuWork", value=i) for i in range(4)}
+    executor.execute(prompt, "p", {}, list(prompt))
+    assert executor.success
+    assert GpuWork.max_active == 1
+
+
+def test_failure_stops_the_prompt(executor):
+    prompt = {
+        "1": node("Fail", value=1),
+        "2": node("Constant", value=2),
+        "3": node("Sum", a=["1", 0], b=["2", 0]),
+    }
+    executor.execute(prompt, "p", {}, ["3"])
+    assert not executor.success
+    events = [event for event, _ in executor.status_messages]
+    assert "execution_error" in events
+    assert "execution_success" not in events
+    assert not any(name.startswith("sum") for name in executed)
+
+
+def test_lazy_inputs_only_run_the_branch_that_is_needed(executor):
+    prompt = {
+        "1": node("Constant", value=1),
+        "2": node("Constant", value=2),
+        "3": node("LazySwitch", use_a=False, a=["1", 0], b=["2", 0]),
+    }
+    executor.execute(prompt, "p", {}, ["3"])
+    assert executor.success
+    assert executed == ["constant 2", "switch 2"]
+
+
+def test_subgraph_prefix_and_executing_node_are_per_thread():
+    results = {}
+    started = threading.Barrier(2, timeout=10)
+
+    def expand(node_id):
+        with CurrentNodeContext("p", node_id):
+            GraphBuilder.set_default_prefix(node_id, 0, 0)
+            started.wait()
+            results[node_id] = (GraphBuilder.alloc_prefix(), get_executing_context().node_id)
+
+    threads = [threading.Thread(target=expand, args=(node_id,)) for node_id in ("5", "7")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {"5": ("5.0.0.", "5"), "7": ("7.0.0.", "7")}
+    assert get_executing_context() is None
@@ -0,0 +1,136 @@
+import pytest
+
+import nodes
+from execution import execute_persistent_graph
+from node_state_manager import NodeStateManager
+
+
+class CountingConstant:
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, value):
+        CountingConstant.calls += 1
+        return (value,)
+
+
+class CountingAdd:
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"a": ("INT", {}), "b": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, a, b):
+        CountingAdd.calls += 1
+        return (a + b,)
+
+
+class ChangingSource:
+    calls = 0
+    version = 0
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    @classmethod
+    def IS_CHANGED(s, value):
+        return ChangingSource.version
+
+    def run(self, value):
+        ChangingSource.calls += 1
+        return (value + ChangingSource.version,)
+
+
+class RandomSource(CountingConstant):
+    NOT_IDEMPOTENT = True
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    CountingConstant.calls = 0
+    CountingAdd.calls = 0
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "CountingConstant", CountingConstant)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "CountingAdd", CountingAdd)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "ChangingSource", ChangingSource)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "RandomSource", RandomSource)
+    manager = NodeStateManager()
+    # Registered in reverse so the order has to come from the graph
+    manager.register_persistent_node("3", {"class_type": "CountingAdd", "inputs": {"a": ["1", 0], "b": ["2", 0]}})
+    manager.register_persistent_node("2", {"class_type": "CountingConstant", "inputs": {"value": 2}})
+    manager.register_persistent_node("1", {"class_type": "CountingConstant", "inputs": {"value": 1}})
+    return manager
+
+
+def test_upstream_nodes_run_in_dependency_order(manager):
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager)
+    assert error is None
+    assert result["executed"][-1] == "3"
+    assert sorted(result["executed"]) == ["1", "2", "3"]
+    assert result["outputs"]["3"] == (3,)
+
+
+def test_unchanged_outputs_are_reused(manager):
+    execute_persistent_graph(None, ["3"], {}, manager)
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager)
+    assert error is None
+    assert result["executed"] == []
+    assert result["reused"] == ["1", "2", "3"]
+    assert CountingConstant.calls == 2
+    assert CountingAdd.calls == 1
+
+
+def test_changed_input_reruns_downstream_only(manager):
+    execute_persistent_graph(None, ["3"], {}, manager)
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager, inputs={"2": {"value": 5}})
+    assert error is None
+    assert result["executed"] == ["2", "3"]
+    assert result["reused"] == ["1"]
+    assert result["outputs"]["3"] == (6,)
+
+
+def test_force_and_unregistered_nodes(manager):
+    execute_persistent_graph(None, None, {}, manager)
+    result, error, _ = execute_persistent_graph(None, None, {}, manager, force=True)
+    assert error is None
+    assert len(result["executed"]) == 3
+    result, error, failed = execute_persistent_graph(None, ["missing"], {}, manager)
+    assert result is None
+    assert failed == "missing"
+
+
+def test_is_changed_reruns_the_node_and_downstream(manager):
+    ChangingSource.calls = 0
+    ChangingSource.version = 0
+    manager.register_persistent_node("1", {"class_type": "ChangingSource", "inputs": {"value": 1}})
+    execute_persistent_graph(None, ["3"], {}, manager)
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager)
+    assert result["executed"] == []
+    ChangingSource.version = 10
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager)
+    assert error is None
+    assert result["executed"] == ["1", "3"]
+    assert result["outputs"]["3"] == (13,)
+    assert ChangingSource.calls == 2
+
+
+def test_not_idempotent_nodes_are_never_reused(manager):
+    manager.register_persistent_node("2", {"class_type": "RandomSource", "inputs": {"value": 2}})
+    execute_persistent_graph(None, ["3"], {}, manager)
+    result, error, _ = execute_persistent_graph(None, ["3"], {}, manager)
+    assert error is None
+    assert result["executed"] == ["2", "3"]
+    assert result["reused"] == ["1"]
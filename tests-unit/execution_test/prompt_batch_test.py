@@ -0,0 +1,46 @@
+from comfy_execution.prompt_batch import fusion_key, group_prompts, fuse_prompts, split_outputs
+
+
+def make_prompt(seed, batch_size=1, text="a cat", sampler_name="euler"):
+    return {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": batch_size}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["4", 1]}},
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "steps": 20, "sampler_name": sampler_name, "model": ["4", 0], "positive": ["6", 0], "negative": ["6", 0], "latent_image": ["5", 0]}},
+        "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI", "images": ["8", 0]}},
+    }
+
+
+def test_fusion_key_ignores_seed_and_batch_size():
+    assert fusion_key(make_prompt(1)) == fusion_key(make_prompt(2, batch_size=3))
+    assert fusion_key(make_prompt(1)) != fusion_key(make_prompt(1, text="a dog"))
+
+
+def test_unknown_nodes_are_not_fused():
+    prompt = make_prompt(1)
+    prompt["10"] = {"class_type": "SomeCustomNode", "inputs": {}}
+    assert fusion_key(prompt) is None
+
+
+def test_samplers_that_add_noise_are_not_fused():
+    assert fusion_key(make_prompt(1, sampler_name="euler_ancestral")) is None
+    assert fusion_key(make_prompt(1, sampler_name="dpmpp_2m_sde")) is None
+
+
+def test_group_prompts_respects_max_batch_size():
+    prompts = [make_prompt(i) for i in range(5)] + [make_prompt(9, text="other")]
+    assert group_prompts(prompts, max_batch_size=4) == [[0, 1, 2, 3], [4], [5]]
+
+
+def test_fuse_and_split():
+    fused, batch_sizes = fuse_prompts([make_prompt(7), make_prompt(8, batch_size=2)])
+    assert batch_sizes == [1, 2]
+    assert fused["5"]["inputs"]["batch_size"] == 3
+    assert fused["3"]["inputs"]["seed"] == [[7, 1], [8, 2]]
+
+    images = [{"filename": "a"}, {"filename": "b"}, {"filename": "c"}]
+    outputs = split_outputs({"9": {"images": images, "text": ["x"]}}, batch_sizes)
+    assert outputs[0]["9"]["images"] == [{"filename": "a"}]
+    assert outputs[1]["9"]["images"] == [{"filename": "b"}, {"filename": "c"}]
+    assert outputs[1]["9"]["text"] == ["x"]
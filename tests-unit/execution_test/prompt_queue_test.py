@@ -0,0 +1,93 @@
+from execution import PromptQueue, get_prompt_model_files
+
+
+class DummyServer:
+    def queue_updated(self):
+        pass
+
+
+def make_item(number, ckpt):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt}}}
+    return (number, f"prompt-{number}", prompt, {}, ["1"])
+
+
+def test_get_prompt_model_files():
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sdxl.safetensors"}},
+        "2": {"class_type": "KSampler", "inputs": {"sampler_name": "euler", "model": ["1", 0]}},
+        "3": {"class_type": "LoraLoader", "inputs": {"lora_name": "detail.safetensors", "strength_model": 1.0}},
+    }
+    assert get_prompt_model_files(prompt) == {"sdxl.safetensors", "detail.safetensors"}
+
+
+def test_get_without_affinity_is_fifo():
+    q = PromptQueue(DummyServer())
+    q.put(make_item(1, "a.safetensors"))
+    q.put(make_item(0, "b.safetensors"))
+    item, _ = q.get()
+    assert item[0] == 0
+
+
+def test_get_prefers_affinity():
+    q = PromptQueue(DummyServer())
+    q.put(make_item(0, "a.safetensors"))
+    q.put(make_item(1, "b.safetensors"))
+    q.put(make_item(2, "a.safetensors"))
+
+    def prefers_b(prompt):
+        return len(get_prompt_model_files(prompt) & {"b.safetensors"})
+
+    item, _ = q.get(affinity=prefers_b)
+    assert item[0] == 1
+    item, _ = q.get(affinity=prefers_b)
+    assert item[0] == 0
+
+
+def test_flags_reach_every_worker():
+    q = PromptQueue(DummyServer())
+    q.register_worker(0)
+    q.register_worker(1)
+    q.set_flag("free_memory", True)
+    assert q.get_flags(worker_id=0) == {"free_memory": True}
+    assert q.get_flags(worker_id=1) == {"free_memory": True}
+    assert q.get_flags(worker_id=0) == {}
+
+
+def test_expired_prompt_goes_to_history():
+    q = PromptQueue(DummyServer())
+    expired = make_item(0, "a.safetensors")
+    expired[3]["deadline"] = 1.0
+    q.put(expired)
+    q.put(make_item(1, "a.safetensors"))
+    item, _ = q.get()
+    assert item[0] == 1
+    status = q.get_history(prompt_id="prompt-0")["prompt-0"]["status"]
+    assert status["status_str"] == "expired"
+    assert not status["completed"]
+
+
+def test_cancel_by_prompt_id():
+    q = PromptQueue(DummyServer())
+    q.put(make_item(0, "a.safetensors"))
+    q.put(make_item(1, "a.safetensors"))
+    assert q.cancel("prompt-0")
+    assert q.get_queue_depths()["normal"] == 1
+    item, _ = q.get()
+    assert item[0] == 1
+
+
+def test_fused_members_get_the_whole_history_entry():
+    q = PromptQueue(DummyServer())
+    members = [{"number": i, "prompt_id": f"member-{i}", "prompt": {}, "extra_data": {}, "outputs_to_execute": ["1"], "batch_size": 1} for i in range(2)]
+    item = make_item(0, "a.safetensors")
+    item[3]["fused_prompts"] = members
+    q.put(item)
+    _, item_id = q.get()
+    images = [{"filename": "a"}, {"filename": "b"}]
+    q.task_done(item_id, {"outputs": {"9": {"images": images}}, "meta": {"9": {"node_id": "9"}}},
+                PromptQueue.ExecutionStatus("success", True, []))
+    entry = q.get_history(prompt_id="member-1")["member-1"]
+    assert entry["outputs"] == {"9": {"images": [{"filename": "b"}]}}
+    assert entry["meta"] == {"9": {"node_id": "9"}}
+    assert entry["status"]["status_str"] == "success"
+    assert entry["fused_into"] == "prompt-0"
@@ -0,0 +1,87 @@
+from comfy_execution.prompt_scheduler import PromptScheduler
+
+
+def make_item(number, client_id=None, priority=None, deadline=None, ckpt="a.safetensors"):
+    extra_data = {}
+    if client_id is not None:
+        extra_data["client_id"] = client_id
+    if priority is not None:
+        extra_data["priority"] = priority
+    if deadline is not None:
+        extra_data["deadline"] = deadline
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt}}}
+    return (number, f"prompt-{number}", prompt, extra_data, ["1"])
+
+
+def drain(scheduler, affinity=None):
+    out = []
+    while True:
+        item = scheduler.pop(affinity)
+        if item is None:
+            return out
+        out.append(item[0])
+
+
+def test_fifo_for_a_single_client():
+    s = PromptScheduler()
+    for n in (2, 0, 1):
+        s.push(make_item(n))
+    assert drain(s) == [0, 1, 2]
+
+
+def test_priority_classes():
+    s = PromptScheduler()
+    s.push(make_item(0, priority="batch"))
+    s.push(make_item(1))
+    s.push(make_item(2, priority="interactive"))
+    assert s.get_depths() == {"interactive": 1, "normal": 1, "batch": 1}
+    assert drain(s) == [2, 1, 0]
+
+
+def test_fair_share_between_clients():
+    s = PromptScheduler()
+    for n in range(4):
+        s.push(make_item(n, client_id="bulk"))
+    s.push(make_item(10, client_id="user"))
+    s.push(make_item(11, client_id="user"))
+    assert drain(s) == [0, 10, 1, 11, 2, 3]
+
+
+def test_front_skips_fair_share():
+    s = PromptScheduler()
+    s.push(make_item(0, client_id="a"))
+    s.push(make_item(1, client_id="b"))
+    s.push(make_item(-5, client_id="a"))
+    assert drain(s) == [-5, 0, 1]
+
+
+def test_cancel():
+    s = PromptScheduler()
+    for n in range(3):
+        s.push(make_item(n))
+    assert s.cancel("prompt-1")
+    assert not s.cancel("prompt-1")
+    assert len(s) == 2
+    assert [item[0] for item in s.items()] == [0, 2]
+    assert drain(s) == [0, 2]
+
+
+def test_expired_prompts_are_dropped():
+    s = PromptScheduler()
+    s.push(make_item(0, deadline=100.0))
+    s.push(make_item(1, deadline=300.0))
+    s.push(make_item(2))
+    expired = s.pop_expired(now=200.0)
+    assert [item[0] for item in expired] == [0]
+    assert drain(s) == [1, 2]
+
+
+def test_affinity_within_client():
+    s = PromptScheduler()
+    s.push(make_item(0, ckpt="a.safetensors"))
+    s.push(make_item(1, ckpt="b.safetensors"))
+
+    def prefers_b(prompt):
+        return 1 if prompt["1"]["inputs"]["ckpt_name"] == "b.safetensors" else 0
+
+    assert drain(s, prefers_b) == [1, 0]
@@ -0,0 +1,99 @@
+import os
+import tempfile
+
+import pytest
+
+import folder_paths
+from comfy_execution.schema_registry import SchemaRegistry
+
+
+@pytest.fixture
+def input_dir():
+    original = folder_paths.get_input_directory()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        folder_paths.set_input_directory(tmpdirname)
+        yield tmpdirname
+    folder_paths.set_input_directory(original)
+
+
+def make_node_class():
+    class ListingNode:
+        calls = 0
+
+        @classmethod
+        def INPUT_TYPES(s):
+            s.calls += 1
+            input_dir = folder_paths.get_input_directory()
+            return {"required": {"image": (sorted(os.listdir(input_dir)),), "strength": ("FLOAT",)}}
+    return ListingNode
+
+
+def touch(path):
+    open(path, "w").close()
+    # Make sure the directory mtime moves even on filesystems with coarse timestamps
+    stat = os.stat(os.path.dirname(path))
+    os.utime(os.path.dirname(path), (stat.st_atime, stat.st_mtime + 1))
+
+
+def test_schema_computed_once_per_generation(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    registry.check_filesystem()
+    for _ in range(10):
+        registry.get_input_types(node_class)
+    assert node_class.calls == 1
+    assert registry.get_stats()["hits"] == 9
+    assert registry.check_filesystem() is False
+    registry.get_input_types(node_class)
+    assert node_class.calls == 1
+
+
+def test_directory_change_invalidates(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    registry.check_filesystem()
+    assert registry.get_input_types(node_class)["required"]["image"][0] == []
+    generation = registry.generation
+
+    touch(os.path.join(input_dir, "example.png"))
+    assert registry.check_filesystem() is True
+    assert registry.generation == generation + 1
+    assert registry.get_input_types(node_class)["required"]["image"][0] == ["example.png"]
+    assert node_class.calls == 2
+
+
+def test_input_order(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    assert registry.get_input_order(node_class) == {"required": ["image", "strength"]}
+    assert node_class.calls == 1
+
+
+def test_explicit_invalidate(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    registry.get_input_types(node_class)
+    registry.invalidate(node_class)
+    registry.get_input_types(node_class)
+    assert node_class.calls == 2
+
+
+def test_callers_get_their_own_copy(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    registry.get_input_types(node_class)["required"]["image"][0].append("injected.png")
+    registry.get_input_order(node_class)["required"].append("injected")
+    assert registry.get_input_types(node_class)["required"]["image"][0] == []
+    assert registry.get_input_order(node_class) == {"required": ["image", "strength"]}
+    assert node_class.calls == 1
+
+
+def test_dynamic_input_types_are_not_cached(input_dir):
+    registry = SchemaRegistry()
+    node_class = make_node_class()
+    node_class.DYNAMIC_INPUT_TYPES = True
+    registry.get_input_types(node_class)
+    registry.get_input_types(node_class)
+    registry.get_input_order(node_class)
+    assert node_class.calls == 3
+    assert registry.get_stats()["schemas"] == 0
@@ -0,0 +1,177 @@
+import pytest
+
+import nodes
+from execution import execute_single_node
+from node_state_manager import NodeStateManager
+
+
+class Scale:
+    instances = 0
+    calls = 0
+
+    def __init__(self):
+        Scale.instances += 1
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {"value": ("INT", {})},
+            "optional": {"factor": ("INT", {})},
+            "hidden": {"unique_id": "UNIQUE_ID"},
+        }
+
+    RETURN_TYPES = ("INT", "STRING")
+    FUNCTION = "run"
+
+    def run(self, value, unique_id, factor=1):
+        Scale.calls += 1
+        return (value * factor, unique_id)
+
+
+class Total:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"values": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    INPUT_IS_LIST = True
+
+    def run(self, values):
+        return (sum(values),)
+
+
+class Volatile:
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("INT", {})}}
+
+    @classmethod
+    def IS_CHANGED(s, value):
+        return float("NaN")
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+    def run(self, value):
+        Volatile.calls += 1
+        return (value,)
+
+
+class Pair:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"number": ("INT", {}), "text": ("STRING", {})}}
+
+    RETURN_TYPES = ("STRING",)
+    FUNCTION = "run"
+
+    def run(self, number, text):
+        return (f"{text}:{number}",)
+
+
+class RemoteManager(NodeStateManager):
+    """Serves the outputs of the nodes registered on owner as if they ran on another rank."""
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+        self.fetched = []
+
+    def is_remote(self, node_id):
+        return node_id in self.owner.persistent_nodes
+
+    def get_output_slot(self, node_id, output_index=0):
+        if not self.is_remote(node_id):
+            return super().get_output_slot(node_id, output_index)
+        self.fetched.append((node_id, output_index))
+        return self.owner.get_output_slot(node_id, output_index)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    Scale.instances = 0
+    Scale.calls = 0
+    Volatile.calls = 0
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "Scale", Scale)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "Total", Total)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "Volatile", Volatile)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "Pair", Pair)
+    return NodeStateManager()
+
+
+def run(manager, node_id, node_data, **kwargs):
+    if node_id not in manager.persistent_nodes:
+        manager.register_persistent_node(node_id, node_data)
+    return execute_single_node(None, node_id, node_data, None, manager, **kwargs)
+
+
+def test_optional_and_hidden_inputs(manager):
+    outputs, error = run(manager, "1", {"class_type": "Scale", "inputs": {"value": 3}})
+    assert error is None
+    assert outputs == (3, "1")
+    outputs, error = run(manager, "2", {"class_type": "Scale", "inputs": {"value": 3, "factor": 4}})
+    assert outputs == (12, "2")
+
+
+def test_unchanged_inputs_skip_execution(manager):
+    node = {"class_type": "Scale", "inputs": {"value": 3}}
+    run(manager, "1", node)
+    outputs, error = run(manager, "1", node)
+    assert error is None
+    assert outputs == (3, "1")
+    assert Scale.calls == 1
+    # The instance is kept on the persistent entry
+    assert isinstance(manager.persistent_nodes["1"]["instance"], Scale)
+    run(manager, "1", {"class_type": "Scale", "inputs": {"value": 5}})
+    run(manager, "1", {"class_type": "Scale", "inputs": {"value": 5}}, force=True)
+    assert Scale.calls == 3
+    assert Scale.instances == 1
+
+
+def test_upstream_changes_are_detected(manager):
+    run(manager, "1", {"class_type": "Scale", "inputs": {"value": 2}})
+    node = {"class_type": "Scale", "inputs": {"value": ["1", 0], "factor": 10}}
+    assert run(manager, "2", node)[0] == (20, "2")
+    run(manager, "1", {"class_type": "Scale", "inputs": {"value": 3}})
+    assert run(manager, "2", node)[0] == (30, "2")
+
+
+def test_list_inputs_and_is_changed(manager):
+    manager.set_node_output("1", ([1, 2, 3],))
+    manager.register_persistent_node("1", {"class_type": "Scale", "inputs": {}})
+    manager.persistent_nodes["1"]["list_outputs"] = [True]
+    outputs, error = run(manager, "2", {"class_type": "Total", "inputs": {"values": ["1", 0]}})
+    assert error is None
+    assert outputs == (6,)
+    node = {"class_type": "Volatile", "inputs": {"value": 1}}
+    run(manager, "3", node)
+    run(manager, "3", node)
+    assert Volatile.calls == 2
+
+
+def test_missing_inputs(manager):
+    outputs, error = run(manager, "1", {"class_type": "Scale", "inputs": {}})
+    assert outputs is None
+    assert error == "Missing required input: value"
+    outputs, error = run(manager, "2", {"class_type": "Scale", "inputs": {"value": ["missing", 0]}})
+    assert error == "Referenced node output missing:0 not found"
+
+
+def test_several_slots_of_one_remote_node(manager):
+    run(manager, "1", {"class_type": "Scale", "inputs": {"value": 7}})
+    manager.register_persistent_node("2", {"class_type": "Scale", "inputs": {}})
+    manager.set_node_output("2", ([1, 2, 3],))
+    manager.persistent_nodes["2"]["list_outputs"] = [True]
+    local = RemoteManager(manager)
+    outputs, error = run(local, "3", {"class_type": "Pair", "inputs": {"number": ["1", 0], "text": ["1", 1]}})
+    assert error is None
+    assert outputs == ("1:7",)
+    assert sorted(local.fetched) == [("1", 0), ("1", 1)]
+    # List outputs of remote nodes reach the consumer as lists, like local ones
+    outputs, error = run(local, "4", {"class_type": "Total", "inputs": {"values": ["2", 0]}})
+    assert error is None
+    assert outputs == (6,)
+    outputs, error = run(local, "5", {"class_type": "Pair", "inputs": {"number": ["1", 0], "text": ["1", 3]}})
+    assert error == "Referenced node output 1:3 not found"
@@ -0,0 +1,92 @@
+import pytest
+import torch
+
+import nodes
+from comfy_execution.caching import SizeAwareCache, CacheKeySetInputSignature, measure_output_size
+from comfy_execution.graph import DynamicPrompt
+
+
+class DummyNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {}}
+
+
+class StaticIsChanged:
+    def get(self, node_id):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def dummy_nodes(monkeypatch):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "DummyNode", DummyNode)
+
+
+def make_prompt(*values):
+    return {str(i): {"class_type": "DummyNode", "inputs": {"value": v}} for i, v in enumerate(values)}
+
+
+def set_prompt(cache, prompt):
+    cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), StaticIsChanged())
+    cache.clean_unused()
+
+
+def test_measure_counts_shared_storage_once():
+    t = torch.zeros(256, dtype=torch.float32)
+    ram, vram = measure_output_size([[t, {"pooled_output": t[:10]}]])
+    assert ram == 1024
+    assert vram == 0
+
+
+def test_measure_latent_dict():
+    ram, _ = measure_output_size([{"samples": torch.zeros(4, 4, dtype=torch.float16)}])
+    assert ram == 32
+
+
+def test_storage_shared_between_entries_is_counted_once():
+    cache = SizeAwareCache(CacheKeySetInputSignature, ram_budget=3000)
+    set_prompt(cache, make_prompt(1, 2))
+    t = torch.zeros(256)
+    cache.set("0", [[t]])
+    # A node passing its input through keeps no extra memory alive
+    cache.set("1", [[t[:128], torch.zeros(64)]])
+    assert cache.get_stats()["ram_used"] == 1024 + 256
+    cache.clean_unused()
+    assert cache.get_stats()["ram_used"] == 1024 + 256
+    # The storage stays counted while another entry still holds it
+    cache._remove_entry(cache.cache_key_set.get_data_key("0"))
+    assert cache.get_stats()["ram_used"] == 1024 + 256
+    cache._remove_entry(cache.cache_key_set.get_data_key("1"))
+    assert cache.get_stats()["ram_used"] == 0
+
+
+def test_evicts_to_ram_budget():
+    cache = SizeAwareCache(CacheKeySetInputSignature, ram_budget=3000)
+    set_prompt(cache, make_prompt(1, 2))
+    cache.set("0", [[torch.zeros(256)]])
+    cache.set("1", [[torch.zeros(256)]])
+    assert cache.get_stats()["ram_used"] == 2048
+
+    # A new prompt that doesn't use the old entries pushes them out.
+    set_prompt(cache, make_prompt(3, 4))
+    cache.set("0", [[torch.zeros(256)]])
+    cache.set("1", [[torch.zeros(256)]])
+    stats = cache.get_stats()
+    assert stats["ram_used"] <= 3000
+    assert stats["evictions"] >= 1
+
+
+def test_prefers_evicting_cheap_entries():
+    cache = SizeAwareCache(CacheKeySetInputSignature, ram_budget=2500)
+    set_prompt(cache, make_prompt(1, 2))
+    cache.set("0", [[torch.zeros(256)]])
+    cache.record_execution_time("0", 10.0)
+    cache.set("1", [[torch.zeros(256)]])
+    cache.record_execution_time("1", 0.01)
+
+    set_prompt(cache, make_prompt(1, 2, 5))
+    set_prompt(cache, make_prompt(6))
+    cache.set("0", [[torch.zeros(256)]])
+    # The slow-to-recompute entry survives
+    set_prompt(cache, make_prompt(1))
+    assert cache.get("0") is not None
@@ -0,0 +1,94 @@
+import pytest
+
+import nodes
+from execution import ValidationCache
+
+
+class CountingSource:
+    validations = 0
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {
+            "seed": ("INT", {"default": 0, "min": 0, "max": 100}),
+            "sampler": (["euler", "ddim"],),
+            "strength": ("FLOAT", {}),
+        }}
+
+    @classmethod
+    def VALIDATE_INPUTS(s, strength):
+        s.validations += 1
+        return True
+
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+
+
+class DummyOutput:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"samples": ("LATENT",), "text": ("STRING", {})}}
+
+    RETURN_TYPES = ()
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+
+
+@pytest.fixture(autouse=True)
+def node_classes(monkeypatch):
+    CountingSource.validations = 0
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "CountingSource", CountingSource)
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "DummyOutput", DummyOutput)
+
+
+def make_prompt(seed="1", sampler="euler", text="a cat"):
+    return {
+        "1": {"class_type": "CountingSource", "inputs": {"seed": seed, "sampler": sampler, "strength": 1.0}},
+        "2": {"class_type": "DummyOutput", "inputs": {"samples": ["1", 0], "text": text}},
+    }
+
+
+def test_resubmission_is_a_hit():
+    cache = ValidationCache()
+    assert cache.validate(make_prompt())[0] is True
+    prompt = make_prompt()
+    result = cache.validate(prompt)
+    assert result[0] is True
+    assert result[2] == ["2"]
+    # Converted values are applied without validating again
+    assert prompt["1"]["inputs"]["seed"] == 1
+    assert CountingSource.validations == 1
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_changed_widget_is_revalidated():
+    cache = ValidationCache()
+    cache.validate(make_prompt(seed="1"))
+    prompt = make_prompt(seed="5", text="a dog")
+    assert cache.validate(prompt)[0] is True
+    assert prompt["1"]["inputs"]["seed"] == 5
+    assert CountingSource.validations == 2
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["revalidated_nodes"] == 2
+
+
+def test_invalid_change_falls_back_to_full_validation():
+    cache = ValidationCache()
+    cache.validate(make_prompt())
+    result = cache.validate(make_prompt(seed="500"))
+    assert result[0] is False
+    assert result[3]["1"]["errors"][0]["type"] == "value_bigger_than_max"
+    result = cache.validate(make_prompt(sampler="unknown"))
+    assert result[0] is False
+    assert result[3]["1"]["errors"][0]["type"] == "value_not_in_list"
+
+
+def test_structure_change_is_a_miss():
+    cache = ValidationCache()
+    cache.validate(make_prompt())
+    prompt = make_prompt()
+    prompt["3"] = {"class_type": "DummyOutput", "inputs": {"samples": ["1", 0], "text": "x"}}
+    assert cache.validate(prompt)[0] is True
+    assert cache.get_stats()["misses"] == 2
+    assert cache.get_stats()["entries"] == 2
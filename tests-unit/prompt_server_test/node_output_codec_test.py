@@ -0,0 +1,57 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from safetensors.torch import load
+
+from node_output_codec import BinaryPayload, UnsupportedOutput, encode_payload
+
+
+def test_safetensors_round_trip():
+    image = torch.rand((1, 8, 8, 3))
+    conditioning = [[torch.rand((1, 77, 16), dtype=torch.float16), {"pooled_output": torch.rand((1, 16))}]]
+    payload = encode_payload((image, conditioning), "safetensors")
+    data = payload.read()
+    assert len(data) == payload.length
+    tensors = load(data)
+    header_length = struct.unpack("<Q", data[:8])[0]
+    structure = json.loads(json.loads(data[8:8 + header_length])["__metadata__"]["structure"])
+    assert torch.equal(tensors[structure["__tuple__"][0]["__tensor__"]], image)
+    assert tensors["1"].dtype == torch.float16
+
+
+def test_npy_matches_numpy():
+    tensor = torch.arange(24, dtype=torch.int32).reshape(2, 3, 4)
+    array = np.load(io.BytesIO(encode_payload(tensor, "npy").read()))
+    assert array.shape == (2, 3, 4)
+    assert (array == tensor.numpy()).all()
+    # bfloat16 has no numpy equivalent
+    array = np.load(io.BytesIO(encode_payload(torch.ones(5, dtype=torch.bfloat16), "npy").read()))
+    assert array.dtype == np.float32
+
+
+def test_image_formats():
+    image = torch.zeros((2, 4, 6, 3))
+    image[1] = 1.0
+    decoded = Image.open(io.BytesIO(encode_payload(image, "png", batch_index=1).read()))
+    assert decoded.size == (6, 4)
+    assert decoded.getpixel((0, 0)) == (255, 255, 255)
+    assert encode_payload(image, "webp").content_type == "image/webp"
+    with pytest.raises(UnsupportedOutput):
+        encode_payload(image, "png", batch_index=2)
+
+
+def test_models_are_rejected():
+    with pytest.raises(UnsupportedOutput):
+        encode_payload((object(),), "safetensors")
+
+
+def test_ranges_span_segments():
+    payload = BinaryPayload([b"abc", b"", b"defgh"], "application/octet-stream", "bin")
+    assert payload.length == 8
+    assert payload.read(2, 5) == b"cde"
+    assert b"".join(bytes(c) for c in payload.iter_range(0, None, chunk_size=2)) == b"abcdefgh"
@@ -0,0 +1,68 @@
+import struct
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from app.preview_encoder import PreviewEncoder, encode_preview
+
+
+def frame(color=(255, 0, 0), size=64):
+    return ("JPEG", Image.new("RGB", (size, size), color), None)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_encode_preview_applies_format_and_size_policy():
+    message = encode_preview(("JPEG", Image.new("RGB", (256, 128)), 512), image_format="WEBP", quality=50, max_size=64)
+    assert struct.unpack(">I", message[:4])[0] == 3
+    with Image.open(BytesIO(message[4:])) as image:
+        assert image.format == "WEBP"
+        assert image.size == (64, 32)
+    message = encode_preview(("PNG", Image.new("RGBA", (16, 16)), None))
+    assert struct.unpack(">I", message[:4])[0] == 2
+
+
+def test_lagging_encoder_keeps_only_the_latest_frame():
+    release = threading.Event()
+    delivered = []
+
+    def deliver(message, sid):
+        release.wait(5)
+        delivered.append((message, sid))
+
+    encoder = PreviewEncoder(deliver, lambda sid: True, workers=1, max_fps=0)
+    for color in [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]:
+        assert encoder.submit(frame(color), "a")
+    release.set()
+    assert wait_until(lambda: len(delivered) == 2)
+    time.sleep(0.05)
+    assert len(delivered) == 2
+    with Image.open(BytesIO(delivered[-1][0][4:])) as image:
+        assert min(image.convert("RGB").getpixel((32, 32))) > 200
+    stats = encoder.get_stats()
+    assert stats["encoded"] == 2
+    assert stats["dropped"] == 2
+
+
+def test_rate_limit_and_subscribers():
+    delivered = []
+    subscribers = {"a"}
+    encoder = PreviewEncoder(lambda message, sid: delivered.append(sid), lambda sid: sid in subscribers, max_fps=1)
+    assert not encoder.wants_preview("b")
+    assert not encoder.submit(frame(), "b")
+    assert encoder.submit(frame(), "a")
+    assert not encoder.wants_preview("a")
+    assert not encoder.submit(frame(), "a")
+    assert wait_until(lambda: len(delivered) == 1)
+    stats = encoder.get_stats()
+    assert stats["no_subscribers"] == 2
+    assert stats["rate_limited"] == 2
@@ -0,0 +1,154 @@
+import asyncio
+import json
+
+import pytest
+
+from app.websocket_fanout import WebSocketFanout
+
+pytestmark = (
+    pytest.mark.asyncio
+)  # This applies the asyncio mark to all test functions in the module
+
+
+class FakeSocket:
+    def __init__(self, fail=False):
+        self.received = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.fail = fail
+        self.closed = False
+
+    async def send_str(self, data):
+        await self.gate.wait()
+        if self.fail:
+            raise ConnectionResetError("gone")
+        self.received.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        await self.gate.wait()
+        self.received.append(bytes(data))
+
+    async def close(self):
+        self.closed = True
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+
+async def test_slow_client_does_not_block_others():
+    fanout = WebSocketFanout()
+    slow = FakeSocket()
+    slow.gate.clear()
+    fast = FakeSocket()
+    fanout.add("slow", slow)
+    fanout.add("fast", fast)
+    for i in range(5):
+        fanout.publish_json("executed", {"node": str(i)})
+    await settle()
+    assert [m["data"]["node"] for m in fast.received] == ["0", "1", "2", "3", "4"]
+    assert slow.received == []
+    slow.gate.set()
+    await settle()
+    assert len(slow.received) == 5
+
+
+async def test_progress_is_coalesced_for_a_stalled_client():
+    fanout = WebSocketFanout()
+    ws = FakeSocket()
+    ws.gate.clear()
+    fanout.add("a", ws)
+    for value in range(20):
+        fanout.publish_json("progress", {"value": value, "max": 20, "prompt_id": "p", "node": "3"})
+    fanout.publish_json("executed", {"node": "3"})
+    fanout.publish_json("progress", {"value": 20, "max": 20, "prompt_id": "p", "node": "3"})
+    ws.gate.set()
+    await settle()
+    # The first progress message was already handed to the socket before it stalled
+    assert [m["type"] for m in ws.received][-2:] == ["executed", "progress"]
+    assert ws.received[-1]["data"]["value"] == 20
+    assert fanout.get_stats()["clients"]["a"]["coalesced"] >= 19
+
+
+async def test_full_queue_drops_droppable_messages_first():
+    fanout = WebSocketFanout(max_queue=3)
+    ws = FakeSocket()
+    ws.gate.clear()
+    fanout.add("a", ws)
+    fanout.publish_json("executing", {"node": "0"})
+    await settle()
+    fanout.publish_bytes(b"preview", key=("preview",))
+    fanout.publish_json("executed", {"node": "1"})
+    fanout.publish_json("executed", {"node": "2"})
+    fanout.publish_json("executed", {"node": "3"})
+    ws.gate.set()
+    await settle()
+    assert b"preview" not in ws.received
+    assert [m["data"]["node"] for m in ws.received] == ["0", "1", "2", "3"]
+    stats = fanout.get_stats()
+    assert stats["dropped"] == 1
+    fanout.remove("a")
+    assert fanout.get_stats()["connected"] == 0
+    assert fanout.get_stats()["sent"] == 4
+
+
+async def test_lagging_client_is_disconnected_instead_of_losing_state():
+    fanout = WebSocketFanout(max_queue=2)
+    slow = FakeSocket()
+    slow.gate.clear()
+    fanout.add("slow", slow)
+    fanout.publish_json("executing", {"node": "0"})
+    await settle()
+    fanout.publish_json("executed", {"node": "1"})
+    # Binary messages other than previews can't be dropped either
+    fanout.publish_bytes(b"output")
+    fanout.publish_json("executed", {"node": "2"})
+    slow.gate.set()
+    await settle()
+    assert slow.closed
+    assert [m["data"]["node"] for m in slow.received] == ["0"]
+    stats = fanout.get_stats()
+    assert stats["connected"] == 0
+    assert stats["disconnected"] == 1
+    assert stats["dropped"] == 0
+
+
+async def test_send_error_removes_the_client():
+    fanout = WebSocketFanout()
+    ws = FakeSocket(fail=True)
+    fanout.add("a", ws)
+    fanout.publish_json("executed", {"node": "1"})
+    fanout.publish_json("executed", {"node": "2"})
+    await settle()
+    assert ws.closed
+    stats = fanout.get_stats()
+    assert stats["connected"] == 0
+    assert stats["errors"] == 1
+
+
+async def test_targeted_messages():
+    fanout = WebSocketFanout()
+    a, b = FakeSocket(), FakeSocket()
+    fanout.add("a", a)
+    fanout.add("b", b)
+    fanout.publish_json("status", {"status": {}, "sid": "a"}, sid="a")
+    await settle()
+    assert len(a.received) == 1
+    assert b.received == []
+
+
+async def test_previews_skip_clients_that_opted_out():
+    fanout = WebSocketFanout()
+    a, b = FakeSocket(), FakeSocket()
+    fanout.add("a", a)
+    fanout.add("b", b, previews=False)
+    assert fanout.has_preview_subscribers()
+    assert not fanout.has_preview_subscribers("b")
+    fanout.publish_bytes(b"preview", key=("preview",))
+    fanout.publish_bytes(b"preview", key=("preview",), sid="b")
+    await settle()
+    assert a.received == [b"preview"]
+    assert b.received == []
+    fanout.remove("a")
+    assert not fanout.has_preview_subscribers()
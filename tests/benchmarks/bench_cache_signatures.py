@@ -0,0 +1,87 @@
+"""
+Times CacheKeySetInputSignature via set_prompt on synthetic graphs.
+
+Usage:
+    python -m tests.benchmarks.bench_cache_signatures [--sizes 100 1000 10000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+
+import nodes
+from comfy_execution.caching import HierarchicalCache, LRUCache, CacheKeySetInputSignature
+from comfy_execution.graph import DynamicPrompt
+from execution import IsChangedCache
+
+
+class BenchmarkPassthrough:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {"value": ("INT", {"default": 0})},
+            "optional": {"a": ("*",), "b": ("*",)},
+        }
+
+    RETURN_TYPES = ("*",)
+    FUNCTION = "run"
+
+    def run(self, value, a=None, b=None):
+        return (value,)
+
+
+def make_graph(size, fan_in=2, seed=0):
+    rng = random.Random(seed)
+    prompt = {}
+    for i in range(size):
+        inputs = {"value": rng.randint(0, 1 << 20)}
+        if i > 0:
+            for name in ("a", "b")[:fan_in]:
+                # Mostly link to recent nodes so the graph is deep as well as wide.
+                parent = max(0, i - 1 - int(rng.expovariate(0.1)))
+                inputs[name] = [str(parent), 0]
+        prompt[str(i)] = {"class_type": "BenchmarkPassthrough", "inputs": inputs}
+    return prompt
+
+
+def time_set_prompt(cache, prompt):
+    dynprompt = DynamicPrompt(prompt)
+    is_changed_cache = IsChangedCache(dynprompt, cache)
+    start = time.perf_counter()
+    cache.set_prompt(dynprompt, prompt.keys(), is_changed_cache)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    nodes.NODE_CLASS_MAPPINGS["BenchmarkPassthrough"] = BenchmarkPassthrough
+
+    print(f"{'nodes':>8} {'cold (ms)':>12} {'resubmit (ms)':>14} {'keys reused':>12}")
+    for size in options.sizes:
+        cold = []
+        warm = []
+        reused = 0
+        for r in range(options.repeat):
+            prompt = make_graph(size, seed=r)
+            cache = LRUCache(CacheKeySetInputSignature, max_size=size * 2)
+            cold.append(time_set_prompt(cache, prompt))
+            first_keys = set(cache.cache_key_set.get_used_keys())
+
+            # Change a single widget in the middle of the graph; only its descendants should get new keys.
+            changed = make_graph(size, seed=r)
+            changed[str(size // 2)]["inputs"]["value"] += 1
+            warm.append(time_set_prompt(cache, changed))
+            reused = len(first_keys.intersection(cache.cache_key_set.get_used_keys()))
+        print(f"{size:>8} {min(cold) * 1000:>12.2f} {min(warm) * 1000:>14.2f} {reused:>12}")
+
+    # The classic cache goes through the same key set; keep it in the report for comparison.
+    prompt = make_graph(options.sizes[-1])
+    elapsed = time_set_prompt(HierarchicalCache(CacheKeySetInputSignature), prompt)
+    print(f"HierarchicalCache, {options.sizes[-1]} nodes: {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
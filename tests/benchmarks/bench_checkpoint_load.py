@@ -0,0 +1,109 @@
+"""
+Compares loading a synthetic safetensors checkpoint into a preallocated fp16 model on the CPU:
+  safe_open  - safetensors.torch.load_file then load_state_dict (the old load_torch_file)
+  mmap       - comfy.utils.load_torch_file with --mmap-checkpoints then load_state_dict
+  streaming  - comfy.utils.load_torch_file then comfy.checkpoint_stream.load_state_dict_streaming
+Every path runs in a fresh process and reports MB/s of checkpoint data and the peak RSS above
+the RSS the process had before loading. The file is read from the page cache after the first
+run, so the numbers mostly show copies and memory use rather than disk speed.
+
+Usage:
+    python -m tests.benchmarks.bench_checkpoint_load [--size-mb 512] [--tensor-mb 16] [--chunk-mb 64] [--read-ahead 4]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import psutil
+import torch
+import safetensors.torch
+
+import comfy.utils
+import comfy.checkpoint_stream
+
+METHODS = ("safe_open", "mmap", "streaming")
+
+
+def tensor_shapes(size_mb, tensor_mb):
+    count = max(int(size_mb // tensor_mb), 1)
+    columns = 1024
+    rows = max(int(tensor_mb * 1024 * 1024 / 4 / columns), 1)
+    return {"blocks.{}.weight".format(i): (rows, columns) for i in range(count)}
+
+
+def make_checkpoint(path, shapes):
+    sd = {k: torch.randn(shape, dtype=torch.float32) for k, shape in shapes.items()}
+    safetensors.torch.save_file(sd, path)
+
+
+def make_model(shapes):
+    model = torch.nn.Module()
+    for k, shape in shapes.items():
+        name = k.split(".")[1]
+        block = torch.nn.Module()
+        block.weight = torch.nn.Parameter(torch.empty(shape, dtype=torch.float16), requires_grad=False)
+        model.add_module("blocks_" + name, block)
+    return model
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run(method, path, shapes, options, results):
+    comfy.utils.args.mmap_checkpoints = method != "safe_open"
+    model = make_model(shapes)
+    for p in model.parameters():
+        p.zero_()
+    baseline = psutil.Process().memory_info().rss
+    start = time.perf_counter()
+    if method == "safe_open":
+        sd = safetensors.torch.load_file(path)
+    else:
+        sd = comfy.utils.load_torch_file(path)
+    sd = {k.replace("blocks.", "blocks_"): v for k, v in sd.items()}
+    if method == "streaming":
+        missing, unexpected = comfy.checkpoint_stream.load_state_dict_streaming(model, sd, chunk_size=options.chunk_mb * 1024 * 1024, read_ahead=options.read_ahead)
+    else:
+        missing, unexpected = model.load_state_dict(sd, strict=False)
+    del sd
+    elapsed = time.perf_counter() - start
+    assert len(missing) == 0 and len(unexpected) == 0
+    assert all(p.abs().sum() > 0 for p in model.parameters())
+    results.put((method, elapsed, peak_rss() - baseline))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=512)
+    parser.add_argument("--tensor-mb", type=float, default=16)
+    parser.add_argument("--chunk-mb", type=int, default=64)
+    parser.add_argument("--read-ahead", type=int, default=4)
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=METHODS)
+    options = parser.parse_args()
+
+    shapes = tensor_shapes(options.size_mb, options.tensor_mb)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.safetensors")
+        make_checkpoint(path, shapes)
+        size = os.path.getsize(path)
+        print(f"checkpoint: {size / (1024 * 1024):.0f} MB fp32 in {len(shapes)} tensors, loaded into fp16 parameters")
+        print(f"{'method':>10} {'time (s)':>10} {'MB/s':>10} {'peak RSS (MB)':>14}")
+        for method in options.methods:
+            results = context.Queue()
+            process = context.Process(target=run, args=(method, path, shapes, options, results))
+            process.start()
+            method, elapsed, rss = results.get()
+            process.join()
+            print(f"{method:>10} {elapsed:>10.2f} {size / (1024 * 1024) / elapsed:>10.1f} {rss / (1024 * 1024):>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
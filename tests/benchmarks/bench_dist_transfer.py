@@ -0,0 +1,86 @@
+"""
+Compares the throughput of sending node outputs between two ranks with the pickle + ByteTensor(list(data))
+path DistributedNodeStateManager used before and with dist_utils.send_object / recv_object.
+Runs two processes on the gloo backend, so no GPU is needed.
+
+Usage:
+    python -m tests.benchmarks.bench_dist_transfer [--sizes-mb 1 16 64] [--repeat 3] [--skip-legacy-above-mb 64]
+"""
+import argparse
+import os
+import pickle
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from dist_utils import send_object, recv_object
+
+
+def legacy_send(obj, dst):
+    data = pickle.dumps(obj)
+    dist.send(torch.tensor([len(data)], dtype=torch.long), dst=dst)
+    dist.send(torch.ByteTensor(list(data)), dst=dst)
+
+
+def legacy_recv(src):
+    size = torch.zeros(1, dtype=torch.long)
+    dist.recv(size, src=src)
+    data = torch.zeros(size.item(), dtype=torch.uint8)
+    dist.recv(data, src=src)
+    return pickle.loads(data.numpy().tobytes())
+
+
+def make_output(size_mb):
+    # Shaped like an IMAGE batch plus a small conditioning-style structure
+    pixels = int(size_mb * 1024 * 1024 / 4 / 3)
+    side = max(int(pixels ** 0.5), 1)
+    images = torch.rand((1, side, side, 3), dtype=torch.float32)
+    cond = [[torch.rand((1, 77, 768)), {"pooled_output": torch.rand((1, 768))}]]
+    return {"output": (images, cond)}
+
+
+def run(rank, options):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(options.port)
+    dist.init_process_group("gloo", rank=rank, world_size=2)
+    results = []
+    for size_mb in options.sizes_mb:
+        obj = make_output(size_mb) if rank == 1 else None
+        nbytes = sum(t.numel() * t.element_size() for t in (obj["output"][0], obj["output"][1][0][0])) if obj is not None else 0
+        for name, send, recv in (("legacy", legacy_send, legacy_recv), ("send_object", send_object, lambda src: recv_object(src=src)[0])):
+            if name == "legacy" and size_mb > options.skip_legacy_above_mb:
+                continue
+            times = []
+            for _ in range(options.repeat):
+                dist.barrier()
+                start = time.perf_counter()
+                if rank == 1:
+                    send(obj, 0)
+                else:
+                    received = recv(1)
+                dist.barrier()
+                times.append(time.perf_counter() - start)
+            if rank == 0:
+                assert received["output"][0].dtype == torch.float32
+            results.append((size_mb, name, min(times), nbytes))
+    if rank == 1:
+        print(f"{'size (MB)':>10} {'path':>12} {'time (ms)':>12} {'MB/s':>10}")
+        for size_mb, name, elapsed, nbytes in results:
+            print(f"{size_mb:>10} {name:>12} {elapsed * 1000:>12.1f} {nbytes / (1024 * 1024) / elapsed:>10.1f}")
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy-above-mb", type=float, default=64, help="The legacy path builds a Python list with one int per byte and gets very slow for large outputs.")
+    parser.add_argument("--port", type=int, default=29533)
+    options = parser.parse_args()
+    mp.spawn(run, args=(options,), nprocs=2, join=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Replays a trace of model load requests against a fake device with a fixed amount of memory and
+compares the eviction policies in comfy.eviction. No GPU is needed.
+
+The default trace is synthetic: workflows drawn with a skewed popularity, each loading a
+checkpoint's text encoder, diffusion model and VAE plus sometimes a LoRA or an upscaler. A
+trace recorded elsewhere can be passed as a JSON list of {"model", "size", "source", "partial",
+"time"} requests.
+
+Usage:
+    python -m tests.benchmarks.bench_eviction_policy [--device-gb 12] [--prompts 500] [--trace trace.json]
+"""
+import argparse
+import json
+import random
+
+from comfy.eviction import POLICIES, simulate
+
+GB = 1024 * 1024 * 1024
+
+
+def synthetic_trace(prompts, seed=0):
+    rng = random.Random(seed)
+    checkpoints = [("sdxl_{}".format(i), 5.1, 1.6) for i in range(3)] + [("sd15_{}".format(i), 1.7, 0.25) for i in range(3)] + [("flux", 11.9, 9.1)]
+    weights = [1.0 / (rank + 1) for rank in range(len(checkpoints))]
+    trace = []
+    now = 0.0
+    for _ in range(prompts):
+        name, unet_gb, clip_gb = rng.choices(checkpoints, weights)[0]
+        # Checkpoints stay in RAM after unloading, standalone diffusion models are often dropped by the cache
+        source = "disk" if name == "flux" else "ram"
+        trace.append({"model": name + "_clip", "size": int(clip_gb * GB), "source": source, "partial": False, "time": now})
+        trace.append({"model": name + "_unet", "size": int(unet_gb * GB), "source": source, "partial": True, "time": now + 1})
+        trace.append({"model": name + "_vae", "size": int(0.16 * GB), "source": "ram", "partial": False, "time": now + 20})
+        if rng.random() < 0.3:
+            trace.append({"model": "upscaler", "size": int(0.07 * GB), "source": "ram", "partial": False, "time": now + 21})
+        now += rng.expovariate(1 / 30.0) + 25
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device-gb", type=float, default=12)
+    parser.add_argument("--prompts", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", type=str, default=None, help="JSON file with a list of load requests")
+    options = parser.parse_args()
+
+    if options.trace is not None:
+        with open(options.trace) as f:
+            trace = json.load(f)
+    else:
+        trace = synthetic_trace(options.prompts, options.seed)
+
+    print(f"{len(trace)} load requests on a {options.device_gb} GB device")
+    print(f"{'policy':>8} {'hits':>6} {'loaded (GB)':>12} {'load time (s)':>14} {'unloads':>8} {'partial':>8} {'lowvram':>8}")
+    for name, policy in POLICIES.items():
+        result = simulate(policy(), trace, int(options.device_gb * GB))
+        print(f"{name:>8} {result['hits']:>6} {result['bytes_loaded'] / GB:>12.1f} {result['load_seconds']:>14.1f} {result['unloads']:>8} {result['partial_unloads']:>8} {result['lowvram_loads']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Times execution.validate_prompt on a synthetic graph of loader-like nodes whose INPUT_TYPES list
+a model folder and the input directory, with and without the node schema registry.
+
+Usage:
+    python -m tests.benchmarks.bench_validate_prompt [--nodes 500] [--files 2000] [--repeat 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import folder_paths
+import nodes
+import execution
+from comfy_execution import schema_registry
+
+
+class BenchmarkLoader:
+    @classmethod
+    def INPUT_TYPES(s):
+        input_dir = folder_paths.get_input_directory()
+        images = [f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f))]
+        return {
+            "required": {
+                "model_name": (folder_paths.get_filename_list("benchmark_models"),),
+                "image": (sorted(images),),
+                "strength": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 10.0}),
+            },
+            "optional": {"previous": ("*",)},
+        }
+
+    RETURN_TYPES = ("*",)
+    FUNCTION = "run"
+
+
+class BenchmarkOutput:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"value": ("*",)}}
+
+    RETURN_TYPES = ()
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+
+
+def make_graph(size):
+    prompt = {}
+    for i in range(size - 1):
+        inputs = {"model_name": "model_{}.safetensors".format(i % 100), "image": "image_{}.png".format(i % 10), "strength": 0.5}
+        if i > 0:
+            inputs["previous"] = [str(i - 1), 0]
+        prompt[str(i)] = {"class_type": "BenchmarkLoader", "inputs": inputs}
+    prompt[str(size - 1)] = {"class_type": "BenchmarkOutput", "inputs": {"value": [str(size - 2), 0]}}
+    return prompt
+
+
+def time_validate(size, repeat):
+    times = []
+    for _ in range(repeat):
+        prompt = make_graph(size)
+        start = time.perf_counter()
+        valid = execution.validate_prompt(prompt)
+        times.append(time.perf_counter() - start)
+        assert valid[0], valid[1]
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        models_dir = os.path.join(temp_dir, "models")
+        input_dir = os.path.join(temp_dir, "input")
+        os.makedirs(models_dir)
+        os.makedirs(input_dir)
+        for i in range(options.files):
+            open(os.path.join(models_dir, "model_{}.safetensors".format(i)), "w").close()
+            if i < options.files // 10:
+                open(os.path.join(input_dir, "image_{}.png".format(i)), "w").close()
+        folder_paths.add_model_folder_path("benchmark_models", models_dir)
+        folder_paths.folder_names_and_paths["benchmark_models"][1].add(".safetensors")
+        folder_paths.set_input_directory(input_dir)
+        nodes.NODE_CLASS_MAPPINGS["BenchmarkLoader"] = BenchmarkLoader
+        nodes.NODE_CLASS_MAPPINGS["BenchmarkOutput"] = BenchmarkOutput
+
+        registry = schema_registry.registry
+        cached = time_validate(options.nodes, options.repeat)
+        stats = registry.get_stats()
+
+        # Previous behaviour: every lookup calls INPUT_TYPES() again.
+        registry.get_input_types = lambda class_def: class_def.INPUT_TYPES()
+        uncached = time_validate(options.nodes, options.repeat)
+        del registry.get_input_types
+
+    print(f"validate_prompt, {options.nodes} nodes, {options.files} model files")
+    print(f"{'INPUT_TYPES per lookup (ms)':>30} {uncached * 1000:>10.2f}")
+    print(f"{'schema registry (ms)':>30} {cached * 1000:>10.2f}")
+    print(f"registry: {stats}")
+
+
+if __name__ == "__main__":
+    main()